@@ -1,6 +1,6 @@
 import os
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -25,3 +25,40 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Mises à jour idempotentes des bases créées avec une version antérieure de
+# init.sql (create_all ne modifie pas les tables existantes)
+SCHEMA_UPGRADES = [
+    # trade_date NOT NULL (clé de la pagination) : les trades sans date prennent
+    # la plus ancienne date du portefeuille, comme le ledger les traitait
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'trades' AND column_name = 'trade_date' AND is_nullable = 'YES'
+        ) THEN
+            UPDATE trades t SET trade_date = COALESCE(
+                (SELECT LEAST(p.portfolio_date, MIN(o.trade_date))
+                 FROM portfolios p
+                 LEFT JOIN trades o ON o.portfolio_id = p.portfolio_id AND o.trade_date IS NOT NULL
+                 WHERE p.portfolio_id = t.portfolio_id
+                 GROUP BY p.portfolio_date),
+                NOW()
+            )
+            WHERE t.trade_date IS NULL;
+            ALTER TABLE trades ALTER COLUMN trade_date SET NOT NULL;
+        END IF;
+    END $$
+    """,
+    # compteur de révision du ledger (invalidation des caches de positions)
+    "ALTER TABLE portfolios ADD COLUMN IF NOT EXISTS ledger_revision INT NOT NULL DEFAULT 0",
+]
+
+
+def upgrade_schema(bind=engine):
+    """Applique SCHEMA_UPGRADES dans une transaction (sans effet sur une base à jour)."""
+    with bind.begin() as connection:
+        for statement in SCHEMA_UPGRADES:
+            connection.execute(text(statement))
@@ -6,13 +6,19 @@ from routers.portfolio_router import portfolio_router
 from routers.trade_router import trade_router
 from routers.ticker_router import ticker_router
 from routers.auth_router import auth_router
-from database import BaseSQL, engine
+from database import BaseSQL, engine, SessionLocal, upgrade_schema
+from services.nav_service import start_nav_scheduler
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Crée toutes les tables si elles n'existent pas
     BaseSQL.metadata.create_all(bind=engine)
+    upgrade_schema()
+    # Calcul quotidien des NAV (désactivable avec NAV_SCHEDULER_ENABLED=0)
+    nav_scheduler = start_nav_scheduler(SessionLocal)
     yield
+    if nav_scheduler is not None:
+        nav_scheduler.stop()
 
 app = FastAPI(
     title="Full Stack API",
@@ -1,3 +1,6 @@
 from .user_model import User
 from .trade_model import Trade
 from .portfolio_model import Portfolio
+from .holding_model import Holding
+from .nav_model import PortfolioNavDaily
+from .corporate_action_model import AppliedCorporateAction
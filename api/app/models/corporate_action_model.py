@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Date, DateTime, Float, Integer, String, ForeignKey
+
+from database import BaseSQL
+
+
+class AppliedCorporateAction(BaseSQL):
+    __tablename__ = "corporate_actions_applied"
+
+    # une opération n'est appliquée qu'une fois par portefeuille
+    portfolio_id = Column(Integer, ForeignKey("portfolios.portfolio_id", ondelete="CASCADE"), primary_key=True)
+    symbol = Column(String, primary_key=True)
+    ex_date = Column(Date, primary_key=True)
+    action_type = Column(String, primary_key=True)  # "SPLIT" ou "DIVIDEND"
+
+    value = Column(Float, nullable=False)   # ratio de division ou dividende par titre
+    quantity = Column(Float)                # titres détenus à la date d'effet
+    amount = Column(Float)                  # dividende crédité au cash
+    applied_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, String, Float, Integer, ForeignKey, UniqueConstraint, Index
+
+from database import BaseSQL
+from sqlalchemy.orm import relationship
+
+
+class Holding(BaseSQL):
+    __tablename__ = "holdings"
+
+    holding_id = Column(Integer, primary_key=True, autoincrement=True)
+    portfolio_id = Column(Integer, ForeignKey("portfolios.portfolio_id", ondelete="CASCADE"), nullable=False)
+
+    symbol = Column(String, nullable=False)                 # ex: "AAPL"
+    quantity = Column(Float, nullable=False, default=0)     # ex: 50
+    cost_basis = Column(Float, nullable=False, default=0)   # coût total des titres détenus
+
+    portfolio = relationship("Portfolio", back_populates="holdings")
+
+    __table_args__ = (
+        UniqueConstraint("portfolio_id", "symbol", name="uq_holdings_portfolio_symbol"),
+        Index("ix_holdings_symbol", "symbol"),
+    )
@@ -0,0 +1,18 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, JSON, String
+
+from database import BaseSQL
+
+
+class IdempotencyKey(BaseSQL):
+    __tablename__ = "idempotency_keys"
+
+    # clé fournie par le client (en-tête Idempotency-Key), propre à chaque utilisateur
+    user_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    key = Column(String(255), primary_key=True)
+
+    endpoint = Column(String, nullable=False)       # ex: "POST /trades/"
+    fingerprint = Column(String(64), nullable=False)  # sha256 du corps de la requête
+    response = Column(JSON)                         # réponse renvoyée aux rejeux
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
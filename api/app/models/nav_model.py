@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Date, Float, Integer, ForeignKey
+
+from database import BaseSQL
+
+
+class PortfolioNavDaily(BaseSQL):
+    __tablename__ = "portfolio_nav_daily"
+
+    # clé (portefeuille, date) : l'historique d'un portefeuille est un simple parcours d'index
+    portfolio_id = Column(Integer, ForeignKey("portfolios.portfolio_id", ondelete="CASCADE"), primary_key=True)
+    nav_date = Column(Date, primary_key=True)
+
+    positions_value = Column(Float, nullable=False)
+    cash_value = Column(Float, nullable=False)
+    nav = Column(Float, nullable=False)     # positions_value + cash_value à la clôture
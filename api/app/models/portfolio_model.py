@@ -8,16 +8,33 @@ class Portfolio(BaseSQL):
     __tablename__ = "portfolios"
 
     portfolio_id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(String, ForeignKey("users.user_id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False, index=True)
 
     last_amount = Column(Float, nullable=False)
     initial_amount = Column(Float, nullable=False)
-    positions = Column(String)          # ex: "AAPL,GOOGL,TSLA"
-    positions_size = Column(String)     # ex: "50,30,20"
     portfolio_name = Column(String)     # ex: "Tech Stocks"
     portfolio_date = Column(DateTime, default=datetime.utcnow)    # ex: "2024-06-15 10:30:00"
     cash_balance = Column(Float, nullable=False, default=0)
+    # Incrémenté quand des trades existants sont réécrits (divisions) : les ledgers en cache sont reconstruits
+    ledger_revision = Column(Integer, nullable=False, default=0)
     
     user = relationship("User", back_populates="portfolios")
     trades = relationship("Trade", back_populates="portfolio",cascade="all, delete-orphan")
+    holdings = relationship(
+        "Holding",
+        back_populates="portfolio",
+        cascade="all, delete-orphan",
+        lazy="selectin",
+        order_by="Holding.holding_id",
+    )
+
+    # Anciens champs texte, conservés en lecture seule pour les clients existants
+    @property
+    def positions(self) -> str:
+        return ",".join(h.symbol for h in self.holdings)    # ex: "AAPL,GOOGL,TSLA"
+
+    @property
+    def positions_size(self) -> str:
+        # précision de la colonne (6 décimales), sans zéros inutiles ni notation exponentielle
+        return ",".join(f"{h.quantity:.6f}".rstrip("0").rstrip(".") for h in self.holdings)    # ex: "50,30,20.5"
 
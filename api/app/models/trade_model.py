@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, Integer, DateTime, ForeignKey
+from sqlalchemy import Column, String, Float, Integer, DateTime, ForeignKey, Index
 from datetime import datetime
 
 from database import BaseSQL
@@ -9,13 +9,19 @@ class Trade(BaseSQL):
     __tablename__ = "trades"
 
     trade_id = Column(Integer, primary_key=True, autoincrement=True)
-    portfolio_id = Column(String, ForeignKey("portfolios.portfolio_id"), nullable=False)
+    portfolio_id = Column(Integer, ForeignKey("portfolios.portfolio_id"), nullable=False)
 
     asset_name = Column(String, nullable=False)
-    action = Column(String, nullable=False)  # "BUY" ou "SELL"
+    action = Column(String, nullable=False)  # "BUY", "SELL" ou "DIVIDEND" (opération sur titres)
     price = Column(Float, nullable=False)
-    quantity = Column(Integer, nullable=False)
-    trade_date = Column(DateTime, default=datetime.utcnow)
+    quantity = Column(Float, nullable=False)
+    trade_date = Column(DateTime, nullable=False, default=datetime.utcnow)  # clé de la pagination : jamais NULL
     description = Column(String)  # Optional description of the trade
 
     portfolio = relationship("Portfolio", back_populates="trades")
+
+    __table_args__ = (
+        # pagination par clé (trade_date, trade_id), par portefeuille et par titre
+        Index("ix_trades_portfolio_date", "portfolio_id", "trade_date", "trade_id"),
+        Index("ix_trades_portfolio_asset_date", "portfolio_id", "asset_name", "trade_date", "trade_id"),
+    )
@@ -1,4 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
 from sqlalchemy.orm import Session
 
 from models.user_model import User
@@ -7,7 +9,17 @@ from database import get_db
 from services.portfolio_service import (
     create_portfolio, get_portfolios_by_user, update_portfolio, delete_portfolio
 )
-from serializers.portfolio_serializer import PortfolioCreate, PortfolioRead, PortfolioUpdate, PortfolioBase
+from services.valuation_service import get_portfolio_valuation
+from services.nav_service import get_nav_history, get_nav_summary
+from services.analytics_service import get_portfolio_analytics
+from services.risk_service import get_portfolio_risk
+from services.projection_service import get_portfolio_projection
+from services.lots_service import get_portfolio_pnl, get_portfolio_lots
+from services.fx_service import validate_currency
+from services.corporate_actions import apply_user_portfolio_actions
+from services.rebalance_service import rebalance_portfolio, rebalance_user_portfolios
+from services.simulation_service import simulate_portfolio
+from serializers.portfolio_serializer import PortfolioCreate, PortfolioRead, PortfolioUpdate, PortfolioBase, PortfolioSummary, ProjectionRequest, RebalanceRequest, BatchRebalanceRequest, SimulationRequest
 
 portfolio_router = APIRouter(prefix="/portfolios", tags=["portfolios"])
 
@@ -15,10 +27,11 @@ portfolio_router = APIRouter(prefix="/portfolios", tags=["portfolios"])
 @portfolio_router.post("/", response_model=PortfolioRead)
 def create_portfolio_endpoint(
     portfolio: PortfolioCreate,
+    idempotency_key: str | None = Header(None, description="Clé unique : un rejeu renvoie le portefeuille déjà créé"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)  # récupère l'utilisateur connecté
 ):
-    return create_portfolio(db, portfolio, current_user)
+    return create_portfolio(db, portfolio, current_user, idempotency_key)
 
 @portfolio_router.get("/", response_model=list[PortfolioBase])
 def get_my_portfolios(
@@ -30,6 +43,29 @@ def get_my_portfolios(
     """
     return get_portfolios_by_user(db, current_user.user_id)
 
+@portfolio_router.get("/summary", response_model=list[PortfolioSummary])
+def get_my_portfolios_summary(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Dernière NAV de clôture de chaque portefeuille et variation sur la veille,
+    lues dans les snapshots journaliers.
+    """
+    return get_nav_summary(db, current_user.user_id)
+
+@portfolio_router.post("/rebalance")
+def rebalance_my_portfolios(
+    request: BatchRebalanceRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Rééquilibre tous les portefeuilles de l'utilisateur (ou `portfolio_ids`)
+    vers les mêmes poids cibles ; avec `execute`, tout est passé dans une seule transaction.
+    """
+    return rebalance_user_portfolios(db, current_user.user_id, request, request.portfolio_ids)
+
 @portfolio_router.get("/{portfolio_id}", response_model=list[PortfolioRead])
 def get_my_portfolios_id(portfolio_id: int,
     db: Session = Depends(get_db),
@@ -41,6 +77,184 @@ def get_my_portfolios_id(portfolio_id: int,
     """
     return get_portfolios_by_user(db, current_user.user_id, portfolio_id=portfolio_id)
 
+@portfolio_router.get("/{portfolio_id}/valuation")
+def get_portfolio_valuation_endpoint(
+    portfolio_id: int,
+    period: str = Query("1y", description="Période de l'historique, ex: 5d, 1mo, 1y, max"),
+    interval: str = Query("1d", description="Intervalle des données, ex: 1d, 1h"),
+    start: str | None = Query(None, description="Date de début, ex: 2024-01-01"),
+    currency: str | None = Query(None, description="Devise de conversion, ex: EUR, USD (par défaut celle du portefeuille)"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Évolution de la valeur du portefeuille (positions et cash) calculée côté serveur,
+    avec les positions réellement détenues à chaque date d'après l'historique des trades.
+    """
+    valuation = get_portfolio_valuation(
+        db, portfolio_id, current_user.user_id, period, interval, start, validate_currency(currency)
+    )
+    if valuation is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return valuation
+
+@portfolio_router.get("/{portfolio_id}/analytics")
+def get_portfolio_analytics_endpoint(
+    portfolio_id: int,
+    period: str = Query("1y", description="Fenêtre d'analyse, ex: 6mo, 1y, 10y, max"),
+    interval: str = Query("1d", description="Intervalle des données, ex: 1d, 1wk"),
+    start: str | None = Query(None, description="Date de début, ex: 2024-01-01"),
+    risk_free: float = Query(0.0, description="Taux sans risque annuel, ex: 0.03"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Rendements pondérés par le temps (TWR) et par les capitaux (IRR), volatilité,
+    Sharpe, Sortino et perte maximale de la poche investie, les trades étant
+    traités comme des flux.
+    """
+    analytics = get_portfolio_analytics(db, portfolio_id, current_user.user_id, period, interval, start, risk_free)
+    if analytics is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return analytics
+
+@portfolio_router.get("/{portfolio_id}/risk")
+def get_portfolio_risk_endpoint(
+    portfolio_id: int,
+    confidence: list[float] = Query([0.95, 0.99], description="Niveaux de confiance, ex: 0.95"),
+    horizon: int = Query(1, ge=1, le=252, description="Horizon en séances"),
+    period: str = Query("1y", description="Historique utilisé pour l'estimation, ex: 6mo, 1y, 5y"),
+    simulations: int = Query(20000, ge=1000, le=1_000_000, description="Nombre de chemins Monte Carlo"),
+    seed: int | None = Query(None, description="Graine des tirages Monte Carlo"),
+    currency: str | None = Query(None, description="Devise de conversion, ex: EUR, USD (par défaut celle du portefeuille)"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    VaR et CVaR (pertes en montant) des positions actuelles : historique,
+    variance-covariance et Monte Carlo.
+    """
+    risk = get_portfolio_risk(
+        db, portfolio_id, current_user.user_id, confidence, horizon, period, simulations, seed, validate_currency(currency)
+    )
+    if risk is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return risk
+
+@portfolio_router.post("/{portfolio_id}/projection")
+def project_portfolio_endpoint(
+    portfolio_id: int,
+    request: ProjectionRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Projection Monte Carlo (mouvement brownien géométrique corrélé) de la valeur
+    du portefeuille : bandes de percentiles à chaque pas, pas de chemins bruts.
+    """
+    projection = get_portfolio_projection(db, portfolio_id, current_user.user_id, request)
+    if projection is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return projection
+
+@portfolio_router.get("/{portfolio_id}/pnl")
+def get_portfolio_pnl_endpoint(
+    portfolio_id: int,
+    method: str = Query("fifo", description="Rapprochement des lots : fifo, lifo ou average"),
+    currency: str | None = Query(None, description="Devise de conversion, ex: EUR, USD (par défaut celle du portefeuille)"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Prix de revient, P&L réalisé et latent par position, les ventes étant
+    rapprochées des achats selon la méthode choisie.
+    """
+    pnl = get_portfolio_pnl(db, portfolio_id, current_user.user_id, method, validate_currency(currency))
+    if pnl is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return pnl
+
+@portfolio_router.get("/{portfolio_id}/pnl/lots")
+def get_portfolio_lots_endpoint(
+    portfolio_id: int,
+    method: str = Query("fifo", description="Rapprochement des lots : fifo, lifo ou average"),
+    symbol: str | None = Query(None, description="Filtrer sur un symbole, ex: AAPL"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Lots ouverts et lots clôturés (achat rapproché d'une vente, avec le gain réalisé).
+    """
+    lots = get_portfolio_lots(db, portfolio_id, current_user.user_id, method, symbol)
+    if lots is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return lots
+
+@portfolio_router.post("/{portfolio_id}/corporate-actions")
+def apply_portfolio_corporate_actions_endpoint(
+    portfolio_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Applique sans attendre le calcul quotidien les divisions et dividendes en
+    attente : trades et holdings ajustés, dividendes crédités au cash.
+    Renvoie les opérations appliquées.
+    """
+    applied = apply_user_portfolio_actions(db, portfolio_id, current_user.user_id)
+    if applied is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return applied
+
+@portfolio_router.post("/{portfolio_id}/rebalance")
+def rebalance_portfolio_endpoint(
+    portfolio_id: int,
+    request: RebalanceRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Ordres en titres entiers pour atteindre les poids cibles aux derniers cours
+    (le reste en cash) ; avec `execute`, ils sont passés dans une seule transaction.
+    """
+    plan = rebalance_portfolio(db, portfolio_id, current_user.user_id, request)
+    if plan is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return plan
+
+@portfolio_router.post("/{portfolio_id}/simulate")
+def simulate_portfolio_endpoint(
+    portfolio_id: int,
+    request: SimulationRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    État du portefeuille après des trades hypothétiques (cash, poids, P&L, VaR),
+    pour un ou plusieurs scénarios : rien n'est enregistré et les cours viennent
+    uniquement du cache ou du stockage local.
+    """
+    simulation = simulate_portfolio(db, portfolio_id, current_user.user_id, request)
+    if simulation is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return simulation
+
+@portfolio_router.get("/{portfolio_id}/history")
+def get_portfolio_history_endpoint(
+    portfolio_id: int,
+    start: date | None = Query(None, description="Date de début, ex: 2024-01-01"),
+    end: date | None = Query(None, description="Date de fin incluse"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Historique des NAV de clôture enregistrées par le calcul quotidien.
+    """
+    history = get_nav_history(db, portfolio_id, current_user.user_id, start, end)
+    if history is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return history
+
 @portfolio_router.put("/{portfolio_id}", response_model=PortfolioRead)
 def update_portfolio_endpoint(portfolio_id: int, portfolio_update: PortfolioUpdate, db: Session = Depends(get_db),current_user: User = Depends(get_current_user)):
     portfolio = update_portfolio(db, portfolio_id, portfolio_update, current_user.user_id)
@@ -1,12 +1,94 @@
-from fastapi import APIRouter, Query
-from services.ticker_service import get_tickers_data
+from typing import Literal
+
+import orjson
+from fastapi import APIRouter, Header, Query, Response
+from fastapi.responses import StreamingResponse
+from services.ticker_service import (
+    get_tickers_frames_or_404, get_quote, lookup_symbol, parse_symbols, frames_json, frames_cache,
+    iter_arrow_stream, frames_to_parquet, get_price_matrix, matrix_payload, matrix_to_arrow_stream,
+    matrix_to_parquet, ARROW_STREAM_MEDIA_TYPE, PARQUET_MEDIA_TYPE
+)
+from services.corporate_actions import get_actions, invalidate_actions
 ticker_router = APIRouter(prefix="/tickers", tags=["tickers"])
 
+@ticker_router.get("/cache/stats")
+def tickers_cache_stats():
+    """
+    Compteurs du cache mémoire des historiques (hits, misses, évictions...).
+    """
+    return frames_cache.stats()
+
+@ticker_router.get("/{ticker}/quote")
+def ticker_quote(ticker: str):
+    """
+    Dernier prix connu d'un ticker.
+    """
+    return get_quote(ticker)
+
+@ticker_router.get("/{ticker}/lookup")
+def ticker_lookup(ticker: str):
+    """
+    Vérifie qu'un ticker existe (404 sinon) et renvoie ses informations de base.
+    """
+    return lookup_symbol(ticker)
+
+@ticker_router.get("/{ticker}/actions")
+def ticker_actions(ticker: str, refresh: bool = Query(False, description="Relire la source au lieu du cache")):
+    """
+    Divisions et dividendes d'un ticker, par date d'effet.
+    """
+    if refresh:
+        invalidate_actions(ticker)
+    actions = get_actions(ticker)
+    return {
+        "symbol": ticker.strip().upper(),
+        "dates": [d.date().isoformat() for d in actions.index],
+        "dividends": actions["Dividends"].tolist(),
+        "splits": actions["Stock Splits"].tolist(),
+    }
+
+@ticker_router.get("/{ticker}/matrix")
+def tickers_matrix(
+    ticker: str,
+    period: str = Query("1y", description="Période de l'historique, ex: 5d, 1mo, 1y"),
+    interval: str = Query("1d", description="Intervalle des données, ex: 1d, 1h"),
+    start: str | None = Query(None, description="Date de début, ex: 2024-01-01"),
+    field: Literal["Open", "High", "Low", "Close", "Volume"] = Query("Close", description="Champ OHLCV à aligner"),
+    fill: Literal["ffill", "drop", "none"] = Query("ffill", description="ffill : dernière valeur connue, drop : dates communes uniquement, none : trous à null"),
+    fill_limit: int | None = Query(None, ge=1, description="Nombre maximal de lignes consécutives complétées (ffill)"),
+    accept: str | None = Header(None)
+):
+    """
+    Matrice dense (dates x tickers) sur un calendrier unifié : {"dates", "symbols", "values"}.
+    En Arrow IPC ou Parquet selon l'en-tête Accept (une colonne par ticker).
+    """
+    matrix = get_price_matrix(parse_symbols(ticker), period, interval, start, field, fill, fill_limit)
+    if accept and ARROW_STREAM_MEDIA_TYPE in accept:
+        return Response(content=matrix_to_arrow_stream(matrix), media_type=ARROW_STREAM_MEDIA_TYPE)
+    if accept and PARQUET_MEDIA_TYPE in accept:
+        return Response(content=matrix_to_parquet(matrix), media_type=PARQUET_MEDIA_TYPE)
+    return Response(content=orjson.dumps(matrix_payload(matrix)), media_type="application/json")
+
 @ticker_router.get("/{ticker}/")
 def tickers_read(
     ticker: str,
     period: str = Query("5d", description="Période de l'historique, ex: 5d, 1mo, 1y"),
     interval: str = Query("1d", description="Intervalle des données, ex: 1d, 1h"),
-    start: str | None = Query(None, description="Date de début, ex: 2024-01-01")
+    start: str | None = Query(None, description="Date de début, ex: 2024-01-01"),
+    format: Literal["records", "columnar"] = Query("records", description="records : une ligne par date, columnar : un tableau par colonne"),
+    max_points: int | None = Query(None, ge=3, description="Nombre maximal de points renvoyés par ticker"),
+    downsample: Literal["lttb", "ohlc"] = Query("lttb", description="lttb pour les courbes, ohlc pour les chandeliers"),
+    accept: str | None = Header(None)
 ):
-    return get_tickers_data(ticker, period, interval, start)
\ No newline at end of file
+    """
+    Historique des tickers en JSON, ou en binaire selon l'en-tête Accept :
+    - application/vnd.apache.arrow.stream : flux Arrow IPC, un RecordBatch par ticker
+    - application/vnd.apache.parquet : fichier Parquet
+    """
+    frames = get_tickers_frames_or_404(ticker, period, interval, start, max_points, downsample)
+    if accept and ARROW_STREAM_MEDIA_TYPE in accept:
+        return StreamingResponse(iter_arrow_stream(frames), media_type=ARROW_STREAM_MEDIA_TYPE)
+    if accept and PARQUET_MEDIA_TYPE in accept:
+        return Response(content=frames_to_parquet(frames), media_type=PARQUET_MEDIA_TYPE)
+    # JSON écrit directement à partir des colonnes (bien plus rapide que jsonable_encoder sur de gros historiques)
+    return Response(content=frames_json(frames, format), media_type="application/json")
@@ -1,32 +1,113 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from models.user_model import User
 from services.auth_service import get_current_user
 from database import get_db
 from services.trade_service import (
-    create_trade, get_trades, get_trades_by_portfolio
+    TRADES_PAGE_SIZE, create_trade, get_trades, get_trade_summary
 )
+from services.trade_export_service import export_media_type, iter_trades_export
+from services.trade_import_service import import_format, import_trades_stream
 from serializers.trade_serializer import TradeCreate, TradeRead
 
 trade_router = APIRouter(prefix="/trades", tags=["trades"])
 
 
 @trade_router.post("/", response_model=TradeRead)
-def create_trade_endpoint(trade: TradeCreate, db: Session = Depends(get_db),
+def create_trade_endpoint(trade: TradeCreate,
+                          idempotency_key: str | None = Header(None, description="Clé unique : un rejeu renvoie le trade déjà passé"),
+                          db: Session = Depends(get_db),
                           current_user: User = Depends(get_current_user)):
-    return create_trade(db, trade)
+    return create_trade(db, trade, current_user.user_id, idempotency_key)
 
 
-@trade_router.get("/", response_model=list[TradeRead])
-def read_trades(db: Session = Depends(get_db),
+@trade_router.post("/bulk")
+async def import_trades_endpoint(request: Request,
+    format: str | None = Query(None, description="csv ou ndjson (par défaut d'après le Content-Type)"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)):
+    """
+    Import d'un historique de trades envoyé en flux (CSV avec en-tête ou NDJSON) :
+    tout ou rien, dans une seule transaction. Les lignes sont validées pendant
+    la réception ; une erreur indique la ligne fautive.
+    """
+    format = import_format(format, request.headers.get("content-type"))
+    return await import_trades_stream(db, request.stream(), format, current_user.user_id)
+
+
+@trade_router.get("/export")
+def export_trades_endpoint(
+    format: str = Query("csv", description="csv ou ndjson"),
+    portfolio_id: int | None = Query(None, description="Limiter à un portefeuille"),
+    start: date | None = Query(None, description="Date de début, ex: 2024-01-01"),
+    end: date | None = Query(None, description="Date de fin incluse"),
+    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)):
+    """
+    Export en flux de tous les trades de l'utilisateur, par ordre chronologique.
+    """
+    media_type = export_media_type(format)
+    rows = iter_trades_export(db, current_user.user_id, format, portfolio_id, start, end)
+    return StreamingResponse(
+        rows, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="trades.{format}"'},
+    )
+
 
-    return get_trades(db,current_user.user_id)
+@trade_router.get("/summary")
+def trade_summary_endpoint(
+    group_by: str = Query("asset", description="asset, month ou portfolio"),
+    portfolio_id: int | None = Query(None, description="Limiter à un portefeuille"),
+    start: date | None = Query(None, description="Date de début, ex: 2024-01-01"),
+    end: date | None = Query(None, description="Date de fin incluse"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)):
+    """
+    Nombre de trades, volumes, prix moyens pondérés (VWAP) et quantité nette par
+    titre, mois ou portefeuille, agrégés par la base.
+    """
+    return get_trade_summary(db, current_user.user_id, group_by, portfolio_id, start, end)
+
+
+@trade_router.get("/", response_model=list[TradeRead])
+def read_trades(
+    response: Response,
+    asset: str | None = Query(None, description="Filtrer sur un symbole, ex: AAPL"),
+    action: str | None = Query(None, description="BUY, SELL ou DIVIDEND"),
+    start: date | None = Query(None, description="Date de début, ex: 2024-01-01"),
+    end: date | None = Query(None, description="Date de fin incluse"),
+    cursor: str | None = Query(None, description="Curseur X-Next-Cursor de la page précédente"),
+    limit: int = Query(TRADES_PAGE_SIZE, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)):
+    """
+    Trades de l'utilisateur, du plus récent au plus ancien ; la page suivante
+    s'obtient avec le curseur renvoyé dans l'en-tête X-Next-Cursor.
+    """
+    trades, next_cursor = get_trades(db, current_user.user_id, None, asset, action, start, end, cursor, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return trades
 
 
 @trade_router.get("/portfolio/{portfolio_id}", response_model=list[TradeRead])
-def read_trades_by_portfolio(portfolio_id: int,db: Session = Depends(get_db),
+def read_trades_by_portfolio(
+    portfolio_id: int,
+    response: Response,
+    asset: str | None = Query(None, description="Filtrer sur un symbole, ex: AAPL"),
+    action: str | None = Query(None, description="BUY, SELL ou DIVIDEND"),
+    start: date | None = Query(None, description="Date de début, ex: 2024-01-01"),
+    end: date | None = Query(None, description="Date de fin incluse"),
+    cursor: str | None = Query(None, description="Curseur X-Next-Cursor de la page précédente"),
+    limit: int = Query(TRADES_PAGE_SIZE, ge=1, le=1000),
+    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)):
 
-    return get_trades_by_portfolio(db,current_user.user_id, portfolio_id)
\ No newline at end of file
+    trades, next_cursor = get_trades(db, current_user.user_id, portfolio_id, asset, action, start, end, cursor, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return trades
@@ -1,12 +1,23 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
 import datetime
+class HoldingBase(BaseModel):
+    symbol: str              # Exemple : "AAPL"
+    quantity: float          # Exemple : 50
+    cost_basis: float | None = None    # Coût total des titres détenus
+
+class HoldingRead(HoldingBase):
+    cost_basis: float
+    class Config:
+        orm_mode = True
+
 class PortfolioBase(BaseModel):
     portfolio_id: Optional[int] = None
     last_amount: float
     initial_amount: float
-    positions: str           # Exemple : "AAPL,GOOGL,TSLA"
-    positions_size: str      # Exemple : "50,30,20"
+    positions: str = ""      # Exemple : "AAPL,GOOGL,TSLA" (ancien format, préférer holdings)
+    positions_size: str = "" # Exemple : "50,30,20"
+    holdings: List[HoldingBase] = []
     portfolio_name: str
     portfolio_date: Optional[datetime.datetime] = None
     cash_balance: float
@@ -16,6 +27,7 @@ class PortfolioCreate(PortfolioBase):
 class PortfolioRead(PortfolioBase):
     portfolio_id: int
     user_id: int
+    holdings: List[HoldingRead] = []
 
     class Config:
         orm_mode = True
@@ -25,5 +37,42 @@ class PortfolioUpdate(BaseModel):
     initial_amount: float | None = None
     positions: str | None = None
     positions_size: str | None = None
+    holdings: List[HoldingBase] | None = None
     portfolio_name: str | None = None
     cash_balance: float | None = None
+
+class PortfolioSummary(BaseModel):
+    portfolio_id: int
+    portfolio_name: str | None = None
+    nav_date: Optional[datetime.date] = None
+    nav: float | None = None
+    day_change: float | None = None
+    day_change_pct: float | None = None
+    total_return_pct: float | None = None
+
+class ProjectionRequest(BaseModel):
+    horizon_years: float = Field(5.0, gt=0, le=50)          # Exemple : 5 ans
+    steps_per_year: int = Field(12, ge=1, le=252)           # 12 = pas mensuel
+    paths: int = Field(10000, ge=100, le=200_000)
+    seed: Optional[int] = None
+    percentiles: List[float] = [5, 25, 50, 75, 95]
+    period: str = "5y"                                      # historique utilisé pour estimer dérive et volatilité
+
+class RebalanceRequest(BaseModel):
+    targets: Dict[str, float]       # Exemple : {"AAPL": 0.6, "GOOGL": 0.3}, le reste en cash
+    execute: bool = False           # True : ordres passés dans une seule transaction
+
+class BatchRebalanceRequest(RebalanceRequest):
+    portfolio_ids: Optional[List[int]] = None   # None : tous les portefeuilles de l'utilisateur
+
+class SimulatedTrade(BaseModel):
+    asset_name: str
+    action: str                     # "BUY" ou "SELL"
+    quantity: float = Field(..., gt=0)
+    price: float | None = Field(None, gt=0)    # None : dernier cours connu
+
+class SimulationRequest(BaseModel):
+    trades: List[SimulatedTrade] = []                           # un seul scénario
+    scenarios: Optional[List[List[SimulatedTrade]]] = None      # variantes évaluées ensemble
+    confidence: float = Field(0.95, gt=0, lt=1)                 # niveau de la VaR journalière
+    period: str = "1y"                                          # historique utilisé pour la volatilité
@@ -5,7 +5,7 @@ class TradeBase(BaseModel):
     asset_name: str
     action: str
     price: float
-    quantity: int
+    quantity: float  # fractionnaire après une division
     trade_date: datetime
     description: Optional[str] = None
 
@@ -0,0 +1,196 @@
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from services.cache import TTLCache
+from services.portfolio_service import get_portfolio, get_positions
+from services.positions_engine import get_ledger
+from services.valuation_service import valuation_series
+
+TRADING_DAYS = 252
+# Nombre de barres par an pour annualiser volatilité et ratios
+_PERIODS_PER_YEAR = {"1d": TRADING_DAYS, "5d": TRADING_DAYS / 5, "1wk": 52, "1mo": 12, "3mo": 4}
+_INTRADAY_RE = re.compile(r"^(\d+)(m|h)$")
+
+# Mémoïsation par (portefeuille, jour, version du ledger, positions, fenêtre) ;
+# le TTL borne le décalage avec la dernière barre intraday.
+ANALYTICS_TTL_SECONDS = 300
+analytics_cache = TTLCache(max_entries=int(os.environ.get("ANALYTICS_CACHE_MAX_ENTRIES", "512")))
+
+
+def periods_per_year(interval: str) -> float:
+    if interval in _PERIODS_PER_YEAR:
+        return _PERIODS_PER_YEAR[interval]
+    match = _INTRADAY_RE.match(interval)
+    if not match:
+        return TRADING_DAYS
+    minutes = int(match.group(1)) * (60 if match.group(2) == "h" else 1)
+    return TRADING_DAYS * 390 / minutes
+
+
+def sleeve_returns(values: np.ndarray, flows: np.ndarray) -> np.ndarray:
+    """
+    Rendements par barre de la poche investie, corrigés des flux des trades
+    (achats > 0, ventes < 0) : les achats sont comptés en début de barre,
+    les ventes en fin de barre.
+    r_t = (V_t - V_{t-1} - F_t) / (V_{t-1} + max(F_t, 0))
+    """
+    prev, f = values[:-1], flows[1:]
+    gain = values[1:] - prev - f
+    base = prev + np.maximum(f, 0)
+    return np.divide(gain, base, out=np.zeros_like(gain), where=base > 0)
+
+
+def max_drawdown(returns: np.ndarray) -> tuple[float, int, int]:
+    """Plus forte baisse de l'indice de richesse (1 + r cumulé) : (baisse, indice du pic, indice du creux)."""
+    wealth = np.concatenate(([1.0], np.cumprod(1 + returns)))
+    drawdowns = wealth / np.maximum.accumulate(wealth) - 1
+    trough = int(np.argmin(drawdowns))
+    peak = int(np.argmax(wealth[: trough + 1]))
+    return float(drawdowns[trough]), peak, trough
+
+
+def irr(years: np.ndarray, flows: np.ndarray) -> float | None:
+    """
+    Taux annuel r tel que sum(flows / (1 + r) ** years) = 0 (flux vus de
+    l'investisseur). Newton vectorisé sur les flux, repli par dichotomie.
+    None si les flux ne changent pas de signe.
+    """
+    if not (flows > 0).any() or not (flows < 0).any():
+        return None
+
+    def npv(rate):
+        return np.sum(flows * (1 + rate) ** -years)
+
+    rate = 0.1
+    for _ in range(50):
+        discount = (1 + rate) ** -years
+        value = np.sum(flows * discount)
+        slope = np.sum(-years * flows * discount / (1 + rate))
+        if slope == 0:
+            break
+        step = value / slope
+        rate -= step
+        if rate <= -1 or not np.isfinite(rate):
+            break
+        if abs(step) < 1e-10:
+            return float(rate)
+
+    lo, hi = -0.9999, 1.0
+    while npv(hi) > 0 and hi < 1e6:
+        hi *= 10
+    if np.sign(npv(lo)) == np.sign(npv(hi)):
+        return None
+    for _ in range(200):
+        mid = (lo + hi) / 2
+        if np.sign(npv(mid)) == np.sign(npv(lo)):
+            lo = mid
+        else:
+            hi = mid
+    return float((lo + hi) / 2)
+
+
+def _round(value: float | None, digits: int = 6) -> float | None:
+    if value is None or not np.isfinite(value):
+        return None
+    return round(float(value), digits)
+
+
+def compute_analytics(dates, positions_value: np.ndarray, cash_value: np.ndarray,
+                      interval: str = "1d", risk_free: float = 0.0) -> dict:
+    """
+    Indicateurs de performance de la poche investie (positions), les trades
+    étant traités comme des apports / retraits :
+    - TWR : produit des rendements par barre corrigés des flux ;
+    - IRR : taux de rendement interne des flux (valeur initiale, trades, valeur finale) ;
+    - volatilité, Sharpe et Sortino annualisés, perte maximale.
+    """
+    result = {
+        "start": dates[0].isoformat() if len(dates) else None,
+        "end": dates[-1].isoformat() if len(dates) else None,
+        "observations": int(len(dates)),
+        "total_return": None,
+        "twr": None,
+        "twr_annualized": None,
+        "irr": None,
+        "volatility": None,
+        "sharpe": None,
+        "sortino": None,
+        "max_drawdown": None,
+        "drawdown_peak": None,
+        "drawdown_trough": None,
+    }
+    if len(dates) < 2:
+        return result
+
+    nav = positions_value + cash_value
+    if nav[0] > 0:
+        result["total_return"] = _round(nav[-1] / nav[0] - 1)
+
+    # le cash ne varie qu'avec les trades : sa baisse est un achat de titres
+    flows = np.concatenate(([0.0], -np.diff(cash_value)))
+    returns = sleeve_returns(positions_value, flows)
+    years = (dates - dates[0]).total_seconds().to_numpy() / (365.25 * 86400)
+
+    twr = np.prod(1 + returns) - 1
+    result["twr"] = _round(twr)
+    if years[-1] > 0 and twr > -1:
+        result["twr_annualized"] = _round((1 + twr) ** (1 / years[-1]) - 1)
+
+    investor_flows = -flows
+    investor_flows[0] -= positions_value[0]
+    investor_flows[-1] += positions_value[-1]
+    result["irr"] = _round(irr(years, investor_flows))
+
+    if len(returns) >= 2:
+        n = periods_per_year(interval)
+        excess = returns - risk_free / n
+        std = returns.std(ddof=1)
+        downside = np.sqrt(np.mean(np.minimum(excess, 0) ** 2))
+        result["volatility"] = _round(std * np.sqrt(n))
+        result["sharpe"] = _round(excess.mean() / std * np.sqrt(n)) if std > 0 else None
+        result["sortino"] = _round(excess.mean() / downside * np.sqrt(n)) if downside > 0 else None
+
+    drawdown, peak, trough = max_drawdown(returns)
+    result["max_drawdown"] = _round(drawdown)
+    result["drawdown_peak"] = dates[peak].isoformat()
+    result["drawdown_trough"] = dates[trough].isoformat()
+    return result
+
+
+def get_portfolio_analytics(
+    db: Session,
+    portfolio_id: int,
+    user_id: int,
+    period: str = "1y",
+    interval: str = "1d",
+    start: str | None = None,
+    risk_free: float = 0.0,
+):
+    """
+    Indicateurs de performance sur la fenêtre demandée, mémoïsés tant que le
+    ledger, les positions et le jour ne changent pas.
+    Retourne None si le portefeuille n'appartient pas à l'utilisateur.
+    """
+    portfolio = get_portfolio(db, portfolio_id, user_id)
+    if not portfolio:
+        return None
+    ledger = get_ledger(db, portfolio_id)
+    key = (
+        portfolio_id,
+        datetime.utcnow().date(),
+        ledger.version,
+        tuple(sorted(get_positions(portfolio).items())),
+        float(portfolio.cash_balance or 0),
+        period, interval, start, risk_free,
+    )
+
+    def load():
+        _, dates, positions_value, cash_value, missing = valuation_series(db, portfolio, period, interval, start, ledger)
+        analytics = compute_analytics(dates, positions_value, cash_value, interval, risk_free)
+        return {"portfolio_id": portfolio_id, **analytics, "missing": missing}
+
+    return analytics_cache.get_or_load(key, load, ANALYTICS_TTL_SECONDS)
@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    """Chargement en cours pour une clé : les requêtes identiques attendent son résultat."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    Cache mémoire borné (LRU) avec expiration par entrée.
+    Les manqués simultanés sur la même clé ne déclenchent qu'un seul chargement
+    (single-flight) : les autres appels attendent et reçoivent le même résultat.
+    La taille est bornée en nombre d'entrées et, si `weigher` est fourni, en octets.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int | None = None, weigher=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.weigher = weigher
+        self._data: OrderedDict = OrderedDict()  # clé -> (expiration, valeur, poids)
+        self._inflight: dict = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_or_load(self, key, loader, ttl: float):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._remove(key)
+                self.expirations += 1
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self.set(key, flight.value, ttl)
+            return flight.value
+        except BaseException as e:
+            # les erreurs ne sont pas mises en cache, seulement transmises aux appels en attente
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def set(self, key, value, ttl: float):
+        weight = self.weigher(value) if self.weigher else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + ttl, value, weight)
+            self._bytes += weight
+            while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self._bytes > self.max_bytes and len(self._data) > 1
+            ):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def get(self, key):
+        """Valeur en cache sans chargement (None si absente ou expirée)."""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry[1] if entry is not None and entry[0] > time.monotonic() else None
+
+    def invalidate(self, key):
+        """Retire une entrée (sans effet si elle est absente)."""
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def invalidate_matching(self, predicate) -> int:
+        """Retire les entrées dont la clé vérifie `predicate` ; retourne leur nombre."""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, _, weight = self._data.pop(key)
+        self._bytes -= weight
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else None,
+            }
@@ -0,0 +1,240 @@
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from models.corporate_action_model import AppliedCorporateAction
+from models.portfolio_model import Portfolio
+from models.trade_model import Trade
+from services import price_store
+from services.cache import TTLCache
+from services.lots_service import refresh_symbols
+from services.market_data import ACTION_COLUMNS, get_provider
+from services.portfolio_service import get_holding, get_portfolio, invalidate_nav
+from services.positions_engine import LEDGER_TTL_SECONDS, ledgers, split_factors
+from services.ticker_service import invalidate_symbol
+
+logger = logging.getLogger(__name__)
+
+# Les opérations sur titres sont relues à la source au plus une fois par jour
+ACTIONS_REFRESH_SECONDS = int(os.environ.get("CORPORATE_ACTIONS_REFRESH", str(24 * 3600)))
+actions_cache = TTLCache(max_entries=int(os.environ.get("ACTIONS_CACHE_MAX_ENTRIES", "4096")))
+# Sous-dossier de price_store : les opérations sont stockées à côté des prix
+_STORE_INTERVAL = "actions"
+_QTY_EPSILON = 1e-9
+
+
+def _normalize(df: pd.DataFrame | None) -> pd.DataFrame:
+    """Dates d'effet naïves (date locale de la place), lignes sans opération retirées."""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=ACTION_COLUMNS, index=pd.DatetimeIndex([], name="Date"), dtype=np.float64)
+    index = df.index.tz_localize(None) if df.index.tz is not None else df.index
+    df = df.reindex(columns=ACTION_COLUMNS).astype(np.float64).fillna(0.0)
+    df.index = pd.DatetimeIndex(index, name="Date").normalize()
+    df = df[(df != 0).any(axis=1)]
+    return df[~df.index.duplicated(keep="last")].sort_index()
+
+
+def _load_actions(symbol: str) -> pd.DataFrame:
+    stored, meta = price_store.read(symbol, _STORE_INTERVAL)
+    if stored is not None and datetime.utcnow() - datetime.fromisoformat(meta["fetched_at"]) < timedelta(seconds=ACTIONS_REFRESH_SECONDS):
+        return stored
+    try:
+        df = _normalize(get_provider().actions(symbol))
+    except Exception as e:
+        logger.warning("Opérations sur titres indisponibles pour %s (%s)", symbol, e)
+        return stored if stored is not None else _normalize(None)
+    price_store.write(symbol, _STORE_INTERVAL, df, None)
+    return df
+
+
+def get_actions(symbol: str) -> pd.DataFrame:
+    """
+    Dividendes par titre et ratios de division d'un symbole, indexés par date
+    d'effet. Stockés sur disque avec les prix et gardés en mémoire.
+    """
+    symbol = symbol.strip().upper()
+    return actions_cache.get_or_load(symbol, lambda: _load_actions(symbol), ACTIONS_REFRESH_SECONDS)
+
+
+def invalidate_actions(symbol: str):
+    """Force la relecture des opérations d'un seul symbole."""
+    symbol = symbol.strip().upper()
+    actions_cache.invalidate(symbol)
+    price_store.delete(symbol, _STORE_INTERVAL)
+
+
+def _split_ratios(events: pd.DataFrame) -> pd.Series:
+    ratios = events["Stock Splits"]
+    return ratios[(ratios > 0) & (ratios != 1)]
+
+
+def _apply_symbol(db: Session, portfolio: Portfolio, symbol: str, events: pd.DataFrame) -> list[dict]:
+    """
+    Applique les opérations en attente d'un symbole en une passe vectorisée :
+    - divisions : quantités des trades antérieurs multipliées, prix divisés
+      (montants inchangés), ligne holdings recalculée ;
+    - dividendes : titres détenus à la date d'effet (en unités après division)
+      multipliés par le dividende, crédités au cash et enregistrés comme trades DIVIDEND.
+      Les cours utilisés pour la valorisation ne sont donc ajustés que des divisions.
+    """
+    rows = db.query(Trade.trade_id, Trade.trade_date, Trade.action, Trade.quantity, Trade.price).filter(
+        Trade.portfolio_id == portfolio.portfolio_id, Trade.asset_name == symbol
+    ).all()
+    trades = pd.DataFrame(rows, columns=["trade_id", "trade_date", "action", "quantity", "price"])
+    times = pd.to_datetime(trades["trade_date"]).to_numpy("datetime64[ns]")
+    actions = trades["action"].str.upper().to_numpy()
+    raw_quantities = trades["quantity"].to_numpy(dtype=np.float64)
+    signed = np.where(actions == "DIVIDEND", 0.0, np.where(actions == "SELL", -1.0, 1.0) * raw_quantities)
+    holding = get_holding(portfolio, symbol)
+    current = holding.quantity if holding is not None else 0.0
+    base = current - signed.sum()
+
+    splits = _split_ratios(events)
+    ex_dates = splits.index.to_numpy("datetime64[ns]")
+    ratios = splits.to_numpy(dtype=np.float64)
+    factors = split_factors(times, ex_dates, ratios)
+    total = float(np.prod(ratios))
+    applied = []
+
+    if len(splits):
+        changed = factors != 1
+        if changed.any():
+            db.execute(update(Trade), [
+                {"trade_id": int(i), "quantity": float(q), "price": float(p)}
+                for i, q, p in zip(
+                    trades["trade_id"].to_numpy()[changed],
+                    raw_quantities[changed] * factors[changed],
+                    trades["price"].to_numpy(dtype=np.float64)[changed] / factors[changed],
+                )
+            ])
+        if holding is not None:
+            holding.quantity = float(base * total + (signed * factors).sum())
+        applied += [
+            {"symbol": symbol, "ex_date": d.date(), "action_type": "SPLIT", "value": float(r), "quantity": None, "amount": None}
+            for d, r in splits.items()
+        ]
+
+    dividends = events[events["Dividends"] > 0]["Dividends"]
+    if len(dividends):
+        order = np.argsort(times, kind="stable")
+        held = np.concatenate(([0.0], np.cumsum((signed * factors)[order])))
+        k = np.searchsorted(times[order], dividends.index.to_numpy("datetime64[ns]"), side="left")
+        shares = np.maximum(base * total + held[k], 0.0)
+        for (ex_date, dividend), quantity in zip(dividends.items(), shares):
+            amount = round(float(quantity * dividend), 2)
+            if quantity > _QTY_EPSILON:
+                portfolio.cash_balance = float(portfolio.cash_balance) + amount
+                db.add(Trade(
+                    portfolio_id=portfolio.portfolio_id,
+                    asset_name=symbol,
+                    action="DIVIDEND",
+                    price=float(dividend),
+                    quantity=float(quantity),
+                    trade_date=ex_date.to_pydatetime(),
+                    description=f"Dividende de {dividend:g} par titre",
+                ))
+            applied.append({
+                "symbol": symbol, "ex_date": ex_date.date(), "action_type": "DIVIDEND",
+                "value": float(dividend), "quantity": round(float(quantity), 6), "amount": amount,
+            })
+    return applied
+
+
+def apply_portfolio_actions(db: Session, portfolio_id: int, as_of: date | None = None) -> list[dict]:
+    """
+    Applique aux trades, holdings et cash d'un portefeuille les divisions et
+    dividendes pas encore appliqués, jusqu'à `as_of` inclus, en une transaction.
+    Seuls les symboles concernés sont recalculés dans les caches (ledger, lots) ;
+    une division incrémente Portfolio.ledger_revision pour les autres processus.
+    """
+    as_of = pd.Timestamp(as_of or datetime.utcnow().date())
+    try:
+        portfolio = db.query(Portfolio).filter(Portfolio.portfolio_id == portfolio_id).with_for_update().first()
+        if portfolio is None:
+            return []
+        first_trades = dict(
+            db.query(Trade.asset_name, func.min(Trade.trade_date))
+            .filter(Trade.portfolio_id == portfolio_id)
+            .group_by(Trade.asset_name).all()
+        )
+        done = set(
+            db.query(AppliedCorporateAction.symbol, AppliedCorporateAction.ex_date, AppliedCorporateAction.action_type)
+            .filter(AppliedCorporateAction.portfolio_id == portfolio_id).all()
+        )
+        created = pd.Timestamp(portfolio.portfolio_date or as_of).normalize()
+
+        applied, splits = [], {}
+        for symbol in sorted({h.symbol for h in portfolio.holdings} | set(first_trades)):
+            since = created
+            if first_trades.get(symbol) is not None:
+                since = min(since, pd.Timestamp(first_trades[symbol]).normalize())
+            events = get_actions(symbol)
+            events = events[(events.index > since) & (events.index <= as_of)].copy()
+            # une opération déjà appliquée n'est jamais rejouée
+            events.loc[[(symbol, d.date(), "SPLIT") in done for d in events.index], "Stock Splits"] = 0.0
+            events.loc[[(symbol, d.date(), "DIVIDEND") in done for d in events.index], "Dividends"] = 0.0
+            if _split_ratios(events).empty and not (events["Dividends"] > 0).any():
+                continue
+            applied += _apply_symbol(db, portfolio, symbol, events)
+            ratios = _split_ratios(events)
+            if not ratios.empty:
+                splits[symbol] = (ratios.index.to_numpy("datetime64[ns]"), ratios.to_numpy(dtype=np.float64))
+
+        if not applied:
+            db.rollback()
+            return []
+        db.add_all([AppliedCorporateAction(portfolio_id=portfolio_id, **a) for a in applied])
+        previous_revision = portfolio.ledger_revision or 0
+        if splits:
+            # trades réécrits : les ledgers en cache des autres processus doivent être relus
+            portfolio.ledger_revision = previous_revision + 1
+        invalidate_nav(db, portfolio_id, min(a["ex_date"] for a in applied))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    # le ledger en cache de ce processus est ajusté symbole par symbole et passe à
+    # la nouvelle révision ; les dividendes arrivent comme nouveaux trades
+    if splits:
+        ledger = ledgers.get(portfolio_id)
+        if ledger is not None and ledger.revision == previous_revision:
+            for symbol, (ex_dates, ratios) in splits.items():
+                ledger = ledger.split(symbol, ex_dates, ratios, portfolio.ledger_revision)
+            ledgers.set(portfolio_id, ledger, LEDGER_TTL_SECONDS)
+        else:
+            ledgers.invalidate(portfolio_id)
+        refresh_symbols(db, portfolio, sorted(splits), previous_revision)
+        # historique de prix stocké avant la division : relu entièrement, ajusté
+        for symbol in splits:
+            invalidate_symbol(symbol)
+    return [{"portfolio_id": portfolio_id, **a} for a in applied]
+
+
+def apply_corporate_actions(db: Session, as_of: date | None = None, portfolio_ids: list[int] | None = None) -> int:
+    """
+    Passage planifié sur tous les portefeuilles (un échec n'arrête pas les autres).
+    Retourne le nombre d'opérations appliquées.
+    """
+    query = db.query(Portfolio.portfolio_id)
+    if portfolio_ids is not None:
+        query = query.filter(Portfolio.portfolio_id.in_(portfolio_ids))
+    count = 0
+    for (portfolio_id,) in query.order_by(Portfolio.portfolio_id).all():
+        try:
+            count += len(apply_portfolio_actions(db, portfolio_id, as_of))
+        except Exception:
+            logger.exception("Échec des opérations sur titres du portefeuille %s", portfolio_id)
+    return count
+
+
+def apply_user_portfolio_actions(db: Session, portfolio_id: int, user_id: int):
+    """Applique les opérations en attente d'un portefeuille de l'utilisateur, None s'il ne lui appartient pas."""
+    if not get_portfolio(db, portfolio_id, user_id):
+        return None
+    return apply_portfolio_actions(db, portfolio_id)
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets : indices des `threshold` points qui conservent
+    au mieux la forme de la courbe (premier et dernier point toujours gardés).
+    Les moyennes de seaux sont calculées d'un coup avec reduceat ; la boucle ne
+    porte que sur les seaux (chaque choix dépend du point retenu précédemment).
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # threshold - 2 seaux pour les points 1 .. n-2
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[: n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[: n - 1], edges[:-1]) / counts
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 1 < len(avg_x):
+            cx, cy = avg_x[i + 1], avg_y[i + 1]
+        else:
+            cx, cy = x[n - 1], y[n - 1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def lttb_frame(df: pd.DataFrame, max_points: int, column: str = "Close") -> pd.DataFrame:
+    """Sous-échantillonne un historique en gardant les lignes choisies par LTTB sur `column`."""
+    df = df[df[column].notna()]
+    if len(df) <= max_points:
+        return df
+    x = df.index.asi8.astype(np.float64)
+    y = df[column].to_numpy(dtype=np.float64)
+    return df.iloc[lttb_indices(x, y, max_points)]
+
+
+def ohlc_frame(df: pd.DataFrame, max_points: int) -> pd.DataFrame:
+    """
+    Regroupe les barres en `max_points` seaux consécutifs de même taille :
+    Open = première, High = max, Low = min, Close = dernière, Volume = somme.
+    """
+    n = len(df)
+    if n <= max_points:
+        return df
+    edges = np.linspace(0, n, max_points + 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:] - 1
+    out = {}
+    for col in df.columns:
+        values = df[col].to_numpy(dtype=np.float64)
+        if col == "Open":
+            out[col] = values[starts]
+        elif col == "High":
+            out[col] = np.fmax.reduceat(values, starts)
+        elif col == "Low":
+            out[col] = np.fmin.reduceat(values, starts)
+        elif col == "Volume":
+            out[col] = np.add.reduceat(np.nan_to_num(values), starts)
+        else:
+            out[col] = values[ends]
+    return pd.DataFrame(out, index=df.index[starts])
+
+
+def downsample_frames(frames: dict[str, pd.DataFrame], max_points: int, method: str = "lttb") -> dict[str, pd.DataFrame]:
+    if method == "ohlc":
+        return {s: ohlc_frame(df, max_points) for s, df in frames.items()}
+    return {s: lttb_frame(df, max_points) if "Close" in df.columns else df for s, df in frames.items()}
@@ -0,0 +1,121 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+
+from services.cache import TTLCache
+from services.market_data import get_provider
+from services.ticker_service import get_price_matrix
+
+logger = logging.getLogger(__name__)
+
+# Devise du cash et des prix saisis dans les trades (l'interface affiche des €)
+PORTFOLIO_CURRENCY = os.environ.get("PORTFOLIO_CURRENCY", "EUR").upper()
+
+# La devise de cotation d'un symbole ne change pas : métadonnées gardées longtemps
+CURRENCY_TTL_SECONDS = 7 * 24 * 3600
+currency_cache = TTLCache(max_entries=int(os.environ.get("CURRENCY_CACHE_MAX_ENTRIES", "4096")))
+
+# Devise déduite du suffixe de place quand le fournisseur ne la donne pas
+_SUFFIX_CURRENCIES = {
+    ".PA": "EUR", ".AS": "EUR", ".DE": "EUR", ".F": "EUR", ".MI": "EUR", ".MC": "EUR", ".BR": "EUR",
+    ".LS": "EUR", ".VI": "EUR", ".HE": "EUR", ".IR": "EUR",
+    ".L": "GBp", ".SW": "CHF", ".TO": "CAD", ".V": "CAD", ".T": "JPY", ".HK": "HKD", ".AX": "AUD",
+    ".ST": "SEK", ".OL": "NOK", ".CO": "DKK",
+}
+# Sous-unités cotées par certaines places : (devise, facteur vers la devise)
+_MINOR_UNITS = {"GBp": ("GBP", 0.01), "GBX": ("GBP", 0.01), "ZAc": ("ZAR", 0.01), "ILA": ("ILS", 0.01)}
+
+
+def _currency_from_suffix(symbol: str) -> str:
+    dot = symbol.rfind(".")
+    return _SUFFIX_CURRENCIES.get(symbol[dot:].upper() if dot > 0 else "", "USD")
+
+
+def _load_currency(symbol: str) -> str:
+    try:
+        info = get_provider().lookup(symbol)
+    except Exception as e:
+        logger.warning("Devise de %s indisponible (%s)", symbol, e)
+        info = None
+    currency = info.get("currency") if info else None
+    return currency or _currency_from_suffix(symbol)
+
+
+def symbol_currency(symbol: str) -> str:
+    """Devise de cotation d'un symbole (telle que donnée par le fournisseur, ex: "USD", "GBp")."""
+    return currency_cache.get_or_load(symbol, lambda: _load_currency(symbol), CURRENCY_TTL_SECONDS)
+
+
+def normalize_currency(currency: str) -> tuple[str, float]:
+    """Devise ISO et facteur de conversion d'une sous-unité ("GBp" -> ("GBP", 0.01))."""
+    if currency in _MINOR_UNITS:
+        return _MINOR_UNITS[currency]
+    return currency.upper(), 1.0
+
+
+def validate_currency(currency: str | None) -> str:
+    """Devise demandée en majuscules, PORTFOLIO_CURRENCY si aucune n'est précisée."""
+    if currency is None:
+        return PORTFOLIO_CURRENCY
+    currency = currency.strip().upper()
+    if len(currency) != 3 or not currency.isalpha():
+        raise HTTPException(status_code=400, detail=f"Devise invalide : {currency}")
+    return currency
+
+
+def fx_pair(source: str, target: str) -> str:
+    """Symbole Yahoo du change : cours de 1 `source` en `target`."""
+    return f"{source}{target}=X"
+
+
+def fx_rates(sources: list[str], target: str, index: pd.DatetimeIndex, period: str = "1y",
+             interval: str = "1d", start: str | None = None, offline: bool = False) -> pd.DataFrame:
+    """
+    Cours de change (dates x devises sources) alignés sur `index`, un seul appel
+    pour toutes les paires : elles passent par le même cache et le même stockage
+    que les prix. Dernier cours connu pour les jours sans cotation du change.
+    """
+    rates = pd.DataFrame(1.0, index=index, columns=sources)
+    pairs = {fx_pair(c, target): c for c in sources if c != target}
+    if not pairs:
+        return rates
+    try:
+        quotes = get_price_matrix(list(pairs), period, interval, start, fill="none", offline=offline)
+    except HTTPException:
+        quotes = pd.DataFrame()
+    missing = [c for p, c in pairs.items() if p not in quotes.columns]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Change indisponible vers {target} pour : {', '.join(missing)}")
+    quotes = quotes.reindex(quotes.index.union(index)).ffill().bfill().reindex(index)
+    rates[list(pairs.values())] = quotes[list(pairs)].to_numpy()
+    return rates
+
+
+def convert_matrix(matrix: pd.DataFrame, target: str, period: str = "1y", interval: str = "1d",
+                   start: str | None = None, offline: bool = False) -> pd.DataFrame:
+    """
+    Convertit une matrice de prix (dates x symboles, devises de cotation) dans
+    `target` : une colonne de change par devise, répartie sur les symboles puis
+    un seul produit terme à terme.
+    """
+    if matrix.empty:
+        return matrix
+    quoted = [normalize_currency(symbol_currency(s)) for s in matrix.columns]
+    sources = sorted({c for c, _ in quoted})
+    rates = fx_rates(sources, target, matrix.index, period, interval, start, offline).to_numpy()
+    position = {c: i for i, c in enumerate(sources)}
+    columns = np.array([position[c] for c, _ in quoted])
+    units = np.array([f for _, f in quoted])
+    return pd.DataFrame(matrix.to_numpy() * rates[:, columns] * units, index=matrix.index, columns=matrix.columns)
+
+
+def spot_rates(currencies: list[str], target: str) -> dict[str, float]:
+    """Dernier cours de change de chaque devise (sous-unités comprises) vers `target`."""
+    quoted = {c: normalize_currency(c) for c in currencies}
+    sources = sorted({c for c, _ in quoted.values()})
+    today = pd.DatetimeIndex([pd.Timestamp.now(tz="UTC").tz_localize(None).normalize()])
+    rates = fx_rates(sources, target, today, period="1mo").iloc[-1]
+    return {c: float(rates[source]) * unit for c, (source, unit) in quoted.items()}
@@ -0,0 +1,67 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from models.idempotency_model import IdempotencyKey
+
+# Durée pendant laquelle un rejeu renvoie la réponse d'origine
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+_MAX_KEY_LENGTH = 255
+
+
+def _fingerprint(payload: BaseModel) -> str:
+    return hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+
+
+def claim_idempotency_key(db: Session, user_id: int, key: str | None, endpoint: str, payload: BaseModel):
+    """
+    Réserve la clé dans la transaction en cours, avant l'écriture : la clé est
+    validée ou annulée avec elle. Une requête concurrente portant la même clé
+    attend sur l'index unique puis lit la réponse enregistrée.
+    Retourne None si la requête doit être exécutée, sinon la réponse d'origine.
+    """
+    if key is None:
+        return None
+    if not key or len(key) > _MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="En-tête Idempotency-Key invalide.")
+    fingerprint = _fingerprint(payload)
+    now = datetime.utcnow()
+    claimed = db.execute(
+        insert(IdempotencyKey)
+        .values(user_id=user_id, key=key, endpoint=endpoint, fingerprint=fingerprint, created_at=now)
+        .on_conflict_do_nothing()
+        .returning(IdempotencyKey.key)
+    ).first()
+    if claimed is not None:
+        return None
+
+    stored = db.get(IdempotencyKey, (user_id, key), with_for_update=True, populate_existing=True)
+    if stored.created_at < now - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS):
+        # clé expirée mais pas encore purgée : réutilisable
+        stored.endpoint, stored.fingerprint, stored.response, stored.created_at = endpoint, fingerprint, None, now
+        return None
+    if stored.endpoint != endpoint or stored.fingerprint != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key déjà utilisée pour une autre requête.")
+    if stored.response is None:
+        raise HTTPException(status_code=409, detail="Requête avec cette Idempotency-Key en cours de traitement.")
+    return stored.response
+
+
+def store_idempotent_response(db: Session, user_id: int, key: str | None, response: BaseModel):
+    """Enregistre la réponse avec la clé, dans la transaction de l'écriture (avant son commit)."""
+    if key is None:
+        return
+    db.get(IdempotencyKey, (user_id, key)).response = response.model_dump(mode="json")
+
+
+def purge_idempotency_keys(db: Session) -> int:
+    """Supprime les clés expirées (calcul quotidien)."""
+    limit = datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+    deleted = db.query(IdempotencyKey).filter(IdempotencyKey.created_at < limit).delete(synchronize_session=False)
+    db.commit()
+    return deleted
@@ -0,0 +1,318 @@
+import threading
+from collections import defaultdict, deque
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from models.portfolio_model import Portfolio
+from services.cache import TTLCache
+from services.fx_service import PORTFOLIO_CURRENCY, spot_rates, symbol_currency
+from services.portfolio_service import get_portfolio, get_positions
+from services.positions_engine import Ledger, get_ledger, base_positions
+from services.ticker_service import get_price_matrix
+
+LOT_METHODS = ("fifo", "lifo", "average")
+# Les livres de lots sont prolongés à chaque nouveau trade : le TTL ne libère que les inactifs
+LOTS_TTL_SECONDS = 6 * 3600
+lot_books = TTLCache(max_entries=1024)
+_QTY_EPSILON = 1e-9
+
+
+def _iso(value) -> str | None:
+    return None if value is None else pd.Timestamp(value).isoformat()
+
+
+def opening_lots(ledger: Ledger, opening: dict[str, float], holdings_cost: dict[str, float]) -> dict[str, tuple[float, float]]:
+    """
+    Positions d'origine (avant le premier trade) avec leur coût total.
+    Le coût des holdings est tenu au coût moyen : il vaut a * C0 + b, où C0 est
+    le coût d'origine cherché ; a et b s'obtiennent en rejouant les trades une fois,
+    dans l'ordre où ils ont été appliqués (trade_id) et non dans l'ordre des dates.
+    """
+    quantity = {s: q for s, q in opening.items() if q > _QTY_EPSILON}
+    a = dict.fromkeys(quantity, 1.0)
+    b = dict.fromkeys(quantity, 0.0)
+    held = np.flatnonzero((ledger.quantities != 0) & np.isin(ledger.symbols, list(quantity)))
+    order = held[np.argsort(ledger.trade_ids[held], kind="stable")]
+    quantities = ledger.quantities[order]
+    prices = ledger.cash_flows[order] / -quantities
+    for symbol, qty, price in zip(ledger.symbols[order].tolist(), quantities.tolist(), prices.tolist()):
+        if qty > 0:
+            b[symbol] += qty * price
+        elif quantity[symbol] > _QTY_EPSILON:
+            kept = max(0.0, 1 + qty / quantity[symbol])
+            a[symbol] *= kept
+            b[symbol] *= kept
+        quantity[symbol] += qty
+    lots = {}
+    for symbol, q in opening.items():
+        if q <= _QTY_EPSILON:
+            continue
+        cost = (holdings_cost.get(symbol, 0.0) - b[symbol]) / a[symbol] if a[symbol] > _QTY_EPSILON else 0.0
+        lots[symbol] = (q, max(cost, 0.0))
+    return lots
+
+
+def _matched_entries(ledger: Ledger) -> np.ndarray:
+    """Entrées du ledger qui modifient une position (les dividendes n'entrent pas dans les lots)."""
+    return np.flatnonzero(ledger.quantities != 0)
+
+
+class LotBook:
+    """
+    Rapprochement achats / ventes d'un portefeuille pour une méthode.
+    Lots ouverts : une deque par symbole de [trade_id, date, quantité restante, prix].
+    FIFO consomme par la gauche, LIFO par la droite, le coût moyen garde un seul
+    lot par symbole. `trade_ids` garde les trades déjà traités, dans l'ordre :
+    un nouveau trade ne fait que prolonger le rapprochement.
+    """
+
+    def __init__(self, method: str, opening: dict[str, tuple[float, float]], revision: int = 0):
+        self.method = method
+        self.revision = revision
+        self.opening = {s: q for s, (q, _) in opening.items()}
+        self.trade_ids = np.empty(0, dtype=np.int64)
+        self.lots: dict[str, deque] = {
+            s: deque([[None, None, q, cost / q]]) for s, (q, cost) in opening.items()
+        }
+        self.realized = defaultdict(float)
+        self.unmatched = defaultdict(float)
+        self.closed = []
+        self.lock = threading.Lock()
+
+    def extend(self, ledger: Ledger):
+        """Rapproche les trades du ledger non encore traités, dans l'ordre des dates."""
+        entries = _matched_entries(ledger)
+        if len(entries) > len(self.trade_ids):
+            self._match(ledger, entries[len(self.trade_ids):])
+            self.trade_ids = ledger.trade_ids[entries]
+
+    def follows(self, ledger: Ledger) -> bool:
+        """
+        Vrai si le ledger prolonge les trades déjà traités : même révision et
+        pas de trade antidaté entre-temps.
+        """
+        if ledger.revision != self.revision:
+            return False
+        done = len(self.trade_ids)
+        trade_ids = ledger.trade_ids[_matched_entries(ledger)]
+        return done <= len(trade_ids) and np.array_equal(trade_ids[:done], self.trade_ids)
+
+    def replay_symbol(self, ledger: Ledger, symbol: str, opening: tuple[float, float]):
+        """
+        Refait le rapprochement d'un seul symbole (après une division) sur les
+        trades déjà traités ; les lots des autres symboles ne sont pas touchés.
+        """
+        quantity, cost = opening
+        self.opening.pop(symbol, None)
+        self.lots[symbol] = deque()
+        if quantity > _QTY_EPSILON:
+            self.opening[symbol] = quantity
+            self.lots[symbol].append([None, None, quantity, cost / quantity])
+        self.realized.pop(symbol, None)
+        self.unmatched.pop(symbol, None)
+        self.closed = [c for c in self.closed if c["symbol"] != symbol]
+        entries = _matched_entries(ledger)[:len(self.trade_ids)]
+        self._match(ledger, entries[ledger.symbols[entries] == symbol])
+
+    def _match(self, ledger: Ledger, entries: np.ndarray):
+        quantities = ledger.quantities[entries]
+        prices = ledger.cash_flows[entries] / -quantities
+        for trade_id, date, symbol, qty, price in zip(
+            ledger.trade_ids[entries].tolist(),
+            ledger.times[entries],
+            ledger.symbols[entries].tolist(),
+            quantities.tolist(),
+            prices.tolist(),
+        ):
+            if qty > 0:
+                self._buy(symbol, trade_id, date, qty, price)
+            else:
+                self._sell(symbol, trade_id, date, -qty, price)
+
+    def _buy(self, symbol, trade_id, date, qty, price):
+        lots = self.lots.setdefault(symbol, deque())
+        if self.method == "average" and lots:
+            lot = lots[0]
+            total = lot[2] + qty
+            lot[3] = (lot[2] * lot[3] + qty * price) / total
+            lot[2] = total
+        else:
+            lots.append([trade_id, date, qty, price])
+
+    def _sell(self, symbol, trade_id, date, qty, price):
+        lots = self.lots.get(symbol, deque())
+        remaining = qty
+        while remaining > _QTY_EPSILON and lots:
+            lot = lots[-1] if self.method == "lifo" else lots[0]
+            matched = min(remaining, lot[2])
+            gain = matched * (price - lot[3])
+            self.realized[symbol] += gain
+            self.closed.append({
+                "symbol": symbol,
+                "quantity": matched,
+                "open_trade_id": lot[0],
+                "open_date": lot[1],
+                "open_price": lot[3],
+                "close_trade_id": trade_id,
+                "close_date": date,
+                "close_price": price,
+                "realized": gain,
+            })
+            lot[2] -= matched
+            remaining -= matched
+            if lot[2] <= _QTY_EPSILON:
+                lots.pop() if self.method == "lifo" else lots.popleft()
+        if remaining > _QTY_EPSILON:
+            # vente sans lot correspondant (historique incomplet) : pas de coût connu
+            self.unmatched[symbol] += remaining
+
+
+def get_lot_book(db: Session, portfolio: Portfolio, method: str) -> tuple[LotBook, Ledger]:
+    """
+    Livre de lots à jour. Reconstruit seulement si un trade antidaté a réordonné
+    le ledger ou si les positions d'origine ont changé ; sinon prolongé.
+    """
+    if method not in LOT_METHODS:
+        raise HTTPException(status_code=400, detail=f"Méthode inconnue : {method} (fifo, lifo ou average)")
+    ledger = get_ledger(db, portfolio.portfolio_id)
+    opening = {s: q for s, q in base_positions(ledger, get_positions(portfolio)).items() if q > _QTY_EPSILON}
+    key = (portfolio.portfolio_id, method)
+
+    def build():
+        holdings_cost = {h.symbol: h.cost_basis for h in portfolio.holdings}
+        return LotBook(method, opening_lots(ledger, opening, holdings_cost), ledger.revision)
+
+    book = lot_books.get_or_load(key, build, LOTS_TTL_SECONDS)
+    with book.lock:
+        stale = book.opening != opening or not book.follows(ledger)
+    if stale:
+        book = build()
+        lot_books.set(key, book, LOTS_TTL_SECONDS)
+    with book.lock:
+        book.extend(ledger)
+    return book, ledger
+
+
+def refresh_symbols(db: Session, portfolio: Portfolio, symbols: list[str], previous_revision: int):
+    """
+    Après des divisions : dans les livres en cache à la révision précédente,
+    seuls les lots des symboles concernés sont rejoués et le livre passe à la
+    révision du ledger ; les autres symboles gardent leur rapprochement.
+    Les livres plus anciens sont abandonnés.
+    """
+    ledger = get_ledger(db, portfolio.portfolio_id)
+    positions = base_positions(ledger, get_positions(portfolio))
+    holdings_cost = {h.symbol: h.cost_basis for h in portfolio.holdings if h.symbol in symbols}
+    openings = opening_lots(ledger, {s: positions.get(s, 0.0) for s in symbols}, holdings_cost)
+    for method in LOT_METHODS:
+        key = (portfolio.portfolio_id, method)
+        book = lot_books.get(key)
+        if book is None:
+            continue
+        with book.lock:
+            if book.revision == previous_revision:
+                book.revision = ledger.revision
+                if book.follows(ledger):
+                    for symbol in symbols:
+                        book.replay_symbol(ledger, symbol, openings.get(symbol, (0.0, 0.0)))
+                    book.extend(ledger)
+                    continue
+        lot_books.invalidate(key)
+
+
+def _latest_prices(symbols: list[str]) -> dict[str, float]:
+    if not symbols:
+        return {}
+    try:
+        closes = get_price_matrix(symbols, "5d", "1d", fill="ffill")
+    except HTTPException:
+        return {}
+    if closes.empty:
+        return {}
+    return {s: float(p) for s, p in closes.iloc[-1].items() if np.isfinite(p)}
+
+
+def get_portfolio_pnl(db: Session, portfolio_id: int, user_id: int, method: str = "fifo", currency: str = PORTFOLIO_CURRENCY):
+    """
+    P&L réalisé et latent par symbole selon la méthode de rapprochement.
+    Prix de revient (devise des trades) et cours (devise de cotation) sont
+    convertis dans `currency` au dernier cours de change.
+    Retourne None si le portefeuille n'appartient pas à l'utilisateur.
+    """
+    portfolio = get_portfolio(db, portfolio_id, user_id)
+    if not portfolio:
+        return None
+    book, _ = get_lot_book(db, portfolio, method)
+    with book.lock:
+        open_positions = {
+            s: (sum(l[2] for l in lots), sum(l[2] * l[3] for l in lots))
+            for s, lots in book.lots.items() if lots
+        }
+        realized = dict(book.realized)
+        unmatched = dict(book.unmatched)
+    prices = _latest_prices(sorted(open_positions))
+    quoted = {s: symbol_currency(s) for s in prices}
+    rates = spot_rates(sorted(set(quoted.values()) | {PORTFOLIO_CURRENCY}), currency)
+    prices = {s: p * rates[quoted[s]] for s, p in prices.items()}
+    cost_rate = rates[PORTFOLIO_CURRENCY]
+    realized = {s: r * cost_rate for s, r in realized.items()}
+
+    positions = []
+    for symbol in sorted(set(open_positions) | set(realized)):
+        quantity, cost = open_positions.get(symbol, (0.0, 0.0))
+        cost *= cost_rate
+        price = prices.get(symbol)
+        market_value = quantity * price if price is not None else None
+        positions.append({
+            "symbol": symbol,
+            "quantity": round(quantity, 6),
+            "cost_basis": round(cost, 2),
+            "average_cost": round(cost / quantity, 4) if quantity > _QTY_EPSILON else None,
+            "market_price": price,
+            "market_value": round(market_value, 2) if market_value is not None else None,
+            "unrealized": round(market_value - cost, 2) if market_value is not None else None,
+            "realized": round(realized.get(symbol, 0.0), 2),
+            "unmatched_quantity": round(unmatched.get(symbol, 0.0), 6),
+        })
+    return {
+        "portfolio_id": portfolio_id,
+        "method": method,
+        "currency": currency,
+        "realized_total": round(sum(realized.values()), 2),
+        "unrealized_total": round(sum(p["unrealized"] or 0.0 for p in positions), 2),
+        "positions": positions,
+        "missing": [s for s in sorted(open_positions) if s not in prices],
+    }
+
+
+def get_portfolio_lots(db: Session, portfolio_id: int, user_id: int, method: str = "fifo", symbol: str | None = None):
+    """
+    Lots ouverts et lots clôturés (rapprochements achat / vente).
+    Les lots d'origine (positions antérieures au premier trade) n'ont ni trade ni date.
+    """
+    portfolio = get_portfolio(db, portfolio_id, user_id)
+    if not portfolio:
+        return None
+    book, _ = get_lot_book(db, portfolio, method)
+    symbol = symbol.strip().upper() if symbol else None
+    with book.lock:
+        open_lots = [
+            {"symbol": s, "trade_id": l[0], "date": _iso(l[1]), "quantity": round(l[2], 6), "price": round(l[3], 4)}
+            for s, lots in sorted(book.lots.items()) if symbol in (None, s)
+            for l in lots
+        ]
+        closed_lots = [
+            {
+                **c,
+                "quantity": round(c["quantity"], 6),
+                "open_date": _iso(c["open_date"]),
+                "open_price": round(c["open_price"], 4),
+                "close_date": _iso(c["close_date"]),
+                "realized": round(c["realized"], 2),
+            }
+            for c in book.closed if symbol in (None, c["symbol"])
+        ]
+    return {"portfolio_id": portfolio_id, "method": method, "open_lots": open_lots, "closed_lots": closed_lots}
@@ -0,0 +1,329 @@
+import logging
+import os
+import zlib
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+logger = logging.getLogger(__name__)
+
+OHLCV_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+# Opérations sur titres : dividende par action et ratio de division (0 = aucune)
+ACTION_COLUMNS = ["Dividends", "Stock Splits"]
+
+
+class MarketDataProvider(ABC):
+    """
+    Source de données de marché. `batch_history` est la seule méthode obligatoire ;
+    les autres ont une implémentation par défaut basée dessus.
+    Les dates `start`/`end` sont des pd.Timestamp naïfs (end exclu), `period`
+    n'est utilisé que si `start` est None.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def batch_history(
+        self,
+        symbols: list[str],
+        interval: str,
+        start: pd.Timestamp | None = None,
+        end: pd.Timestamp | None = None,
+        period: str = "max",
+    ) -> dict[str, pd.DataFrame]:
+        """Historiques OHLCV par symbole ; les symboles sans données sont absents du dict."""
+
+    def history(self, symbol: str, interval: str, start=None, end=None, period: str = "max") -> pd.DataFrame | None:
+        return self.batch_history([symbol], interval, start=start, end=end, period=period).get(symbol)
+
+    def quote(self, symbol: str) -> dict | None:
+        """Dernier prix connu : {"symbol", "price", "currency", "time"}."""
+        hist = self.history(symbol, "1d", period="5d")
+        if hist is None or hist.empty:
+            return None
+        return {
+            "symbol": symbol,
+            "price": float(hist["Close"].iloc[-1]),
+            "currency": None,
+            "time": hist.index[-1].isoformat(),
+        }
+
+    def lookup(self, symbol: str) -> dict | None:
+        """Informations sur un symbole, None s'il n'existe pas."""
+        quote = self.quote(symbol)
+        if quote is None:
+            return None
+        return {"symbol": symbol, "name": None, "currency": quote["currency"], "exchange": None}
+
+    def actions(self, symbol: str) -> pd.DataFrame | None:
+        """
+        Dividendes et divisions d'un symbole (colonnes ACTION_COLUMNS, indexées
+        par date d'effet). None si le fournisseur ne les connaît pas.
+        """
+        return None
+
+
+class YFinanceProvider(MarketDataProvider):
+    name = "yfinance"
+
+    def batch_history(self, symbols, interval, start=None, end=None, period="max"):
+        """
+        Un seul appel yf.download pour tous les symboles, découpé ensuite par symbole.
+        Cours ajustés des divisions seulement : les dividendes sont crédités au cash
+        par les opérations sur titres, des cours ajustés des dividendes les
+        compteraient deux fois dans la valorisation et la performance.
+        """
+        kwargs = dict(
+            tickers=" ".join(symbols),
+            interval=interval,
+            group_by="ticker",
+            auto_adjust=False,
+            threads=True,
+            progress=False,
+        )
+        if start is not None:
+            kwargs["start"] = start.strftime("%Y-%m-%d")
+            if end is not None:
+                kwargs["end"] = end.strftime("%Y-%m-%d")
+        else:
+            kwargs["period"] = period
+        data = yf.download(**kwargs)
+
+        frames = {}
+        if data is None or data.empty:
+            return frames
+        for s in symbols:
+            if isinstance(data.columns, pd.MultiIndex):
+                if s not in data.columns.get_level_values(0):
+                    continue
+                df = data[s]
+            else:
+                df = data
+            df = df.drop(columns="Adj Close", errors="ignore").dropna(how="all")
+            df.columns.name = None
+            if not df.empty:
+                frames[s] = df
+        return frames
+
+    def quote(self, symbol):
+        try:
+            info = yf.Ticker(symbol).fast_info
+            price = info["lastPrice"]
+            if price is None or np.isnan(price):
+                return None
+            return {
+                "symbol": symbol,
+                "price": float(price),
+                "currency": info["currency"],
+                "time": datetime.utcnow().isoformat(),
+            }
+        except Exception:
+            return None
+
+    def lookup(self, symbol):
+        try:
+            ticker = yf.Ticker(symbol)
+            if ticker.history(period="5d").empty:
+                return None
+            info = ticker.fast_info
+            return {"symbol": symbol, "name": None, "currency": info["currency"], "exchange": info["exchange"]}
+        except Exception:
+            return None
+
+    def actions(self, symbol):
+        df = yf.Ticker(symbol).actions
+        if df is None:
+            return None
+        return df.reindex(columns=ACTION_COLUMNS, fill_value=0.0)
+
+
+class FileProvider(MarketDataProvider):
+    """
+    Rejoue des historiques enregistrés : `{dossier}/{intervalle}/{SYMBOLE}.parquet` ou `.csv`
+    (même arborescence que price_store, une copie du stockage local suffit).
+    Avec `synthetic=True`, les symboles sans fichier reçoivent un historique
+    synthétique déterministe (mouvement brownien géométrique graine = symbole),
+    ce qui permet de tester toute la chaîne /tickers sans réseau.
+    """
+
+    name = "file"
+
+    _INTRADAY_FREQ = {
+        "1m": "1min", "2m": "2min", "5m": "5min", "15m": "15min", "30m": "30min",
+        "60m": "60min", "90m": "90min", "1h": "60min",
+    }
+    _RESAMPLE_FREQ = {"5d": "5B", "1wk": "W-FRI", "1mo": "ME", "3mo": "QE"}
+
+    def __init__(self, directory: str | None = None, synthetic: bool = False):
+        self.directory = directory
+        self.synthetic = synthetic
+
+    def batch_history(self, symbols, interval, start=None, end=None, period="max"):
+        frames = {}
+        for s in symbols:
+            df = self._read(s, interval)
+            if df is None and self.synthetic:
+                df = self._synthetic(s, interval)
+            if df is None:
+                continue
+            if start is not None:
+                df = df[df.index >= self._localize(start, df)]
+            if end is not None:
+                df = df[df.index < self._localize(end, df)]
+            if not df.empty:
+                frames[s] = df
+        return frames
+
+    def actions(self, symbol):
+        # même arborescence, sous-dossier "actions" ; l'historique synthétique n'en a pas
+        df = self._read(symbol, "actions")
+        if df is None:
+            return pd.DataFrame(columns=ACTION_COLUMNS, dtype=float) if self.synthetic else None
+        return df.reindex(columns=ACTION_COLUMNS, fill_value=0.0)
+
+    @staticmethod
+    def _localize(ts: pd.Timestamp, df: pd.DataFrame) -> pd.Timestamp:
+        return ts.tz_localize(df.index.tz) if df.index.tz is not None else ts
+
+    def _read(self, symbol: str, interval: str) -> pd.DataFrame | None:
+        if not self.directory:
+            return None
+        base = os.path.join(self.directory, interval, symbol.replace("/", "_"))
+        if os.path.exists(base + ".parquet"):
+            return pd.read_parquet(base + ".parquet")
+        if os.path.exists(base + ".csv"):
+            return pd.read_csv(base + ".csv", index_col=0, parse_dates=True)
+        return None
+
+    def _synthetic(self, symbol: str, interval: str) -> pd.DataFrame:
+        seed = zlib.crc32(f"{symbol}:{interval}".encode())
+        rng = np.random.default_rng(seed)
+        today = pd.Timestamp(datetime.utcnow().date())
+        if interval in self._INTRADAY_FREQ:
+            days = pd.bdate_range(end=today, periods=30)
+            index = pd.DatetimeIndex(np.concatenate([
+                pd.date_range(d + pd.Timedelta(hours=14, minutes=30), d + pd.Timedelta(hours=21),
+                              freq=self._INTRADAY_FREQ[interval], inclusive="left").values
+                for d in days
+            ]), name="Datetime").tz_localize("UTC")
+            steps_per_year = 252 * len(index) / len(days)
+        else:
+            index = pd.bdate_range("2000-01-03", today, name="Date")
+            steps_per_year = 252
+
+        n = len(index)
+        drift, vol = 0.07 / steps_per_year, 0.25 / np.sqrt(steps_per_year)
+        log_returns = rng.normal(drift - vol ** 2 / 2, vol, n)
+        close = rng.uniform(20, 300) * np.exp(np.cumsum(log_returns))
+        open_ = np.concatenate(([close[0]], close[:-1]))
+        spread = np.abs(rng.normal(0, vol, n)) * close
+        df = pd.DataFrame(
+            {
+                "Open": open_,
+                "High": np.maximum(open_, close) + spread,
+                "Low": np.minimum(open_, close) - spread,
+                "Close": close,
+                "Volume": rng.integers(100_000, 5_000_000, n),
+            },
+            index=index,
+        )
+        if interval in self._RESAMPLE_FREQ:
+            df = df.resample(self._RESAMPLE_FREQ[interval]).agg(
+                {"Open": "first", "High": "max", "Low": "min", "Close": "last", "Volume": "sum"}
+            ).dropna()
+            df.index.name = "Date"
+        return df
+
+
+class ChainProvider(MarketDataProvider):
+    """
+    Interroge les fournisseurs dans l'ordre : chaque symbole est demandé au suivant
+    seulement si les précédents ne l'ont pas (ou ont échoué).
+    """
+
+    def __init__(self, providers: list[MarketDataProvider]):
+        self.providers = providers
+        self.name = ",".join(p.name for p in providers)
+
+    def batch_history(self, symbols, interval, start=None, end=None, period="max"):
+        frames = {}
+        missing = list(symbols)
+        error = None
+        for provider in self.providers:
+            if not missing:
+                break
+            try:
+                frames.update(provider.batch_history(missing, interval, start=start, end=end, period=period))
+            except Exception as e:
+                logger.warning("Fournisseur %s en échec (%s)", provider.name, e)
+                error = e
+                continue
+            missing = [s for s in missing if s not in frames]
+        if not frames and error is not None:
+            raise error
+        return frames
+
+    def quote(self, symbol):
+        for provider in self.providers:
+            result = provider.quote(symbol)
+            if result is not None:
+                return result
+        return None
+
+    def lookup(self, symbol):
+        for provider in self.providers:
+            result = provider.lookup(symbol)
+            if result is not None:
+                return result
+        return None
+
+    def actions(self, symbol):
+        for provider in self.providers:
+            try:
+                result = provider.actions(symbol)
+            except Exception as e:
+                logger.warning("Fournisseur %s en échec (%s)", provider.name, e)
+                continue
+            if result is not None:
+                return result
+        return None
+
+
+def build_provider(spec: str) -> MarketDataProvider:
+    """
+    Construit le fournisseur à partir d'une liste séparée par des virgules,
+    ex: "yfinance", "file,yfinance" ou "synthetic".
+    """
+    directory = os.environ.get("MARKET_DATA_DIR")
+    providers = []
+    for name in [n.strip().lower() for n in spec.split(",") if n.strip()]:
+        if name == "yfinance":
+            providers.append(YFinanceProvider())
+        elif name == "file":
+            providers.append(FileProvider(directory))
+        elif name == "synthetic":
+            providers.append(FileProvider(directory, synthetic=True))
+        else:
+            raise ValueError(f"Fournisseur de données inconnu : {name}")
+    if not providers:
+        raise ValueError("Aucun fournisseur de données configuré")
+    return providers[0] if len(providers) == 1 else ChainProvider(providers)
+
+
+_provider: MarketDataProvider | None = None
+
+
+def get_provider() -> MarketDataProvider:
+    global _provider
+    if _provider is None:
+        _provider = build_provider(os.environ.get("MARKET_DATA_PROVIDER", "yfinance"))
+    return _provider
+
+
+def set_provider(provider: MarketDataProvider | None):
+    """Remplace le fournisseur courant (None = relire MARKET_DATA_PROVIDER)."""
+    global _provider
+    _provider = provider
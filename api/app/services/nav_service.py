@@ -0,0 +1,297 @@
+import logging
+import os
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from models.nav_model import PortfolioNavDaily
+from models.portfolio_model import Portfolio
+from services.corporate_actions import apply_corporate_actions
+from services.fx_service import PORTFOLIO_CURRENCY, convert_matrix
+from services.idempotency_service import purge_idempotency_keys
+from services.portfolio_service import get_portfolio, get_positions
+from services.positions_engine import get_ledger, base_positions, symbols_held_since
+from services.ticker_service import get_price_matrix
+
+logger = logging.getLogger(__name__)
+
+# Profondeur maximale du rattrapage pour un portefeuille sans snapshot
+NAV_BACKFILL_DAYS = int(os.environ.get("NAV_BACKFILL_DAYS", "365"))
+# Heure (UTC) du calcul quotidien, après la clôture américaine
+NAV_SCHEDULE_UTC = os.environ.get("NAV_SCHEDULE_UTC", "21:30")
+_UPSERT_CHUNK = 5000
+# Clé du verrou consultatif Postgres : un seul worker matérialise à la fois
+_ADVISORY_LOCK_KEY = 712_001
+
+
+def last_market_day(day: date | None = None) -> pd.Timestamp:
+    """
+    Dernier jour ouvré à la date donnée. Par défaut, dernier jour dont la
+    clôture est passée : la veille tant que l'heure du calcul n'est pas atteinte.
+    """
+    if day is None:
+        now = datetime.utcnow()
+        day = now.date() if now.time() >= datetime.strptime(NAV_SCHEDULE_UTC, "%H:%M").time() else now.date() - timedelta(days=1)
+    return pd.offsets.BDay().rollback(pd.Timestamp(day))
+
+
+def _closes(symbols: list[str], start: pd.Timestamp, dates: pd.DatetimeIndex) -> pd.DataFrame | None:
+    """
+    Clôtures de tous les symboles en un seul appel, converties dans la devise du
+    cash et alignées sur `dates` avec la dernière valeur connue (quelques jours
+    de marge pour les jours fériés).
+    Un symbole sans cotation a une colonne vide ; None si les prix sont indisponibles.
+    """
+    if not symbols:
+        return pd.DataFrame(index=dates)
+    try:
+        since = (start - timedelta(days=10)).strftime("%Y-%m-%d")
+        closes = get_price_matrix(symbols, interval="1d", start=since, fill="none")
+        closes = convert_matrix(closes, PORTFOLIO_CURRENCY, interval="1d", start=since)
+    except HTTPException as e:
+        logger.warning("Prix indisponibles pour le calcul des NAV (%s)", e.detail)
+        return None
+    return closes.reindex(closes.index.union(dates)).ffill().reindex(index=dates, columns=symbols)
+
+
+def valued_dates(complete: np.ndarray, backfill: bool) -> slice:
+    """
+    Dates à enregistrer : la suite de dates complètes qui prolonge les snapshots
+    existants, arrêtée à la première date incomplète pour qu'elle soit reprise
+    au prochain passage. Lors du premier calcul, les dates précédant les
+    premières cotations des positions sont sautées.
+    """
+    first = int(np.argmax(complete)) if backfill and complete.any() else 0
+    gaps = np.flatnonzero(~complete[first:])
+    return slice(first, first + int(gaps[0]) if len(gaps) else len(complete))
+
+
+def materialize_nav(db: Session, as_of: date | None = None, portfolio_ids: list[int] | None = None) -> int:
+    """
+    Calcule les NAV de clôture manquantes de chaque portefeuille jusqu'au
+    dernier jour ouvré `as_of` et les enregistre dans portfolio_nav_daily.
+    Positions et cash sont ceux détenus à chaque date (ledger des trades) ;
+    les prix de tous les portefeuilles viennent d'un seul appel par lot.
+    Met aussi à jour last_amount. Retourne le nombre de lignes écrites.
+    """
+    as_of = last_market_day(as_of)
+    query = db.query(Portfolio)
+    if portfolio_ids is not None:
+        query = query.filter(Portfolio.portfolio_id.in_(portfolio_ids))
+    portfolios = query.all()
+    last_dates = dict(
+        db.query(PortfolioNavDaily.portfolio_id, func.max(PortfolioNavDaily.nav_date))
+        .group_by(PortfolioNavDaily.portfolio_id)
+        .all()
+    )
+
+    plans = []
+    for portfolio in portfolios:
+        last = last_dates.get(portfolio.portfolio_id)
+        if last is not None:
+            first = pd.Timestamp(last) + timedelta(days=1)
+        else:
+            created = pd.Timestamp(portfolio.portfolio_date or as_of).normalize()
+            first = max(created, as_of - timedelta(days=NAV_BACKFILL_DAYS))
+        dates = pd.bdate_range(first, as_of)
+        if dates.empty:
+            continue
+        ledger = get_ledger(db, portfolio.portfolio_id)
+        base = base_positions(ledger, get_positions(portfolio))
+        plans.append((portfolio, dates, last is None, ledger, base, symbols_held_since(ledger, base, dates[0])))
+    if not plans:
+        return 0
+
+    all_symbols = sorted({s for *_, symbols in plans for s in symbols})
+    start = min(dates[0] for _, dates, *_ in plans)
+    closes = _closes(all_symbols, start, pd.bdate_range(start, as_of))
+
+    rows = []
+    for portfolio, dates, backfill, ledger, base, symbols in plans:
+        if closes is None and symbols:
+            # prix indisponibles : rien n'est écrit, le portefeuille sera repris au prochain passage
+            continue
+        prices = closes.loc[dates, symbols].to_numpy(dtype=np.float64) if symbols else np.empty((len(dates), 0))
+        cutoffs = (dates + timedelta(days=1)).to_numpy()
+        quantities = np.array([base[s] for s in symbols]).reshape(1, -1) + ledger.positions_at(symbols, cutoffs)
+        cash_value = float(portfolio.cash_balance or 0) - ledger.net_cash + ledger.cash_at(cutoffs)
+        held = quantities != 0
+        # une position détenue sans cours (symbole sans cotation compris) rend la date incomplète
+        complete = ~(held & np.isnan(prices)).any(axis=1)
+        valued = valued_dates(complete, backfill)
+        positions_value = np.where(held, prices * quantities, 0.0).sum(axis=1)[valued]
+        cash_value = cash_value[valued]
+        for d, pv, cv in zip(dates[valued], positions_value, cash_value):
+            rows.append({
+                "portfolio_id": portfolio.portfolio_id,
+                "nav_date": d.date(),
+                "positions_value": round(float(pv), 2),
+                "cash_value": round(float(cv), 2),
+                "nav": round(float(pv + cv), 2),
+            })
+        if len(positions_value):
+            portfolio.last_amount = round(float(positions_value[-1]), 2)
+
+    for i in range(0, len(rows), _UPSERT_CHUNK):
+        stmt = insert(PortfolioNavDaily).values(rows[i:i + _UPSERT_CHUNK])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["portfolio_id", "nav_date"],
+            set_={c: stmt.excluded[c] for c in ("positions_value", "cash_value", "nav")},
+        ))
+    db.commit()
+    return len(rows)
+
+
+def get_nav_history(db: Session, portfolio_id: int, user_id: int, start: date | None = None, end: date | None = None):
+    """Snapshots de NAV d'un portefeuille (colonnes parallèles), None s'il n'appartient pas à l'utilisateur."""
+    if not get_portfolio(db, portfolio_id, user_id):
+        return None
+    query = db.query(
+        PortfolioNavDaily.nav_date, PortfolioNavDaily.positions_value, PortfolioNavDaily.cash_value, PortfolioNavDaily.nav
+    ).filter(PortfolioNavDaily.portfolio_id == portfolio_id)
+    if start is not None:
+        query = query.filter(PortfolioNavDaily.nav_date >= start)
+    if end is not None:
+        query = query.filter(PortfolioNavDaily.nav_date <= end)
+    rows = query.order_by(PortfolioNavDaily.nav_date).all()
+    return {
+        "portfolio_id": portfolio_id,
+        "dates": [r.nav_date.isoformat() for r in rows],
+        "positions_value": [r.positions_value for r in rows],
+        "cash_value": [r.cash_value for r in rows],
+        "nav": [r.nav for r in rows],
+    }
+
+
+def get_nav_summary(db: Session, user_id: int) -> list[dict]:
+    """
+    Dernière NAV de chaque portefeuille de l'utilisateur et variation depuis la
+    veille, à partir des deux derniers snapshots (row_number par portefeuille).
+    """
+    ranked = (
+        db.query(
+            PortfolioNavDaily.portfolio_id,
+            PortfolioNavDaily.nav_date,
+            PortfolioNavDaily.nav,
+            func.row_number().over(
+                partition_by=PortfolioNavDaily.portfolio_id,
+                order_by=PortfolioNavDaily.nav_date.desc(),
+            ).label("rn"),
+        )
+        .join(Portfolio, Portfolio.portfolio_id == PortfolioNavDaily.portfolio_id)
+        .filter(Portfolio.user_id == user_id)
+        .subquery()
+    )
+    latest = {}
+    for row in db.query(ranked).filter(ranked.c.rn <= 2).order_by(ranked.c.portfolio_id, ranked.c.rn).all():
+        latest.setdefault(row.portfolio_id, []).append(row)
+
+    summary = []
+    portfolios = db.query(Portfolio).filter(Portfolio.user_id == user_id).order_by(Portfolio.portfolio_id).all()
+    for portfolio in portfolios:
+        snapshots = latest.get(portfolio.portfolio_id, [])
+        nav = snapshots[0].nav if snapshots else None
+        previous = snapshots[1].nav if len(snapshots) > 1 else None
+        summary.append({
+            "portfolio_id": portfolio.portfolio_id,
+            "portfolio_name": portfolio.portfolio_name,
+            "nav_date": snapshots[0].nav_date if snapshots else None,
+            "nav": nav,
+            "day_change": round(nav - previous, 2) if previous is not None else None,
+            "day_change_pct": round((nav / previous - 1) * 100, 2) if previous else None,
+            "total_return_pct": (
+                round((nav / portfolio.initial_amount - 1) * 100, 2)
+                if nav is not None and portfolio.initial_amount else None
+            ),
+        })
+    return summary
+
+
+class NavScheduler:
+    """
+    Thread de fond : rattrapage au démarrage puis un calcul par jour à l'heure
+    `at` (UTC), précédé de l'application des opérations sur titres. Un verrou consultatif Postgres évite que plusieurs workers de
+    l'API calculent en même temps.
+    """
+
+    def __init__(self, session_factory, at: str = NAV_SCHEDULE_UTC):
+        self.session_factory = session_factory
+        self.at = datetime.strptime(at, "%H:%M").time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="nav-scheduler", daemon=True)
+
+    def start(self) -> "NavScheduler":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def seconds_until_next_run(self, now: datetime | None = None) -> float:
+        now = now or datetime.utcnow()
+        next_run = datetime.combine(now.date(), self.at)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    def run_once(self) -> int:
+        """
+        Un passage complet sous le verrou consultatif. Les erreurs sont journalisées
+        et n'interrompent pas le thread ; si le verrou ne peut pas être libéré, la
+        connexion est abandonnée (le verrou part avec elle).
+        """
+        db = self.session_factory()
+        locked = False
+        try:
+            locked = bool(db.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _ADVISORY_LOCK_KEY}).scalar())
+            if not locked:
+                return 0
+            # divisions et dividendes d'abord : les NAV recalculées en tiennent compte
+            applied = apply_corporate_actions(db)
+            if applied:
+                logger.info("Opérations sur titres : %d appliquées", applied)
+            written = materialize_nav(db)
+            logger.info("NAV journalières : %d lignes écrites", written)
+            purge_idempotency_keys(db)
+            return written
+        except Exception:
+            logger.exception("Échec du calcul des NAV journalières")
+            try:
+                db.rollback()
+            except Exception:
+                pass
+            return 0
+        finally:
+            try:
+                if locked:
+                    db.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _ADVISORY_LOCK_KEY})
+                    db.commit()
+            except Exception:
+                logger.exception("Verrou des NAV non libéré, connexion abandonnée")
+                db.invalidate()
+            finally:
+                db.close()
+
+    def _loop(self):
+        delay = 0.0
+        while not self._stop.wait(delay):
+            try:
+                self.run_once()
+            except Exception:
+                # le thread ne doit jamais s'arrêter : nouvel essai au prochain créneau
+                logger.exception("Échec du calcul planifié des NAV")
+            delay = self.seconds_until_next_run()
+
+
+def start_nav_scheduler(session_factory) -> NavScheduler | None:
+    """Démarre le calcul planifié des NAV, sauf si NAV_SCHEDULER_ENABLED=0."""
+    if os.environ.get("NAV_SCHEDULER_ENABLED", "1").lower() in ("0", "false", "no"):
+        return None
+    return NavScheduler(session_factory).start()
@@ -1,20 +1,28 @@
+from datetime import date
 from sqlalchemy.orm import Session
 from models.portfolio_model import Portfolio
+from models.holding_model import Holding
+from models.nav_model import PortfolioNavDaily
 from models.user_model import User
-from serializers.portfolio_serializer import PortfolioCreate, PortfolioUpdate
+from serializers.portfolio_serializer import PortfolioCreate, PortfolioRead, PortfolioUpdate
+from services.idempotency_service import claim_idempotency_key, store_idempotent_response
 
 
-def create_portfolio(db: Session, portfolio: PortfolioCreate, current_user: User):
+def create_portfolio(db: Session, portfolio: PortfolioCreate, current_user: User, idempotency_key: str | None = None):
+    replay = claim_idempotency_key(db, current_user.user_id, idempotency_key, "POST /portfolios/", portfolio)
+    if replay is not None:
+        return replay
     db_portfolio = Portfolio(
         user_id=current_user.user_id,          # <-- sécurisé
         last_amount=portfolio.last_amount,
         initial_amount=portfolio.initial_amount,
-        positions=portfolio.positions,
-        positions_size=portfolio.positions_size,
         portfolio_name=portfolio.portfolio_name,
         cash_balance=portfolio.cash_balance
     )
+    set_positions(db_portfolio, *requested_positions(portfolio) or ({}, {}))
     db.add(db_portfolio)
+    db.flush()
+    store_idempotent_response(db, current_user.user_id, idempotency_key, PortfolioRead.model_validate(db_portfolio, from_attributes=True))
     db.commit()
     db.refresh(db_portfolio)
     return db_portfolio
@@ -23,20 +31,105 @@ def create_portfolio(db: Session, portfolio: PortfolioCreate, current_user: User
 def get_portfolios_by_user(db: Session, user_id: int):
     return db.query(Portfolio).filter(Portfolio.user_id == user_id).all()
 
+def get_portfolio(db: Session, portfolio_id: int, user_id: int):
+    return db.query(Portfolio).filter(Portfolio.user_id == user_id).filter(Portfolio.portfolio_id == portfolio_id).first()
+
 def get_portfolios_by_user(db: Session, user_id: int, portfolio_id: int = None):
     query = db.query(Portfolio).filter(Portfolio.user_id == user_id)
     if portfolio_id is not None:
         query = query.filter(Portfolio.portfolio_id == portfolio_id)
     return query.all()
 
+def parse_positions(positions: str | None, positions_size: str | None) -> dict[str, float]:
+    """
+    Positions {"AAPL": 50.0, ...} à partir de l'ancien format texte
+    positions / positions_size (symboles mis en majuscules, doublons additionnés).
+    """
+    symbols = (positions or "").split(",")
+    sizes = (positions_size or "").split(",")
+    parsed = {}
+    for symbol, size in zip(symbols, sizes):
+        symbol = symbol.strip().upper()
+        if not symbol or not size.strip():
+            continue
+        parsed[symbol] = parsed.get(symbol, 0.0) + float(size)
+    return {s: q for s, q in parsed.items() if q != 0}
+
+def requested_positions(payload: PortfolioCreate | PortfolioUpdate) -> tuple[dict[str, float], dict[str, float]] | None:
+    """
+    Positions et coûts demandés par un create / update : la liste `holdings`
+    est prioritaire sur les champs texte. None si aucune position n'est fournie.
+    """
+    if payload.holdings:
+        positions, cost_basis = {}, {}
+        for h in payload.holdings:
+            symbol = h.symbol.strip().upper()
+            positions[symbol] = positions.get(symbol, 0.0) + h.quantity
+            if h.cost_basis is not None:
+                cost_basis[symbol] = cost_basis.get(symbol, 0.0) + h.cost_basis
+        return positions, cost_basis
+    if payload.holdings is not None:
+        return {}, {}
+    if payload.positions is not None and payload.positions_size is not None:
+        return parse_positions(payload.positions, payload.positions_size), {}
+    return None
+
+def get_positions(portfolio: Portfolio) -> dict[str, float]:
+    """Positions du portefeuille sous forme {"AAPL": 50.0, ...}."""
+    return {h.symbol: h.quantity for h in portfolio.holdings if h.quantity != 0}
+
+def get_holding(portfolio: Portfolio, symbol: str) -> Holding | None:
+    for holding in portfolio.holdings:
+        if holding.symbol == symbol:
+            return holding
+    return None
+
+def set_positions(portfolio: Portfolio, positions: dict[str, float], cost_basis: dict[str, float] | None = None):
+    """
+    Aligne les lignes holdings sur un dict {"AAPL": 50, ...} : seules les lignes
+    qui changent sont modifiées, les positions nulles sont supprimées.
+    Sans coût fourni, une ligne existante garde son prix de revient moyen.
+    """
+    cost_basis = cost_basis or {}
+    current = {h.symbol: h for h in portfolio.holdings}
+    for symbol, holding in current.items():
+        if not positions.get(symbol):
+            portfolio.holdings.remove(holding)
+    for symbol, quantity in positions.items():
+        if quantity == 0:
+            continue
+        holding = current.get(symbol)
+        if holding is None:
+            portfolio.holdings.append(Holding(symbol=symbol, quantity=quantity, cost_basis=cost_basis.get(symbol, 0.0)))
+            continue
+        if symbol in cost_basis:
+            holding.cost_basis = cost_basis[symbol]
+        elif holding.quantity:
+            holding.cost_basis = holding.cost_basis / holding.quantity * quantity
+        holding.quantity = quantity
+
+def invalidate_nav(db: Session, portfolio_id: int, from_date: date | None = None):
+    """
+    Supprime les snapshots de NAV devenus faux (à partir de `from_date`, ou tous) :
+    le job quotidien les recalcule à son prochain passage.
+    """
+    query = db.query(PortfolioNavDaily).filter(PortfolioNavDaily.portfolio_id == portfolio_id)
+    if from_date is not None:
+        query = query.filter(PortfolioNavDaily.nav_date >= from_date)
+    query.delete(synchronize_session=False)
+
 def update_portfolio(db: Session, portfolio_id: int, portfolio_update: PortfolioUpdate, user_id: int):
     portfolio= db.query(Portfolio).filter(Portfolio.user_id == user_id).filter(Portfolio.portfolio_id == portfolio_id).first()
     if not portfolio:
         return None
     portfolio.last_amount = portfolio_update.last_amount if portfolio_update.last_amount is not None else portfolio.last_amount
     portfolio.initial_amount = portfolio_update.initial_amount if portfolio_update.initial_amount is not None else portfolio.initial_amount
-    portfolio.positions = portfolio_update.positions if portfolio_update.positions is not None else portfolio.positions
-    portfolio.positions_size = portfolio_update.positions_size if portfolio_update.positions_size is not None else portfolio.positions_size
+    requested = requested_positions(portfolio_update)
+    if requested is not None:
+        set_positions(portfolio, *requested)
+    if requested is not None or portfolio_update.cash_balance is not None:
+        # positions d'origine ou cash modifiés : tout l'historique de NAV change
+        invalidate_nav(db, portfolio_id)
     portfolio.portfolio_name = portfolio_update.portfolio_name if portfolio_update.portfolio_name is not None else portfolio.portfolio_name
     portfolio.cash_balance = portfolio_update.cash_balance if portfolio_update.cash_balance is not None else portfolio.cash_balance
     db.commit()
@@ -0,0 +1,241 @@
+import copy
+import os
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from models.portfolio_model import Portfolio
+from models.trade_model import Trade
+from services.cache import TTLCache
+
+# Les ledgers sont complétés de façon incrémentale : le TTL ne sert qu'à libérer
+# la mémoire des portefeuilles inactifs.
+LEDGER_TTL_SECONDS = 6 * 3600
+ledgers = TTLCache(max_entries=int(os.environ.get("LEDGER_CACHE_MAX_ENTRIES", "1024")))
+
+# Borne supérieure pour la dernière barre : tous les trades connus sont inclus
+_END_OF_TIME = pd.Timestamp.max.floor("D").to_datetime64()
+
+
+def _series(times: np.ndarray, symbols: np.ndarray, quantities: np.ndarray) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+    """Par symbole : (dates des trades triées, quantité cumulée après chaque trade)."""
+    if not len(times):
+        return {}
+    codes, uniques = pd.factorize(symbols)
+    # tri stable : l'ordre chronologique est conservé à l'intérieur de chaque symbole
+    order = np.argsort(codes, kind="stable")
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+    return {
+        uniques[codes[chunk[0]]]: (times[chunk], np.cumsum(quantities[chunk]))
+        for chunk in np.split(order, bounds)
+    }
+
+
+def split_factors(times: np.ndarray, ex_dates: np.ndarray, ratios: np.ndarray) -> np.ndarray:
+    """
+    Facteur de division applicable à chaque trade : produit des ratios des
+    divisions dont la date d'effet est postérieure au trade (dates triées).
+    """
+    suffix = np.concatenate((np.cumprod(ratios[::-1])[::-1], [1.0]))
+    return suffix[np.searchsorted(ex_dates, times, side="right")]
+
+
+class Ledger:
+    """
+    Trades d'un portefeuille rejoués sous forme de tableaux NumPy triés par date.
+    Pour chaque symbole on garde les dates des trades et la quantité cumulée
+    après chacun : la position à n'importe quelle date se lit par searchsorted.
+    Immuable : `extend` renvoie un nouveau ledger, les lectures en cours ne
+    voient jamais un état partiel. `revision` reprend la révision du portefeuille
+    (Portfolio.ledger_revision) au moment où les trades ont été lus.
+    """
+
+    def __init__(self, revision: int = 0):
+        self.revision = revision
+        self.last_trade_id = 0
+        self.trade_ids = np.empty(0, dtype=np.int64)
+        self.times = np.empty(0, dtype="datetime64[ns]")
+        self.symbols = np.empty(0, dtype=object)
+        self.quantities = np.empty(0, dtype=np.float64)   # signées : achat > 0, vente < 0, dividende 0
+        self.cash_flows = np.empty(0, dtype=np.float64)   # achat < 0, vente et dividende > 0
+        self.cash = np.empty(0, dtype=np.float64)         # flux de cash cumulés
+        self.series: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self.full_replays = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def version(self) -> tuple[int, int, int]:
+        """Identifie l'état du ledger (révision, dernier trade intégré, nombre de trades)."""
+        return self.revision, self.last_trade_id, len(self.times)
+
+    def extend(self, trade_ids: np.ndarray, times: np.ndarray, symbols: np.ndarray,
+               quantities: np.ndarray, cash_flows: np.ndarray) -> "Ledger":
+        """
+        Intègre de nouveaux trades. S'ils sont tous postérieurs au dernier trade
+        connu, seuls les cumuls sont prolongés ; un trade antidaté déclenche un
+        re-tri complet, mais en mémoire, sans relire la base.
+        """
+        if not len(trade_ids):
+            return self
+        order = np.argsort(times, kind="stable")
+        trade_ids, times, symbols = trade_ids[order], times[order], symbols[order]
+        quantities, cash_flows = quantities[order], cash_flows[order]
+
+        ledger = Ledger(self.revision)
+        ledger.last_trade_id = max(self.last_trade_id, int(trade_ids.max()))
+        ledger.full_replays = self.full_replays
+        ledger.trade_ids = np.concatenate((self.trade_ids, trade_ids))
+        ledger.times = np.concatenate((self.times, times))
+        ledger.symbols = np.concatenate((self.symbols, symbols))
+        ledger.quantities = np.concatenate((self.quantities, quantities))
+        ledger.cash_flows = np.concatenate((self.cash_flows, cash_flows))
+
+        if len(self.times) and times[0] < self.times[-1]:
+            order = np.argsort(ledger.times, kind="stable")
+            ledger.trade_ids = ledger.trade_ids[order]
+            ledger.times = ledger.times[order]
+            ledger.symbols = ledger.symbols[order]
+            ledger.quantities = ledger.quantities[order]
+            ledger.cash_flows = ledger.cash_flows[order]
+            ledger.cash = np.cumsum(ledger.cash_flows)
+            ledger.series = _series(ledger.times, ledger.symbols, ledger.quantities)
+            ledger.full_replays += 1
+            return ledger
+
+        offset = self.cash[-1] if len(self.cash) else 0.0
+        ledger.cash = np.concatenate((self.cash, offset + np.cumsum(cash_flows)))
+        ledger.series = dict(self.series)
+        for symbol, (t, cum) in _series(times, symbols, quantities).items():
+            if symbol in ledger.series:
+                old_t, old_cum = ledger.series[symbol]
+                ledger.series[symbol] = (np.concatenate((old_t, t)), np.concatenate((old_cum, old_cum[-1] + cum)))
+            else:
+                ledger.series[symbol] = (t, cum)
+        return ledger
+
+    def split(self, symbol: str, ex_dates: np.ndarray, ratios: np.ndarray, revision: int) -> "Ledger":
+        """
+        Nouveau ledger, à la révision donnée, où les quantités du symbole antérieures
+        à chaque division sont multipliées par son ratio. Les flux de cash ne
+        changent pas (le prix est divisé d'autant) ; seule la série du symbole est recalculée.
+        """
+        ledger = copy.copy(self)
+        ledger.revision = revision
+        mask = self.symbols == symbol
+        if not mask.any():
+            return ledger
+        ledger.quantities = self.quantities.copy()
+        ledger.quantities[mask] *= split_factors(self.times[mask], ex_dates, ratios)
+        ledger.series = dict(self.series)
+        ledger.series[symbol] = (self.times[mask], np.cumsum(ledger.quantities[mask]))
+        return ledger
+
+    def net(self, symbol: str) -> float:
+        """Quantité nette achetée sur tout le ledger."""
+        series = self.series.get(symbol)
+        return float(series[1][-1]) if series is not None else 0.0
+
+    @property
+    def net_cash(self) -> float:
+        return float(self.cash[-1]) if len(self.cash) else 0.0
+
+    def positions_at(self, symbols: list[str], cutoffs: np.ndarray) -> np.ndarray:
+        """
+        Matrice (len(cutoffs) x len(symbols)) des quantités nettes issues des
+        trades strictement antérieurs à chaque date limite (triées).
+        """
+        out = np.zeros((len(cutoffs), len(symbols)), dtype=np.float64)
+        for j, symbol in enumerate(symbols):
+            series = self.series.get(symbol)
+            if series is None:
+                continue
+            t, cum = series
+            k = np.searchsorted(t, cutoffs, side="left")
+            out[:, j] = np.concatenate(([0.0], cum))[k]
+        return out
+
+    def cash_at(self, cutoffs: np.ndarray) -> np.ndarray:
+        """Flux de cash cumulés des trades strictement antérieurs à chaque date limite."""
+        k = np.searchsorted(self.times, cutoffs, side="left")
+        return np.concatenate(([0.0], self.cash))[k]
+
+
+def _load_trades(db: Session, portfolio_id: int, after_trade_id: int):
+    rows = db.query(
+        Trade.trade_id, Trade.trade_date, Trade.asset_name, Trade.action, Trade.quantity, Trade.price
+    ).filter(
+        Trade.portfolio_id == portfolio_id,
+        Trade.trade_id > after_trade_id
+    ).order_by(Trade.trade_id).all()
+    if not rows:
+        return None
+    df = pd.DataFrame(rows, columns=["trade_id", "trade_date", "asset_name", "action", "quantity", "price"])
+    times = pd.to_datetime(df["trade_date"]).to_numpy("datetime64[ns]")
+    actions = df["action"].str.upper().to_numpy()
+    raw_quantities = df["quantity"].to_numpy(dtype=np.float64)
+    prices = df["price"].to_numpy(dtype=np.float64)
+    # dividende : quantité = titres détenus, prix = montant par titre, position inchangée
+    dividend = actions == "DIVIDEND"
+    quantities = np.where(dividend, 0.0, np.where(actions == "SELL", -1.0, 1.0) * raw_quantities)
+    cash_flows = np.where(dividend, raw_quantities * prices, -quantities * prices)
+    symbols = df["asset_name"].str.strip().str.upper().to_numpy(dtype=object)
+    return df["trade_id"].to_numpy(dtype=np.int64), times, symbols, quantities, cash_flows
+
+
+def get_ledger(db: Session, portfolio_id: int) -> Ledger:
+    """
+    Ledger du portefeuille à jour : seuls les trades d'id supérieur au dernier
+    point de contrôle sont lus. Les trades d'un même portefeuille sont insérés
+    sous le verrou du portefeuille, leurs ids croissent donc dans l'ordre des commits.
+    Si la révision du portefeuille a changé (trades réécrits par une division,
+    éventuellement dans un autre processus), le ledger est relu entièrement.
+    """
+    revision = db.query(Portfolio.ledger_revision).filter(Portfolio.portfolio_id == portfolio_id).scalar() or 0
+    cached = ledgers.get_or_load(portfolio_id, lambda: Ledger(revision), LEDGER_TTL_SECONDS)
+    ledger = cached if cached.revision == revision else Ledger(revision)
+    new_trades = _load_trades(db, portfolio_id, ledger.last_trade_id)
+    if new_trades is not None:
+        ledger = ledger.extend(*new_trades)
+    if ledger is not cached:
+        ledgers.set(portfolio_id, ledger, LEDGER_TTL_SECONDS)
+    return ledger
+
+
+def bar_cutoffs(index: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Date limite (UTC naïf) de chaque barre : un trade compte dans une barre s'il
+    précède le début de la barre suivante ; la dernière barre inclut tout.
+    """
+    if index.tz is not None:
+        index = index.tz_convert("UTC").tz_localize(None)
+    values = index.to_numpy("datetime64[ns]")
+    cutoffs = np.empty_like(values)
+    cutoffs[:-1] = values[1:]
+    if len(cutoffs):
+        cutoffs[-1] = _END_OF_TIME
+    return cutoffs
+
+
+def base_positions(ledger: Ledger, current: dict[str, float]) -> dict[str, float]:
+    """
+    Positions d'origine (avant le premier trade) : positions actuelles moins
+    le net des trades. Couvre aussi les symboles entièrement revendus.
+    """
+    symbols = set(current) | set(ledger.series)
+    return {s: current.get(s, 0.0) - ledger.net(s) for s in symbols}
+
+
+def symbols_held_since(ledger: Ledger, base: dict[str, float], start: pd.Timestamp | None) -> list[str]:
+    """Symboles détenus à `start` ou échangés depuis (tous ceux jamais détenus si start est None)."""
+    symbols = sorted(base)
+    if start is None:
+        return symbols
+    cutoff = np.array([start.to_datetime64()])
+    at_start = np.array([base[s] for s in symbols]) + ledger.positions_at(symbols, cutoff)[0]
+    return [
+        s for s, qty in zip(symbols, at_start)
+        if qty != 0 or (s in ledger.series and ledger.series[s][0][-1] >= cutoff[0])
+    ]
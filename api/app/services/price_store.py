@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+# Dossier racine du stockage local (un sous-dossier par intervalle)
+PRICE_STORE_DIR = os.environ.get(
+    "PRICE_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "prices"),
+)
+
+# Seuls les intervalles journaliers et plus sont conservés sur disque :
+# l'historique intraday de Yahoo est court et change en permanence.
+STORED_INTERVALS = {"1d", "5d", "1wk", "1mo", "3mo"}
+
+_locks: dict[tuple[str, str], threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock(symbol: str, interval: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault((symbol, interval), threading.Lock())
+
+
+def _paths(symbol: str, interval: str) -> tuple[str, str]:
+    folder = os.path.join(PRICE_STORE_DIR, interval)
+    safe = symbol.replace("/", "_")
+    return os.path.join(folder, f"{safe}.parquet"), os.path.join(folder, f"{safe}.json")
+
+
+def read(symbol: str, interval: str) -> tuple[pd.DataFrame | None, dict]:
+    """
+    Lit l'historique stocké d'un symbole et ses métadonnées.
+    Retourne (None, {}) si rien n'a encore été stocké.
+    """
+    data_path, meta_path = _paths(symbol, interval)
+    if not os.path.exists(data_path):
+        return None, {}
+    try:
+        df = pd.read_parquet(data_path)
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        # Fichier corrompu ou écriture interrompue : on repart de zéro
+        return None, {}
+    return df, meta
+
+
+def write(symbol: str, interval: str, df: pd.DataFrame, covered_from: str | None):
+    """
+    Écrit l'historique complet d'un symbole de façon atomique.
+    `covered_from` est la date à partir de laquelle l'historique est complet
+    (None = tout l'historique disponible).
+    """
+    data_path, meta_path = _paths(symbol, interval)
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    meta = {"covered_from": covered_from, "fetched_at": datetime.utcnow().isoformat()}
+    with _lock(symbol, interval):
+        df.to_parquet(data_path + ".tmp")
+        os.replace(data_path + ".tmp", data_path)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+
+def merge(stored: pd.DataFrame | None, new: pd.DataFrame | None) -> pd.DataFrame | None:
+    """
+    Fusionne deux historiques ; en cas de chevauchement la nouvelle barre
+    l'emporte (la dernière barre du jour est mise à jour en cours de séance).
+    """
+    if stored is None or stored.empty:
+        return new
+    if new is None or new.empty:
+        return stored
+    if stored.index.tz is not None and new.index.tz is not None:
+        new = new.tz_convert(stored.index.tz)
+    df = pd.concat([stored, new])
+    df = df[~df.index.duplicated(keep="last")]
+    return df.sort_index()
+
+
+def delete(symbol: str, interval: str):
+    """Supprime l'historique stocké d'un symbole (relu à la source au prochain accès)."""
+    with _lock(symbol, interval):
+        for path in _paths(symbol, interval):
+            if os.path.exists(path):
+                os.remove(path)
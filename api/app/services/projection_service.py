@@ -0,0 +1,108 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from serializers.portfolio_serializer import ProjectionRequest
+from services.fx_service import PORTFOLIO_CURRENCY, convert_matrix
+from services.portfolio_service import get_portfolio, get_positions
+from services.risk_service import cov_factor
+from services.ticker_service import get_price_matrix
+
+TRADING_DAYS = 252
+# Taille des tirages par lot (chemins x pas x symboles) pour borner la mémoire d'un worker
+_CHUNK_CELLS = 4_000_000
+# Taille maximale de la matrice de richesse conservée (chemins x pas, float32)
+PROJECTION_MAX_CELLS = int(os.environ.get("PROJECTION_MAX_CELLS", "20000000"))
+
+
+def simulate_wealth(exposure: np.ndarray, drift: np.ndarray, factor: np.ndarray, steps: int, dt: float,
+                    paths: int, seed: int | None = None) -> np.ndarray:
+    """
+    Valeur des positions (chemins x pas) sous un mouvement brownien géométrique
+    corrélé : incréments log = drift*dt + sqrt(dt) * Z @ L.T, tirés par lots de
+    chemins (un seul produit matriciel par lot) pour borner la mémoire.
+    `drift` est la moyenne annuelle des rendements log, L @ L.T la covariance annuelle.
+    """
+    wealth = np.empty((paths, steps), dtype=np.float32)
+    chunk = max(1, _CHUNK_CELLS // (steps * len(exposure)))
+    sizes = [min(chunk, paths - i) for i in range(0, paths, chunk)]
+    scaled = factor.T * np.sqrt(dt)
+    for i, (n, child) in enumerate(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes)))):
+        rng = np.random.default_rng(child)
+        increments = rng.standard_normal((n, steps, len(exposure))) @ scaled
+        increments += drift * dt
+        np.cumsum(increments, axis=1, out=increments)
+        np.exp(increments, out=increments)
+        offset = i * chunk
+        wealth[offset:offset + n] = increments @ exposure
+    return wealth
+
+
+def get_portfolio_projection(db: Session, portfolio_id: int, user_id: int, request: ProjectionRequest):
+    """
+    Projection de la valeur du portefeuille : dérive et covariance estimées sur
+    l'historique des positions actuelles (cours convertis dans la devise du cash,
+    risque de change compris), cash constant, bandes de percentiles
+    à chaque pas. Retourne None si le portefeuille n'appartient pas à l'utilisateur.
+    """
+    for p in request.percentiles:
+        if not 0 <= p <= 100:
+            raise HTTPException(status_code=400, detail=f"Percentile invalide : {p}")
+    steps = max(1, round(request.horizon_years * request.steps_per_year))
+    if request.paths * steps > PROJECTION_MAX_CELLS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Trop de points simulés ({request.paths} chemins x {steps} pas, maximum {PROJECTION_MAX_CELLS}).",
+        )
+    portfolio = get_portfolio(db, portfolio_id, user_id)
+    if not portfolio:
+        return None
+
+    cash = float(portfolio.cash_balance or 0)
+    positions = get_positions(portfolio)
+    dt = 1 / request.steps_per_year
+    times = np.arange(1, steps + 1) * dt
+    today = datetime.utcnow().date()
+    projection = {
+        "portfolio_id": portfolio_id,
+        "start_value": cash,
+        "paths": request.paths,
+        "dates": [(today + timedelta(days=round(t * 365.25))).isoformat() for t in times],
+        "percentiles": {},
+        "estimates": {},
+        "missing": [],
+    }
+
+    if positions:
+        closes = get_price_matrix(sorted(positions), request.period, "1d", fill="ffill")
+        closes = convert_matrix(closes, PORTFOLIO_CURRENCY, request.period, "1d")
+        projection["missing"] = [s for s in sorted(positions) if s not in closes.columns]
+        prices = closes.to_numpy(dtype=np.float64)
+        if len(prices) < 3:
+            raise HTTPException(status_code=400, detail="Historique trop court pour estimer la dérive et la volatilité.")
+        log_returns = np.diff(np.log(prices), axis=0)
+        drift = log_returns.mean(axis=0) * TRADING_DAYS
+        cov = np.atleast_2d(np.cov(log_returns, rowvar=False)) * TRADING_DAYS
+        exposure = np.array([positions[s] for s in closes.columns]) * prices[-1]
+        wealth = simulate_wealth(exposure, drift, cov_factor(cov), steps, dt, request.paths, request.seed) + cash
+        projection["start_value"] = round(float(exposure.sum()) + cash, 2)
+        projection["estimates"] = {
+            s: {"drift": round(float(d), 6), "volatility": round(float(np.sqrt(v)), 6)}
+            for s, d, v in zip(closes.columns, drift, np.diag(cov))
+        }
+    else:
+        wealth = np.full((request.paths, steps), cash, dtype=np.float32)
+
+    bands = np.percentile(wealth, request.percentiles, axis=0)
+    projection["percentiles"] = {
+        f"{p:g}": np.round(band, 2).tolist() for p, band in zip(request.percentiles, bands)
+    }
+    final = wealth[:, -1]
+    projection["final"] = {
+        "mean": round(float(final.mean()), 2),
+        "probability_of_loss": round(float((final < projection["start_value"]).mean()), 4),
+    }
+    return projection
@@ -0,0 +1,162 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from models.portfolio_model import Portfolio
+from serializers.portfolio_serializer import RebalanceRequest
+from services.fx_service import PORTFOLIO_CURRENCY, convert_matrix
+from services.portfolio_service import get_portfolio, get_positions, invalidate_nav
+from services.ticker_service import get_price_matrix
+from services.trade_service import apply_trade, lock_portfolio
+
+_WEIGHT_EPSILON = 1e-9
+
+
+def validate_targets(targets: dict[str, float]) -> dict[str, float]:
+    """Poids cibles par symbole (majuscules), positifs et de somme au plus 1 : le reste reste en cash."""
+    weights = {}
+    for symbol, weight in targets.items():
+        symbol = symbol.strip().upper()
+        if not symbol or weight < 0:
+            raise HTTPException(status_code=400, detail=f"Poids cible invalide pour {symbol or '?'} : {weight}")
+        weights[symbol] = weights.get(symbol, 0.0) + weight
+    if sum(weights.values()) > 1 + _WEIGHT_EPSILON:
+        raise HTTPException(status_code=400, detail="La somme des poids cibles dépasse 1.")
+    return weights
+
+
+def latest_prices(symbols: list[str]) -> dict[str, float]:
+    """
+    Dernière clôture de chaque symbole (cache des historiques), convertie dans la
+    devise du cash et des trades ; 400 si un symbole n'a pas de cotation.
+    """
+    try:
+        closes = get_price_matrix(symbols, "5d", "1d", fill="ffill")
+    except HTTPException as e:
+        if e.status_code != 404:
+            raise
+        closes = pd.DataFrame()
+    closes = convert_matrix(closes, PORTFOLIO_CURRENCY, "5d", "1d")
+    last = closes.iloc[-1] if not closes.empty else {}
+    missing = [s for s in symbols if s not in closes.columns or not np.isfinite(last[s])]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Aucune cotation pour : {', '.join(missing)}")
+    return {s: float(last[s]) for s in symbols}
+
+
+def target_shares(quantities: np.ndarray, prices: np.ndarray, weights: np.ndarray, cash: float) -> np.ndarray:
+    """
+    Nombre entier de titres visé par symbole : plancher de poids x valeur totale
+    / prix (jamais plus de cash que disponible), puis un titre de plus pour les
+    plus gros écarts à la cible tant que le cash restant le permet.
+    """
+    total = cash + float(quantities @ prices)
+    wanted = weights * total
+    shares = np.floor(wanted / prices + _WEIGHT_EPSILON)
+    leftover = total - float(shares @ prices)
+    for i in np.argsort(-(wanted - shares * prices)):
+        if weights[i] > 0 and prices[i] <= leftover + _WEIGHT_EPSILON and (shares[i] + 1) * prices[i] <= wanted[i] + prices[i] / 2:
+            shares[i] += 1
+            leftover -= prices[i]
+    return shares
+
+
+def plan_rebalance(portfolio: Portfolio, weights: dict[str, float], prices: dict[str, float]) -> dict:
+    """
+    Ordres minimaux (une ligne par symbole à modifier, en titres entiers) pour
+    atteindre les poids cibles ; les symboles détenus hors cible sont vendus.
+    Les ventes sont listées avant les achats pour financer ces derniers.
+    """
+    positions = get_positions(portfolio)
+    symbols = sorted(set(positions) | set(weights))
+    quantities = np.array([positions.get(s, 0.0) for s in symbols])
+    price = np.array([prices[s] for s in symbols])
+    weight = np.array([weights.get(s, 0.0) for s in symbols])
+    cash = float(portfolio.cash_balance or 0)
+
+    shares = target_shares(quantities, price, weight, cash)
+    delta = shares - quantities
+    total = cash + float(quantities @ price)
+    orders = [
+        {
+            "symbol": symbols[i],
+            "action": "SELL" if delta[i] < 0 else "BUY",
+            "quantity": float(abs(delta[i])),
+            "price": float(price[i]),
+            "value": round(float(abs(delta[i]) * price[i]), 2),
+        }
+        for i in np.flatnonzero(np.abs(delta) > _WEIGHT_EPSILON)
+    ]
+    orders.sort(key=lambda o: o["action"] != "SELL")
+    cash_after = cash - float(delta @ price)
+
+    def weights_of(q):
+        return {s: round(float(v / total), 6) for s, v in zip(symbols, q * price)} if total > 0 else {}
+
+    return {
+        "portfolio_id": portfolio.portfolio_id,
+        "total_value": round(total, 2),
+        "orders": orders,
+        "cash_after": round(cash_after, 2),
+        "weights_before": weights_of(quantities),
+        "weights_after": weights_of(shares),
+        "executed": False,
+    }
+
+
+def _execute(db: Session, portfolio: Portfolio, plan: dict):
+    now = datetime.utcnow()
+    for order in plan["orders"]:
+        db.add(apply_trade(portfolio, order["symbol"], order["action"], order["price"], order["quantity"], now, "Rééquilibrage"))
+    if plan["orders"]:
+        invalidate_nav(db, portfolio.portfolio_id, now.date())
+    plan["executed"] = True
+
+
+def rebalance_portfolios(db: Session, portfolio_ids: list[int], user_id: int, request: RebalanceRequest) -> list[dict]:
+    """
+    Plans de rééquilibrage de plusieurs portefeuilles avec un seul appel de prix.
+    Avec `execute`, les portefeuilles sont verrouillés (dans l'ordre des ids),
+    les plans calculés sur l'état verrouillé et tous les ordres passés dans
+    une seule transaction : tout ou rien.
+    """
+    weights = validate_targets(request.targets)
+    try:
+        if request.execute:
+            portfolios = [lock_portfolio(db, pid, user_id) for pid in sorted(portfolio_ids)]
+        else:
+            portfolios = db.query(Portfolio).filter(
+                Portfolio.portfolio_id.in_(portfolio_ids), Portfolio.user_id == user_id
+            ).order_by(Portfolio.portfolio_id).all()
+        symbols = sorted({s for p in portfolios for s in get_positions(p)} | set(weights))
+        prices = latest_prices(symbols) if symbols else {}
+        plans = [plan_rebalance(p, weights, prices) for p in portfolios]
+        if request.execute:
+            for portfolio, plan in zip(portfolios, plans):
+                _execute(db, portfolio, plan)
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return plans
+
+
+def rebalance_portfolio(db: Session, portfolio_id: int, user_id: int, request: RebalanceRequest):
+    """Plan (et exécution éventuelle) pour un portefeuille, None s'il n'appartient pas à l'utilisateur."""
+    if not get_portfolio(db, portfolio_id, user_id):
+        return None
+    return rebalance_portfolios(db, [portfolio_id], user_id, request)[0]
+
+
+def rebalance_user_portfolios(db: Session, user_id: int, request: RebalanceRequest, portfolio_ids: list[int] | None = None) -> list[dict]:
+    """Rééquilibre tous les portefeuilles de l'utilisateur (ou ceux demandés) avec les mêmes cibles."""
+    owned = [pid for (pid,) in db.query(Portfolio.portfolio_id).filter(Portfolio.user_id == user_id).all()]
+    if portfolio_ids is not None:
+        unknown = sorted(set(portfolio_ids) - set(owned))
+        if unknown:
+            raise HTTPException(status_code=404, detail=f"Portfolio not found: {', '.join(map(str, unknown))}")
+        owned = portfolio_ids
+    return rebalance_portfolios(db, owned, user_id, request)
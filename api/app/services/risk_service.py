@@ -0,0 +1,198 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from services.cache import TTLCache
+from services.fx_service import PORTFOLIO_CURRENCY, convert_matrix
+from services.portfolio_service import get_portfolio, get_positions
+from services.ticker_service import get_price_matrix
+
+# Résultats gardés tant que positions et prix (empreinte de la matrice) sont inchangés
+RISK_TTL_SECONDS = 24 * 3600
+risk_cache = TTLCache(max_entries=int(os.environ.get("RISK_CACHE_MAX_ENTRIES", "256")))
+
+# Pool de processus pour les gros livres : désactivé avec RISK_MAX_WORKERS <= 1
+RISK_MAX_WORKERS = int(os.environ.get("RISK_MAX_WORKERS", "0"))
+RISK_POOL_MIN_CELLS = int(os.environ.get("RISK_POOL_MIN_CELLS", "50000000"))
+# Taille des tirages par lot (chemins x symboles) pour borner la mémoire
+_CHUNK_CELLS = 4_000_000
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn : pas de fork d'un processus qui a déjà des threads (uvicorn, planificateur)
+            _pool = ProcessPoolExecutor(max_workers=RISK_MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def cov_factor(cov: np.ndarray) -> np.ndarray:
+    """
+    Facteur L tel que L @ L.T = cov : Cholesky, ou décomposition propre avec
+    valeurs propres négatives ramenées à 0 si la matrice n'est pas définie
+    positive (historique court, titres parfaitement corrélés).
+    """
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        values, vectors = np.linalg.eigh(cov)
+        return vectors * np.sqrt(np.clip(values, 0, None))
+
+
+def simulate_losses(mu: np.ndarray, factor: np.ndarray, exposure: np.ndarray, horizon: int,
+                    paths: int, seed: np.random.SeedSequence) -> np.ndarray:
+    """
+    Pertes simulées sur `paths` chemins en un seul produit matriciel :
+    rendements log ~ N(mu*h, cov*h), perte = -(exp(X) - 1) @ exposition.
+    """
+    rng = np.random.default_rng(seed)
+    z = rng.standard_normal((paths, len(mu)))
+    log_returns = mu * horizon + np.sqrt(horizon) * (z @ factor.T)
+    return -np.expm1(log_returns) @ exposure
+
+
+def monte_carlo_losses(mu: np.ndarray, factor: np.ndarray, exposure: np.ndarray, horizon: int,
+                       simulations: int, seed: int | None = None) -> np.ndarray:
+    """
+    Tirages par lots de taille fixe, chacun avec sa propre graine dérivée de
+    `seed` : le résultat est identique que les lots tournent ici ou dans le pool.
+    """
+    chunk = max(1000, _CHUNK_CELLS // max(len(mu), 1))
+    sizes = [min(chunk, simulations - i) for i in range(0, simulations, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if RISK_MAX_WORKERS > 1 and len(sizes) > 1 and simulations * len(mu) >= RISK_POOL_MIN_CELLS:
+        pool = _get_pool()
+        futures = [pool.submit(simulate_losses, mu, factor, exposure, horizon, n, s) for n, s in zip(sizes, seeds)]
+        return np.concatenate([f.result() for f in futures])
+    return np.concatenate([simulate_losses(mu, factor, exposure, horizon, n, s) for n, s in zip(sizes, seeds)])
+
+
+def tail_measures(losses: np.ndarray, confidence_levels: list[float]) -> list[dict]:
+    """VaR (quantile des pertes) et CVaR (perte moyenne au-delà) pour chaque niveau."""
+    out = []
+    for level in confidence_levels:
+        var = float(np.quantile(losses, level))
+        tail = losses[losses >= var]
+        out.append({"confidence": level, "var": round(var, 2), "cvar": round(float(tail.mean()), 2)})
+    return out
+
+
+def parametric_measures(mean: float, std: float, confidence_levels: list[float]) -> list[dict]:
+    """VaR / CVaR variance-covariance : pertes supposées normales N(-mean, std)."""
+    normal = NormalDist()
+    out = []
+    for level in confidence_levels:
+        z = normal.inv_cdf(level)
+        out.append({
+            "confidence": level,
+            "var": round(-mean + z * std, 2),
+            "cvar": round(-mean + std * normal.pdf(z) / (1 - level), 2),
+        })
+    return out
+
+
+def _fingerprint(matrix: pd.DataFrame) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(",".join(map(str, matrix.columns)).encode())
+    digest.update(matrix.index.asi8.tobytes())
+    digest.update(np.ascontiguousarray(matrix.to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+def compute_risk(closes: pd.DataFrame, quantities: np.ndarray, confidence_levels: list[float],
+                 horizon: int = 1, simulations: int = 20000, seed: int | None = None) -> dict:
+    """
+    Risque d'un portefeuille à positions fixes à partir d'une matrice de clôtures
+    (dates x symboles, sans trous). Pertes exprimées en montant, positives.
+    """
+    prices = closes.to_numpy(dtype=np.float64)
+    exposure = quantities * prices[-1]
+    log_returns = np.diff(np.log(prices), axis=0)
+    if len(log_returns) <= horizon:
+        raise HTTPException(status_code=400, detail="Historique trop court pour l'horizon demandé.")
+
+    # historique : variations sur `horizon` séances (fenêtres glissantes)
+    horizon_returns = prices[horizon:] / prices[:-horizon] - 1
+    historical = -(horizon_returns @ exposure)
+
+    mu = log_returns.mean(axis=0)
+    cov = np.atleast_2d(np.cov(log_returns, rowvar=False))
+    mean_pnl = float(exposure @ mu) * horizon
+    std_pnl = float(np.sqrt(max(exposure @ cov @ exposure, 0.0) * horizon))
+
+    simulated = monte_carlo_losses(mu, cov_factor(cov), exposure, horizon, simulations, seed)
+    return {
+        "exposure": round(float(exposure.sum()), 2),
+        "positions": {s: round(float(e), 2) for s, e in zip(closes.columns, exposure)},
+        "observations": int(len(log_returns)),
+        "historical": tail_measures(historical, confidence_levels),
+        "parametric": parametric_measures(mean_pnl, std_pnl, confidence_levels),
+        "monte_carlo": tail_measures(simulated, confidence_levels),
+    }
+
+
+def get_portfolio_risk(
+    db: Session,
+    portfolio_id: int,
+    user_id: int,
+    confidence_levels: list[float],
+    horizon: int = 1,
+    period: str = "1y",
+    simulations: int = 20000,
+    seed: int | None = None,
+    currency: str = PORTFOLIO_CURRENCY,
+):
+    """
+    VaR / CVaR historique, paramétrique et Monte Carlo des positions actuelles,
+    estimées sur `period` de clôtures journalières. Les prix sont convertis dans
+    `currency` avant l'estimation : le risque de change est inclus.
+    Retourne None si le portefeuille n'appartient pas à l'utilisateur.
+    """
+    for level in confidence_levels:
+        if not 0 < level < 1:
+            raise HTTPException(status_code=400, detail=f"Niveau de confiance invalide : {level}")
+    portfolio = get_portfolio(db, portfolio_id, user_id)
+    if not portfolio:
+        return None
+    positions = get_positions(portfolio)
+    risk = {
+        "portfolio_id": portfolio_id,
+        "currency": currency,
+        "as_of": None,
+        "horizon_days": horizon,
+        "simulations": simulations,
+        "missing": [],
+    }
+    if not positions:
+        return risk
+
+    closes = get_price_matrix(sorted(positions), period, "1d", fill="ffill")
+    risk["missing"] = [s for s in sorted(positions) if s not in closes.columns]
+    if closes.empty:
+        return risk
+    closes = convert_matrix(closes, currency, period, "1d")
+    key = (
+        tuple(sorted(positions.items())),
+        tuple(sorted(confidence_levels)), horizon, period, simulations, seed,
+        _fingerprint(closes),
+    )
+    quantities = np.array([positions[s] for s in closes.columns], dtype=np.float64)
+    result = risk_cache.get_or_load(
+        key,
+        lambda: compute_risk(closes, quantities, sorted(confidence_levels), horizon, simulations, seed),
+        RISK_TTL_SECONDS,
+    )
+    risk["as_of"] = closes.index[-1].isoformat()
+    return {**risk, **result}
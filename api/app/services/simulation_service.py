@@ -0,0 +1,159 @@
+import os
+from statistics import NormalDist
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from serializers.portfolio_serializer import SimulationRequest
+from services.fx_service import PORTFOLIO_CURRENCY, convert_matrix
+from services.portfolio_service import get_portfolio
+from services.ticker_service import get_price_matrix
+
+# Nombre maximal de variantes par requête
+SIMULATION_MAX_SCENARIOS = int(os.environ.get("SIMULATION_MAX_SCENARIOS", "1000"))
+_EPSILON = 1e-6
+
+
+def _closes(symbols: list[str], period: str):
+    """
+    Clôtures converties dans la devise du cash et des trades, lues dans le cache
+    ou le stockage local uniquement (change compris) : aucun appel amont.
+    """
+    try:
+        closes = get_price_matrix(symbols, period, "1d", fill="ffill", offline=True)
+        return convert_matrix(closes, PORTFOLIO_CURRENCY, period, "1d", offline=True)
+    except HTTPException as e:
+        if e.status_code != 404:
+            raise
+        return None
+
+
+def simulate_trades(quantities: np.ndarray, costs: np.ndarray, cash: float, symbols: np.ndarray,
+                    actions: np.ndarray, sizes: np.ndarray, prices: np.ndarray, steps: np.ndarray):
+    """
+    Rejoue les trades de K scénarios en parallèle, au coût moyen, une étape à la
+    fois (le j-ième trade de tous les scénarios en une opération vectorisée).
+    Tableaux d'entrée (K x J) : indices de symbole, achat (True) / vente,
+    quantités et prix ; `steps` donne le nombre de trades de chaque scénario.
+    Retourne quantités et coûts (K x S), cash, P&L réalisé et la première
+    étape refusée (-1 si le scénario est valide), comme apply_trade le ferait.
+    Un trade refusé n'est pas appliqué : cash et positions restent positifs.
+    """
+    k = len(steps)
+    qty = np.repeat(quantities[None, :], k, axis=0)
+    cost = np.repeat(costs[None, :], k, axis=0)
+    cash = np.full(k, cash, dtype=np.float64)
+    realized = np.zeros(k)
+    rejected = np.full(k, -1)
+    for j in range(symbols.shape[1]):
+        rows = np.flatnonzero(steps > j)
+        cols, buy, q, p = symbols[rows, j], actions[rows, j], sizes[rows, j], prices[rows, j]
+        amount = q * p
+        held = qty[rows, cols]
+        refused = np.where(buy, cash[rows] + _EPSILON < amount, held + _EPSILON < q)
+        rejected[rows[refused & (rejected[rows] < 0)]] = j
+        keep = ~refused
+        rows, cols, buy, q, p, amount, held = (a[keep] for a in (rows, cols, buy, q, p, amount, held))
+        average = np.divide(cost[rows, cols], held, out=np.zeros_like(held), where=held > 0)
+        sold = np.where(buy, 0.0, np.minimum(q, held))
+        realized[rows] += sold * (p - average)
+        cost[rows, cols] += np.where(buy, amount, -average * sold)
+        qty[rows, cols] = held + np.where(buy, q, -sold)
+        cash[rows] += np.where(buy, -amount, sold * p)
+    return qty, cost, cash, realized, rejected
+
+
+def _states(symbols, qty, cost, cash, realized, last, mu, cov, confidence) -> list[dict]:
+    """Cash, valeur, poids, P&L latent et VaR / CVaR paramétriques de chaque scénario."""
+    priced = np.isfinite(last)
+    exposure = np.where(priced, qty * np.nan_to_num(last), 0.0)
+    positions_value = exposure.sum(axis=1)
+    total = cash + positions_value
+    unrealized = np.where(priced, exposure - cost, 0.0).sum(axis=1)
+    mean = exposure @ mu
+    std = np.sqrt(np.maximum(np.einsum("ks,st,kt->k", exposure, cov, exposure), 0.0))
+    normal = NormalDist()
+    z = normal.inv_cdf(confidence)
+    var = -mean + z * std
+    cvar = -mean + std * normal.pdf(z) / (1 - confidence)
+    weights = np.divide(exposure, total[:, None], out=np.zeros_like(exposure), where=total[:, None] > 0)
+    return [
+        {
+            "cash": round(float(cash[i]), 2),
+            "positions_value": round(float(positions_value[i]), 2),
+            "total_value": round(float(total[i]), 2),
+            "quantities": {s: float(q) for s, q in zip(symbols, qty[i]) if abs(q) > _EPSILON},
+            "weights": {s: round(float(w), 6) for s, w, q in zip(symbols, weights[i], qty[i]) if abs(q) > _EPSILON},
+            "unrealized": round(float(unrealized[i]), 2),
+            "realized": round(float(realized[i]), 2),
+            "var": round(float(var[i]), 2),
+            "cvar": round(float(cvar[i]), 2),
+        }
+        for i in range(len(cash))
+    ]
+
+
+def simulate_portfolio(db: Session, portfolio_id: int, user_id: int, request: SimulationRequest):
+    """
+    État projeté du portefeuille après des trades hypothétiques, pour un ou
+    plusieurs scénarios : lecture seule en base, prix du cache ou du stockage
+    local uniquement. Retourne None si le portefeuille n'appartient pas à l'utilisateur.
+    """
+    scenarios = request.scenarios if request.scenarios is not None else [request.trades]
+    if not 0 < len(scenarios) <= SIMULATION_MAX_SCENARIOS:
+        raise HTTPException(status_code=400, detail=f"Entre 1 et {SIMULATION_MAX_SCENARIOS} scénarios par requête.")
+    for trades in scenarios:
+        for trade in trades:
+            if trade.action.upper() not in ("BUY", "SELL"):
+                raise HTTPException(status_code=400, detail="L'action doit être BUY ou SELL.")
+    portfolio = get_portfolio(db, portfolio_id, user_id)
+    if not portfolio:
+        return None
+
+    holdings = {h.symbol: h for h in portfolio.holdings}
+    symbols = sorted(set(holdings) | {t.asset_name.strip().upper() for trades in scenarios for t in trades})
+    closes = _closes(symbols, request.period) if symbols else None
+    columns = list(closes.columns) if closes is not None else []
+    last = np.array([closes[s].iloc[-1] if s in columns else np.nan for s in symbols])
+    returns = np.zeros((0, len(symbols)))
+    if closes is not None and len(closes) > 2:
+        returns = np.full((len(closes) - 1, len(symbols)), 0.0)
+        index = [symbols.index(s) for s in columns]
+        returns[:, index] = np.diff(np.log(closes.to_numpy(dtype=np.float64)), axis=0)
+    mu = returns.mean(axis=0) if len(returns) else np.zeros(len(symbols))
+    cov = np.atleast_2d(np.cov(returns, rowvar=False)) if len(returns) > 1 else np.zeros((len(symbols),) * 2)
+
+    # scénarios mis en matrices (K x J), complétées au-delà du nombre de trades de chacun
+    position = {s: i for i, s in enumerate(symbols)}
+    width = max((len(t) for t in scenarios), default=0)
+    shape = (len(scenarios), width)
+    sym_idx, buys = np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=bool)
+    sizes, prices = np.zeros(shape), np.zeros(shape)
+    steps = np.array([len(t) for t in scenarios])
+    for i, trades in enumerate(scenarios):
+        for j, trade in enumerate(trades):
+            symbol = trade.asset_name.strip().upper()
+            price = trade.price if trade.price is not None else last[position[symbol]]
+            if not np.isfinite(price):
+                raise HTTPException(status_code=400, detail=f"Aucun cours en cache pour {symbol} : indiquez un prix.")
+            sym_idx[i, j], buys[i, j] = position[symbol], trade.action.upper() == "BUY"
+            sizes[i, j], prices[i, j] = trade.quantity, price
+
+    quantities = np.array([holdings[s].quantity if s in holdings else 0.0 for s in symbols], dtype=np.float64)
+    costs = np.array([holdings[s].cost_basis if s in holdings else 0.0 for s in symbols], dtype=np.float64)
+    cash = float(portfolio.cash_balance or 0)
+    qty, cost, cash_after, realized, rejected = simulate_trades(quantities, costs, cash, sym_idx, buys, sizes, prices, steps)
+
+    current = _states(symbols, quantities[None, :], costs[None, :], np.array([cash]), np.zeros(1), last, mu, cov, request.confidence)[0]
+    states = _states(symbols, qty, cost, cash_after, realized, last, mu, cov, request.confidence)
+    for state, step in zip(states, rejected):
+        state["valid"] = bool(step < 0)
+        state["rejected_trade"] = int(step) if step >= 0 else None
+    return {
+        "portfolio_id": portfolio_id,
+        "as_of": closes.index[-1].isoformat() if closes is not None and len(closes) else None,
+        "missing": [s for s in symbols if s not in columns],
+        "current": current,
+        "scenarios": states,
+    }
@@ -1,70 +1,525 @@
 from fastapi import HTTPException
-import yfinance as yf
-import math
-
-def clean_json_values(data):
-    if isinstance(data, dict):
-        return {k: clean_json_values(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [clean_json_values(v) for v in data]
-    elif isinstance(data, float):
-        if math.isnan(data) or math.isinf(data):
-            return None
-        return data
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import orjson
+import io
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+
+from services import price_store
+from services.cache import TTLCache
+from services.downsampling import downsample_frames
+from services.market_data import get_provider
+
+logger = logging.getLogger(__name__)
+
+# Délai minimal (en secondes) avant de redemander la dernière barre d'un historique stocké
+STORE_REFRESH_SECONDS = int(os.environ.get("PRICE_STORE_REFRESH", "900"))
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+_PERIOD_RE = re.compile(r"^(\d+)(d|wk|mo|y)$")
+
+# Durée de vie en cache selon l'intervalle : courte en intraday, plus longue pour
+# les barres journalières (les clôtures passées sont de toute façon dans price_store,
+# seule la barre du jour peut encore bouger).
+CACHE_TTL_SECONDS = {
+    "1m": 30, "2m": 60, "5m": 120, "15m": 300, "30m": 300,
+    "60m": 600, "90m": 600, "1h": 600,
+    "1d": 900, "5d": 3600, "1wk": 3600, "1mo": 6 * 3600, "3mo": 6 * 3600,
+}
+DEFAULT_CACHE_TTL = 300
+# Intervalles d'au plus une séance : une période en jours se compte en séances
+_SESSION_INTERVALS = {"1m", "2m", "5m", "15m", "30m", "60m", "90m", "1h", "1d"}
+
+
+def _frames_weight(frames: dict[str, pd.DataFrame]) -> int:
+    return int(sum(df.memory_usage(index=True).sum() for df in frames.values()))
+
+
+frames_cache = TTLCache(
+    max_entries=int(os.environ.get("TICKER_CACHE_MAX_ENTRIES", "512")),
+    max_bytes=int(os.environ.get("TICKER_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    weigher=_frames_weight,
+)
+
+
+def frame_columns(df: pd.DataFrame) -> dict[str, list]:
+    """
+    Colonnes d'un historique prêtes pour le JSON, sans parcourir chaque cellule en Python :
+    les NaN/inf sont remplacés par None via un masque NumPy, uniquement si besoin.
+    """
+    columns = {df.index.name or "Date": df.index.to_pydatetime().tolist()}
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if values.dtype.kind == "f":
+            invalid = ~np.isfinite(values)
+            if invalid.any():
+                values = values.astype(object)
+                values[invalid] = None
+        columns[str(col)] = values.tolist()
+    return columns
+
+
+def iso_timestamps(index: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Dates ISO 8601 (avec décalage horaire si l'index est localisé), formatées
+    par NumPy en une passe : même texte que la sérialisation des datetime par orjson.
+    """
+    local = index.tz_localize(None) if index.tz is not None else index
+    ticks = local.to_numpy("datetime64[ns]")
+    unit = "s" if (ticks.view("i8") % 10**9 == 0).all() else "us"
+    stamps = np.datetime_as_string(ticks, unit=unit)
+    if index.tz is None:
+        return stamps
+    utc = index.tz_convert("UTC").tz_localize(None).to_numpy("datetime64[ns]")
+    minutes = (ticks.view("i8") - utc.view("i8")) // (60 * 10**9)
+    # peu de décalages distincts (heure d'été / d'hiver) : un suffixe par valeur
+    offsets, position = np.unique(minutes, return_inverse=True)
+    suffixes = np.array([f"{'+' if m >= 0 else '-'}{abs(m) // 60:02d}:{abs(m) % 60:02d}" for m in offsets])
+    return np.char.add(stamps, suffixes[position])
+
+
+def frame_records_json(df: pd.DataFrame) -> str:
+    """
+    Historique en JSON ligne par ligne [{"Date": ..., "Close": ...}, ...], écrit
+    par pandas (to_json) à partir des tableaux de colonnes, sans dict Python
+    par ligne ; NaN/inf deviennent null.
+    """
+    frame = pd.DataFrame(
+        {df.index.name or "Date": iso_timestamps(df.index)} | {str(col): df[col].to_numpy() for col in df.columns},
+        copy=False,
+    )
+    return frame.to_json(orient="records", double_precision=15)
+
+
+def frames_json(frames: dict[str, pd.DataFrame], layout: str = "records") -> bytes:
+    """Corps JSON de format_frames, assemblé sans repasser par des objets Python pour "records"."""
+    if layout == "columnar":
+        return orjson.dumps(format_frames(frames, layout))
+    parts = [orjson.dumps(t) + b":" + frame_records_json(df).encode() for t, df in frames.items()]
+    return b"{" + b",".join(parts) + b"}"
+
+
+def format_frames(frames: dict[str, pd.DataFrame], layout: str = "records") -> dict:
+    """
+    "records" : une liste de lignes {"Date": ..., "Close": ...} par symbole (format historique).
+    "columnar" : un tableau par colonne {"Date": [...], "Close": [...]} par symbole.
+    """
+    if layout == "columnar":
+        return {t: frame_columns(df) for t, df in frames.items()}
+    return {t: orjson.loads(frame_records_json(df)) for t, df in frames.items()}
+
+
+def frame_record_batch(symbol: str, df: pd.DataFrame) -> pa.RecordBatch:
+    """
+    Historique d'un symbole en RecordBatch Arrow. Les colonnes float64 sont
+    reprises sans copie ; les dates sont en UTC et toutes les valeurs en float64
+    pour que tous les symboles partagent le même schéma.
+    """
+    index = df.index.tz_convert("UTC") if df.index.tz is not None else df.index.tz_localize("UTC")
+    arrays = {
+        "Symbol": pa.DictionaryArray.from_arrays(pa.array(np.zeros(len(df), dtype=np.int32)), pa.array([symbol])),
+        df.index.name or "Date": pa.array(index),
+    }
+    for col in df.columns:
+        arrays[str(col)] = pa.array(df[col].to_numpy(dtype=np.float64))
+    return pa.record_batch(arrays)
+
+
+def iter_arrow_stream(frames: dict[str, pd.DataFrame]):
+    """
+    Flux Arrow IPC envoyé au fil de l'eau : un RecordBatch par symbole.
+    """
+    sink = io.BytesIO()
+    writer = None
+    for symbol, df in frames.items():
+        batch = frame_record_batch(symbol, df)
+        if writer is None:
+            writer = pa.ipc.new_stream(sink, batch.schema)
+        writer.write_batch(batch)
+        yield _drain(sink)
+    if writer is not None:
+        writer.close()
+        yield _drain(sink)
+
+
+def frames_to_parquet(frames: dict[str, pd.DataFrame]) -> bytes:
+    table = pa.Table.from_batches([frame_record_batch(s, df) for s, df in frames.items()])
+    sink = io.BytesIO()
+    pq.write_table(table, sink)
+    return sink.getvalue()
+
+
+def _drain(sink: io.BytesIO) -> bytes:
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
     return data
-def get_tickers_data(
+
+
+def parse_symbols(ticker: str) -> list[str]:
+    """Découpe "aapl, msft" en ["AAPL", "MSFT"] (sans doublons, ordre conservé)."""
+    symbols = [t.strip().upper() for t in ticker.split(",") if t.strip()]
+    return list(dict.fromkeys(symbols))
+
+
+def requested_window(period: str, start: str | None) -> tuple[pd.Timestamp | None, int | None]:
+    """
+    Convertit (period, start) en date de début absolue.
+    Retourne (début, nb_séances) : pour les périodes en jours ("5d"), yfinance
+    renvoie les N dernières séances, on ne garde donc que les barres de celles-ci.
+    Début à None = tout l'historique.
+    """
+    if start:
+        try:
+            return pd.Timestamp(start).tz_localize(None).normalize(), None
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Date de début invalide : {start}")
+    if period == "max":
+        return None, None
+    today = pd.Timestamp(datetime.utcnow().date())
+    if period == "ytd":
+        return pd.Timestamp(today.year, 1, 1), None
+    match = _PERIOD_RE.match(period)
+    if not match:
+        raise HTTPException(status_code=400, detail=f"Période invalide : {period}")
+    n, unit = int(match.group(1)), match.group(2)
+    if unit == "d":
+        # marge pour les week-ends et jours fériés
+        return today - pd.DateOffset(days=2 * n + 7), n
+    if unit == "wk":
+        return today - pd.DateOffset(weeks=n), None
+    if unit == "mo":
+        return today - pd.DateOffset(months=n), None
+    return today - pd.DateOffset(years=n), None
+
+
+def _last_sessions(df: pd.DataFrame, sessions: int | None, interval: str) -> pd.DataFrame:
+    """
+    Barres des `sessions` dernières séances présentes : une barre par séance en
+    journalier, toutes les barres de ces séances en intraday. Les intervalles
+    d'une semaine et plus ne sont bornés que par la date de début.
+    """
+    if sessions is None or interval not in _SESSION_INTERVALS:
+        return df
+    days = df.index.normalize()
+    kept = days.unique()
+    if len(kept) <= sessions:
+        return df
+    return df[days >= kept[-sessions]]
+
+
+def _since(df: pd.DataFrame, start: pd.Timestamp | None) -> pd.DataFrame:
+    if start is None:
+        return df
+    if df.index.tz is not None:
+        start = start.tz_localize(df.index.tz)
+    return df[df.index >= start]
+
+
+def _fetch(
+    symbols: list[str],
+    interval: str,
+    start: pd.Timestamp | None = None,
+    end: pd.Timestamp | None = None,
+    period: str = "max",
+) -> dict[str, pd.DataFrame]:
+    """
+    Téléchargement amont via le fournisseur configuré (MARKET_DATA_PROVIDER).
+    """
+    return get_provider().batch_history(symbols, interval, start=start, end=end, period=period)
+
+
+def _fetch_with_store(symbols: list[str], interval: str, start: pd.Timestamp | None) -> dict[str, pd.DataFrame]:
+    """
+    Lit d'abord le stockage local puis ne télécharge que les plages manquantes :
+    le début si la période demandée remonte plus loin que l'historique stocké,
+    et la fin depuis la dernière barre stockée. Les symboles qui ont le même
+    trou sont regroupés dans un seul appel amont ; chaque groupe sait s'il
+    comble le début de l'historique (la couverture stockée n'est étendue que par ceux-là).
+    Si la source amont est indisponible, on sert ce qui est déjà stocké.
+    """
+    now = datetime.utcnow()
+    stored = {}
+    groups: dict[tuple, list[str]] = {}  # (début, fin, comble le début) -> symboles
+    for s in symbols:
+        df, meta = price_store.read(s, interval)
+        stored[s] = (df, meta)
+        if df is None or df.empty:
+            groups.setdefault((start, None, True), []).append(s)
+            continue
+        covered_from = pd.Timestamp(meta["covered_from"]) if meta.get("covered_from") else None
+        if covered_from is not None and start is None:
+            # tout l'historique est demandé : un seul téléchargement complet
+            groups.setdefault((None, None, True), []).append(s)
+            continue
+        if covered_from is not None and start < covered_from:
+            # trou en tête d'historique
+            groups.setdefault((start, covered_from, True), []).append(s)
+        if now - datetime.fromisoformat(meta["fetched_at"]) > timedelta(seconds=STORE_REFRESH_SECONDS):
+            # trou en fin d'historique (la dernière barre est re-téléchargée car elle a pu bouger)
+            last_day = pd.Timestamp(df.index[-1].date())
+            groups.setdefault((last_day, None, False), []).append(s)
+
+    fetched: dict[str, list[pd.DataFrame]] = {s: [] for s in symbols}
+    refreshed, head_filled = set(), set()
+    for (g_start, g_end, head), group in groups.items():
+        try:
+            result = _fetch(group, interval, start=g_start, end=g_end)
+        except Exception as e:
+            logger.warning("Téléchargement impossible pour %s (%s), utilisation du stockage local", group, e)
+            continue
+        for s in group:
+            refreshed.add(s)
+            if head:
+                head_filled.add(s)
+            if s in result:
+                fetched[s].append(result[s])
+
+    frames = {}
+    for s in symbols:
+        df, meta = stored[s]
+        for new in fetched[s]:
+            df = price_store.merge(df, new)
+        if df is None or df.empty:
+            continue
+        if s in refreshed:
+            covered_from = meta.get("covered_from") if meta else None
+            if s in head_filled or not meta:
+                covered_from = start.isoformat() if start is not None else None
+            price_store.write(s, interval, df, covered_from)
+        frames[s] = _since(df, start)
+    return frames
+
+
+def _load_frames(
+    symbols: list[str],
+    period: str,
+    interval: str,
+    start: str | None,
+) -> dict[str, pd.DataFrame]:
+    window_start, sessions = requested_window(period, start)
+    if interval in price_store.STORED_INTERVALS:
+        frames = _fetch_with_store(symbols, interval, window_start)
+    elif start:
+        frames = _fetch(symbols, interval, start=window_start)
+    else:
+        frames = _fetch(symbols, interval, period=period)
+    frames = {s: _last_sessions(df, sessions, interval) for s, df in frames.items()}
+    return {s: df for s, df in frames.items() if not df.empty}
+
+
+def _load_stored_frames(
+    symbols: list[str],
+    period: str,
+    interval: str,
+    start: str | None,
+) -> dict[str, pd.DataFrame]:
+    """Historiques lus uniquement dans le stockage local, sans appel amont."""
+    if interval not in price_store.STORED_INTERVALS:
+        return {}
+    window_start, sessions = requested_window(period, start)
+    frames = {}
+    for s in symbols:
+        df, _ = price_store.read(s, interval)
+        if df is None:
+            continue
+        df = _last_sessions(_since(df, window_start), sessions, interval)
+        if not df.empty:
+            frames[s] = df
+    return frames
+
+
+def get_tickers_frames(
     ticker: str,
     period: str = "5d",
     interval: str = "1d",
     start: str | None = None,
-):
+    offline: bool = False,
+) -> dict[str, pd.DataFrame]:
+    """
+    Historique OHLCV de chaque symbole demandé, sous forme de DataFrames indexés par date.
+    Les intervalles journaliers et plus passent par le stockage local (price_store),
+    et les résultats sont gardés en mémoire (frames_cache) : les DataFrames
+    renvoyés sont partagés et ne doivent pas être modifiés.
+    Avec `offline`, seuls le cache et le stockage local sont lus (aucun appel
+    amont, rien n'est mis en cache).
+    """
+    symbols = parse_symbols(ticker)
+    if not symbols:
+        raise HTTPException(status_code=400, detail="Aucun ticker fourni")
+    key = (tuple(sorted(symbols)), None if start else period, interval, start)
+    if offline:
+        frames = frames_cache.get(key)
+        if frames is None:
+            frames = _load_stored_frames(sorted(symbols), period, interval, start)
+    else:
+        frames = frames_cache.get_or_load(
+            key,
+            lambda: _load_frames(sorted(symbols), period, interval, start),
+            CACHE_TTL_SECONDS.get(interval, DEFAULT_CACHE_TTL),
+        )
+    return {s: frames[s] for s in symbols if s in frames}
+
+
+def invalidate_symbol(symbol: str):
+    """
+    Oublie l'historique d'un symbole (après une division, les cours stockés ne
+    sont plus ajustés) : fichiers de price_store de chaque intervalle et
+    entrées de frames_cache qui le contiennent. Relu à la source au prochain accès.
+    """
+    symbol = symbol.strip().upper()
+    for interval in price_store.STORED_INTERVALS:
+        price_store.delete(symbol, interval)
+    frames_cache.invalidate_matching(lambda key: symbol in key[0])
+
+
+def get_tickers_frames_or_404(
+    ticker: str,
+    period: str = "5d",
+    interval: str = "1d",
+    start: str | None = None,
+    max_points: int | None = None,
+    downsample: str = "lttb",
+    offline: bool = False,
+) -> dict[str, pd.DataFrame]:
+    """
+    Comme get_tickers_frames, mais lève une 404 si aucun historique n'est trouvé.
+    Avec `max_points`, chaque historique est réduit côté serveur (LTTB pour les
+    courbes, agrégation OHLC pour les chandeliers).
+    """
     try:
-        # Vérifie si plusieurs tickers ont été passés
+        frames = get_tickers_frames(ticker, period, interval, start, offline)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not frames:
         if ',' in ticker:
-            tickers = [t.strip().upper() for t in ticker.split(',')]
-            if start:
-                data = yf.download(
-                    tickers=" ".join(tickers),
-                    start=start,
-                    interval=interval,
-                    group_by="ticker",
-                    auto_adjust=True,
-                    threads=True
-                )
-            else:
-                data = yf.download(
-                    tickers=" ".join(tickers),
-                    period=period,
-                    interval=interval,
-                    group_by="ticker",
-                    auto_adjust=True,
-                    threads=True
-                )
-            if data.empty:
-                raise HTTPException(status_code=404, detail="Aucune donnée trouvée pour les tickers fournis")
-
-            # Formatage propre du retour
-            data_dict = {}
-            for t in tickers:
-                if t in data.columns.levels[0]:
-                    df_t = data[t].reset_index()
-                    data_dict[t] = df_t.to_dict(orient="records")
-            data_dict = clean_json_values(data_dict)
-            return data_dict
-
-        # Cas d’un seul ticker
+            raise HTTPException(status_code=404, detail="Aucune donnée trouvée pour les tickers fournis")
+        raise HTTPException(status_code=404, detail=f"Aucune donnée trouvée pour {ticker.strip().upper()}")
+    if max_points is not None:
+        frames = downsample_frames(frames, max_points, downsample)
+    return frames
+
+
+FILL_POLICIES = ("ffill", "drop", "none")
+
+
+def get_price_matrix(
+    symbols: list[str],
+    period: str = "1y",
+    interval: str = "1d",
+    start: str | None = None,
+    field: str = "Close",
+    fill: str = "ffill",
+    fill_limit: int | None = None,
+    offline: bool = False,
+) -> pd.DataFrame:
+    """
+    Matrice dense float64 (dates x symboles) d'un champ OHLCV sur l'union des
+    calendriers de cotation. Les barres journalières et plus sont ramenées à
+    leur date locale pour que des places de fuseaux différents (New York,
+    Paris...) tombent sur la même ligne ; l'intraday est aligné en UTC.
+
+    Politiques de remplissage :
+    - "ffill" : dernière valeur connue (au plus `fill_limit` lignes), les lignes
+      précédant la première cotation d'un symbole sont retirées ;
+    - "drop" : seules les dates où tous les symboles cotent sont gardées ;
+    - "none" : union des calendriers, trous laissés à NaN.
+    Avec `offline`, seuls le cache et le stockage local sont lus.
+    """
+    if fill not in FILL_POLICIES:
+        raise HTTPException(status_code=400, detail=f"Politique de remplissage invalide : {fill}")
+    frames = get_tickers_frames_or_404(",".join(symbols), period, interval, start, offline=offline)
+    series = {}
+    for s, df in frames.items():
+        if field not in df.columns:
+            raise HTTPException(status_code=400, detail=f"Champ inconnu : {field}")
+        index = df.index
+        if interval in price_store.STORED_INTERVALS:
+            index = (index.tz_localize(None) if index.tz is not None else index).normalize()
         else:
-            ticker = ticker.strip().upper()
-            t = yf.Ticker(ticker)
-            if start:
-                hist = t.history(interval=interval, start=start, auto_adjust=True)
-            else:
-                hist = t.history(period=period, interval=interval, auto_adjust=True)
-
-            if hist.empty:
-                raise HTTPException(status_code=404, detail=f"Aucune donnée trouvée pour {ticker}")
-            hist = clean_json_values(hist)
-            return {ticker: hist.reset_index().to_dict(orient="records")}
+            index = index.tz_convert("UTC") if index.tz is not None else index.tz_localize("UTC")
+        values = pd.Series(df[field].to_numpy(dtype=np.float64), index=index)
+        series[s] = values[~values.index.duplicated(keep="last")]
+    # jointure externe sur les dates : union des calendriers
+    matrix = pd.concat(series, axis=1, join="outer").sort_index()
+    if fill == "ffill":
+        matrix = matrix.ffill(limit=fill_limit)
+        complete = matrix.notna().all(axis=1).to_numpy()
+        matrix = matrix.iloc[complete.argmax():] if complete.any() else matrix.iloc[:0]
+    elif fill == "drop":
+        matrix = matrix.dropna()
+    return matrix
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+def matrix_payload(matrix: pd.DataFrame) -> dict:
+    """Matrice prête pour le JSON : NaN remplacés par None via un masque NumPy."""
+    values = matrix.to_numpy(dtype=np.float64)
+    invalid = ~np.isfinite(values)
+    if invalid.any():
+        values = values.astype(object)
+        values[invalid] = None
+    return {
+        "dates": matrix.index.to_pydatetime().tolist(),
+        "symbols": [str(c) for c in matrix.columns],
+        "values": values.tolist(),
+    }
+
+
+def matrix_record_batch(matrix: pd.DataFrame) -> pa.RecordBatch:
+    """Matrice en RecordBatch Arrow : une colonne Date puis une colonne float64 par symbole."""
+    arrays = {"Date": pa.array(matrix.index)}
+    for col in matrix.columns:
+        arrays[str(col)] = pa.array(matrix[col].to_numpy(dtype=np.float64))
+    return pa.record_batch(arrays)
+
+
+def matrix_to_arrow_stream(matrix: pd.DataFrame) -> bytes:
+    batch = matrix_record_batch(matrix)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue()
+
+
+def matrix_to_parquet(matrix: pd.DataFrame) -> bytes:
+    sink = io.BytesIO()
+    pq.write_table(pa.Table.from_batches([matrix_record_batch(matrix)]), sink)
+    return sink.getvalue()
+
+
+def get_tickers_data(
+    ticker: str,
+    period: str = "5d",
+    interval: str = "1d",
+    start: str | None = None,
+    layout: str = "records",
+    max_points: int | None = None,
+    downsample: str = "lttb",
+):
+    frames = get_tickers_frames_or_404(ticker, period, interval, start, max_points, downsample)
+    return format_frames(frames, layout)
+
+
+def get_quote(ticker: str) -> dict:
+    symbol = ticker.strip().upper()
+    quote = get_provider().quote(symbol)
+    if quote is None:
+        raise HTTPException(status_code=404, detail=f"Aucune cotation trouvée pour {symbol}")
+    return quote
+
+
+def lookup_symbol(ticker: str) -> dict:
+    symbol = ticker.strip().upper()
+    info = get_provider().lookup(symbol)
+    if info is None:
+        raise HTTPException(status_code=404, detail=f"Ticker inconnu : {symbol}")
+    return info
@@ -0,0 +1,55 @@
+import csv
+import io
+from datetime import date
+from typing import Iterator
+
+import orjson
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from models.trade_model import Trade
+from services.trade_service import user_trades_query
+
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+# Lignes lues par aller-retour du curseur serveur (et par morceau envoyé)
+EXPORT_BATCH_ROWS = 2000
+_EXPORT_COLUMNS = (Trade.trade_id, Trade.portfolio_id, Trade.asset_name, Trade.action,
+                   Trade.price, Trade.quantity, Trade.trade_date, Trade.description)
+EXPORT_FIELDS = [c.key for c in _EXPORT_COLUMNS]
+
+
+def export_media_type(format: str) -> str:
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format inconnu : {format} (csv ou ndjson)")
+    return EXPORT_FORMATS[format]
+
+
+def _csv_chunk(rows) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows((*row[:6], row[6].isoformat() if row[6] else None, row[7]) for row in rows)
+    return buffer.getvalue()
+
+
+def _ndjson_chunk(rows) -> bytes:
+    return b"".join(orjson.dumps(dict(zip(EXPORT_FIELDS, row))) + b"\n" for row in rows)
+
+
+def iter_trades_export(db: Session, user_id: int, format: str, portfolio_id: int | None = None,
+                       start: date | None = None, end: date | None = None) -> Iterator[str | bytes]:
+    """
+    Trades de l'utilisateur par ordre chronologique, sérialisés par morceaux au
+    fil d'un curseur côté serveur (yield_per) : mémoire constante quel que soit
+    le volume, premier morceau envoyé dès le premier lot lu.
+    """
+    query = user_trades_query(user_id, *_EXPORT_COLUMNS, portfolio_id=portfolio_id, start=start, end=end)
+    query = query.order_by(Trade.trade_date, Trade.trade_id).execution_options(yield_per=EXPORT_BATCH_ROWS)
+    if format == "csv":
+        yield ",".join(EXPORT_FIELDS) + "\r\n"
+    serialize = _csv_chunk if format == "csv" else _ndjson_chunk
+    try:
+        for rows in db.execute(query).partitions():
+            yield serialize(rows)
+    finally:
+        # fin du curseur nommé (export complet ou client déconnecté)
+        db.rollback()
@@ -0,0 +1,247 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import queue
+import tempfile
+import threading
+from datetime import date, datetime
+from typing import IO, AsyncIterator, Iterator
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from models.trade_model import Trade
+from serializers.trade_serializer import TradeCreate
+from services.portfolio_service import invalidate_nav, set_positions
+from services.trade_service import CASH_EPSILON, lock_portfolio, settle_trade
+
+IMPORT_FORMATS = ("csv", "ndjson")
+# Au-delà, les lignes validées en attente du COPY passent sur disque
+IMPORT_SPOOL_BYTES = int(os.environ.get("TRADE_IMPORT_SPOOL_BYTES", str(8 * 1024 * 1024)))
+# Taille des lots insérés quand COPY n'est pas disponible
+_INSERT_BATCH = 5000
+_COPY_COLUMNS = ("portfolio_id", "asset_name", "action", "price", "quantity", "trade_date", "description")
+# Morceaux du corps en attente de lecture : au-delà, l'envoi attend l'import
+_PIPE_CHUNKS = 16
+_PIPE_POLL_SECONDS = 0.1
+
+
+def spool() -> IO[bytes]:
+    """Fichier temporaire en mémoire, basculé sur disque au-delà de IMPORT_SPOOL_BYTES."""
+    return tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+
+
+class BodyPipe(io.RawIOBase):
+    """
+    Corps de requête transmis au thread d'import au fil de sa réception.
+    La file est bornée : la réception attend la validation, et s'arrête dès
+    que l'import a terminé (erreur sur une ligne comprise).
+    """
+
+    def __init__(self, max_chunks: int = _PIPE_CHUNKS):
+        self._chunks: queue.Queue = queue.Queue(max_chunks)
+        self._pending = memoryview(b"")
+        self._eof = False
+        self.finished = threading.Event()   # l'import ne lit plus
+        self.broken = threading.Event()     # la réception a échoué
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            if self._eof:
+                return 0
+            try:
+                chunk = self._chunks.get(timeout=_PIPE_POLL_SECONDS)
+            except queue.Empty:
+                if self.broken.is_set():
+                    raise HTTPException(status_code=400, detail="Envoi du fichier interrompu.")
+                continue
+            if chunk is None:
+                self._eof = True
+            else:
+                self._pending = memoryview(chunk)
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def offer(self, chunk: bytes | None) -> bool:
+        """Ajoute un morceau (None : fin du corps) s'il y a de la place, sans attendre."""
+        try:
+            self._chunks.put_nowait(chunk)
+            return True
+        except queue.Full:
+            return False
+
+    def put(self, chunk: bytes | None) -> bool:
+        """Ajoute un morceau en attendant de la place ; False si l'import ne lit plus."""
+        while not self.finished.is_set():
+            try:
+                self._chunks.put(chunk, timeout=_PIPE_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+async def import_trades_stream(db: Session, stream: AsyncIterator[bytes], format: str, user_id: int) -> dict:
+    """
+    Import d'un corps reçu en flux : les lignes sont validées par un thread au
+    fur et à mesure de la réception, une ligne invalide interrompt l'envoi sans
+    attendre la fin du fichier.
+    """
+    pipe = BodyPipe()
+
+    def run():
+        try:
+            return import_trades(db, io.BufferedReader(pipe), format, user_id)
+        finally:
+            pipe.finished.set()
+
+    task = asyncio.ensure_future(run_in_threadpool(run))
+    try:
+        async for chunk in stream:
+            if chunk and not (pipe.offer(chunk) or await run_in_threadpool(pipe.put, chunk)):
+                break
+        else:
+            if not pipe.offer(None):
+                await run_in_threadpool(pipe.put, None)
+    except BaseException:
+        pipe.broken.set()
+        await asyncio.wait([task])
+        raise
+    return await task
+
+
+def import_format(format: str | None, content_type: str | None) -> str:
+    """Format explicite, sinon déduit du Content-Type (CSV par défaut)."""
+    if format is None:
+        format = "ndjson" if content_type and "json" in content_type else "csv"
+    format = format.lower()
+    if format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format inconnu : {format} (csv ou ndjson)")
+    return format
+
+
+def _rows(body: IO[bytes], format: str) -> Iterator[tuple[int, dict]]:
+    """Lignes brutes du fichier avec leur numéro, lues au fil de l'eau."""
+    text = io.TextIOWrapper(body, encoding="utf-8-sig", newline="")
+    if format == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            # champs vides d'une ligne CSV : valeurs absentes
+            yield reader.line_num, {k: v for k, v in row.items() if k is not None and v not in ("", None)}
+        return
+    for line_num, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Ligne {line_num} : JSON invalide.")
+        if not isinstance(row, dict):
+            raise HTTPException(status_code=400, detail=f"Ligne {line_num} : un objet JSON est attendu.")
+        yield line_num, row
+
+
+class _PortfolioState:
+    """Portefeuille verrouillé et positions en cours d'import (cash, quantités, prix de revient)."""
+
+    def __init__(self, portfolio):
+        self.portfolio = portfolio
+        self.cash = float(portfolio.cash_balance or 0)
+        self.positions = {h.symbol: [h.quantity, h.cost_basis] for h in portfolio.holdings}
+        self.first_date: date | None = None
+        self.count = 0
+
+
+def _copy(db: Session, rows: IO[str]):
+    """Insère les lignes validées : COPY FROM STDIN sur PostgreSQL, sinon insertions par lots."""
+    connection = db.connection()
+    if connection.dialect.driver == "psycopg2":
+        with connection.connection.driver_connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY trades ({', '.join(_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", rows)
+        return
+    batch = []
+    for values in csv.reader(rows):
+        row = dict(zip(_COPY_COLUMNS, values))
+        row.update(portfolio_id=int(row["portfolio_id"]), price=float(row["price"]), quantity=float(row["quantity"]),
+                   trade_date=datetime.fromisoformat(row["trade_date"]), description=row["description"] or None)
+        batch.append(row)
+        if len(batch) == _INSERT_BATCH:
+            db.execute(insert(Trade), batch)
+            batch = []
+    if batch:
+        db.execute(insert(Trade), batch)
+
+
+def import_trades(db: Session, body: IO[bytes], format: str, user_id: int) -> dict:
+    """
+    Importe un historique de trades (CSV avec en-tête ou NDJSON, mêmes champs que
+    POST /trades/) en une seule transaction. Les lignes sont validées au fil de
+    la lecture et appliquées dans l'ordre du fichier avec les contrôles d'un
+    trade unitaire ; chaque portefeuille est vérifié et verrouillé une seule fois.
+    Les lignes validées sont écrites dans un fichier temporaire puis chargées
+    par COPY : la mémoire ne dépend pas de la taille du fichier.
+    """
+    states: dict[int, _PortfolioState] = {}
+    now = datetime.utcnow()
+    try:
+        with spool() as validated:
+            out = io.TextIOWrapper(validated, encoding="utf-8", newline="")
+            writer = csv.writer(out)
+            for line_num, row in _rows(body, format):
+                try:
+                    trade = TradeCreate(**row)
+                    state = states.get(trade.portfolio_id)
+                    if state is None:
+                        state = states[trade.portfolio_id] = _PortfolioState(
+                            lock_portfolio(db, trade.portfolio_id, user_id)
+                        )
+                    symbol = trade.asset_name.strip().upper()
+                    action = trade.action.upper()
+                    position = state.positions.setdefault(symbol, [0.0, 0.0])
+                    state.cash, position[0], position[1] = settle_trade(
+                        state.cash, position[0], position[1], action, trade.price, trade.quantity
+                    )
+                except ValidationError as e:
+                    error = e.errors()[0]
+                    field = ".".join(str(part) for part in error["loc"])
+                    raise HTTPException(status_code=400, detail=f"Ligne {line_num} : {field} : {error['msg']}")
+                except HTTPException as e:
+                    raise HTTPException(status_code=e.status_code, detail=f"Ligne {line_num} : {e.detail}")
+                trade_date = trade.trade_date or now
+                writer.writerow((trade.portfolio_id, symbol, action, trade.price, trade.quantity,
+                                 trade_date.isoformat(), trade.description))
+                if state.first_date is None or trade_date.date() < state.first_date:
+                    state.first_date = trade_date.date()
+                state.count += 1
+            if not states:
+                raise HTTPException(status_code=400, detail="Aucun trade à importer.")
+            out.seek(0)
+            _copy(db, out)
+
+        for portfolio_id, state in states.items():
+            portfolio = state.portfolio
+            portfolio.cash_balance = state.cash
+            set_positions(
+                portfolio,
+                {s: q for s, (q, _) in state.positions.items() if abs(q) >= CASH_EPSILON},
+                {s: c for s, (_, c) in state.positions.items()},
+            )
+            invalidate_nav(db, portfolio_id, state.first_date)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return {
+        "imported": sum(state.count for state in states.values()),
+        "portfolios": {portfolio_id: state.count for portfolio_id, state in states.items()},
+    }
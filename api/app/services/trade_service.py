@@ -1,58 +1,243 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from sqlalchemy import Select, case, func, select, tuple_
 from sqlalchemy.orm import Session
 from models.trade_model import Trade
-from serializers.trade_serializer import TradeCreate
-from fastapi import Depends
+from serializers.trade_serializer import TradeCreate, TradeRead
+from fastapi import Depends, HTTPException
 from database import get_db
+from datetime import date, datetime, timedelta
 from models.portfolio_model import Portfolio
 from models.user_model import User
+from models.holding_model import Holding
+from services.portfolio_service import get_holding, invalidate_nav
+from services.idempotency_service import claim_idempotency_key, store_idempotent_response
+
+# Tolérance sur les comparaisons de montants en float
+CASH_EPSILON = 1e-6
+# Taille par défaut d'une page de trades
+TRADES_PAGE_SIZE = 100
+
+
+def settle_trade(cash: float, held: float, cost: float, action: str, price: float, quantity: float) -> tuple[float, float, float]:
+    """
+    Contrôles et effet d'un trade BUY / SELL sur le cash, la quantité détenue du
+    titre et son prix de revient (sortie au coût moyen). Retourne le nouvel état.
+    """
+    if action not in ("BUY", "SELL"):
+        raise HTTPException(status_code=400, detail="L'action doit être BUY ou SELL.")
+    if quantity <= 0 or price <= 0:
+        raise HTTPException(status_code=400, detail="La quantité et le prix doivent être positifs.")
+    amount = price * quantity
+    if action == "BUY":
+        if cash + CASH_EPSILON < amount:
+            raise HTTPException(status_code=400, detail="Pas assez de cash pour cet achat.")
+        return cash - amount, held + quantity, cost + amount
+    if held <= 0:
+        raise HTTPException(status_code=400, detail="Vous ne possédez pas ce titre.")
+    if held < quantity:
+        raise HTTPException(status_code=400, detail="Pas assez de titres pour cette vente.")
+    return cash + amount, held - quantity, cost - cost * quantity / held
+
 
-def create_trade(db: Session, trade: TradeCreate):
-    db_trade = Trade(
-        portfolio_id=trade.portfolio_id,
-        asset_name=trade.asset_name.upper(),
-        action=trade.action.upper(),
-        price=trade.price,
-        quantity=trade.quantity,
-        trade_date=trade.trade_date,
-        description=trade.description
+def apply_trade(
+    portfolio: Portfolio,
+    asset_name: str,
+    action: str,
+    price: float,
+    quantity: int,
+    trade_date: datetime | None = None,
+    description: str | None = None,
+) -> Trade:
+    """
+    Applique un trade à un portefeuille déjà verrouillé : vérifie le cash (achat)
+    ou les titres détenus (vente), met à jour le cash et la ligne holdings du titre et renvoie le
+    Trade à insérer. Ne fait ni add ni commit : c'est à l'appelant de gérer la transaction.
+    """
+    symbol = asset_name.strip().upper()
+    action = action.upper()
+    holding = get_holding(portfolio, symbol)
+    portfolio.cash_balance, quantity_after, cost_after = settle_trade(
+        portfolio.cash_balance,
+        holding.quantity if holding is not None else 0.0,
+        holding.cost_basis if holding is not None else 0.0,
+        action, price, quantity,
     )
-    db.add(db_trade)
-    db.commit()
+    if abs(quantity_after) < CASH_EPSILON:
+        portfolio.holdings.remove(holding)
+    else:
+        if holding is None:
+            holding = Holding(symbol=symbol, quantity=0, cost_basis=0)
+            portfolio.holdings.append(holding)
+        holding.quantity, holding.cost_basis = quantity_after, cost_after
+
+    return Trade(
+        portfolio_id=portfolio.portfolio_id,
+        asset_name=symbol,
+        action=action,
+        price=price,
+        quantity=quantity,
+        trade_date=trade_date or datetime.utcnow(),
+        description=description
+    )
+
+
+def lock_portfolio(db: Session, portfolio_id: int, user_id: int) -> Portfolio:
+    """
+    SELECT ... FOR UPDATE sur la ligne du portefeuille : les trades concurrents
+    sur le même portefeuille attendent la fin de la transaction en cours.
+    """
+    portfolio = db.query(Portfolio).filter(
+        Portfolio.portfolio_id == portfolio_id,
+        Portfolio.user_id == user_id
+    ).with_for_update().first()
+    if not portfolio:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return portfolio
+
+
+def create_trade(db: Session, trade: TradeCreate, user_id: int, idempotency_key: str | None = None):
+    """
+    Exécute un trade en une seule transaction : verrouillage du portefeuille,
+    contrôle du cash / des titres, mise à jour du portefeuille et insertion du trade.
+    Avec une clé d'idempotence, un rejeu renvoie le trade d'origine sans rien réexécuter.
+    """
+    try:
+        replay = claim_idempotency_key(db, user_id, idempotency_key, "POST /trades/", trade)
+        if replay is not None:
+            return replay
+        portfolio = lock_portfolio(db, trade.portfolio_id, user_id)
+        db_trade = apply_trade(
+            portfolio,
+            trade.asset_name,
+            trade.action,
+            trade.price,
+            trade.quantity,
+            trade.trade_date,
+            trade.description
+        )
+        db.add(db_trade)
+        invalidate_nav(db, portfolio.portfolio_id, db_trade.trade_date.date())
+        db.flush()
+        store_idempotent_response(db, user_id, idempotency_key, TradeRead.model_validate(db_trade, from_attributes=True))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
     db.refresh(db_trade)
     return db_trade
 
 
-def get_trades(
-    db: Session = Depends(get_db),
-    user_id: int = None
-):
-    # 1️⃣ Récupérer les IDs de portefeuilles de l’utilisateur connecté
-    portfolio_ids = db.query(Portfolio.portfolio_id).filter(
-        Portfolio.user_id == user_id
-    ).all()
+def encode_cursor(trade: Trade) -> str:
+    """Curseur opaque de pagination : position (trade_date, trade_id) du dernier trade servi."""
+    return urlsafe_b64encode(f"{trade.trade_date.isoformat()}|{trade.trade_id}".encode()).decode()
 
-    # .all() renvoie une liste de tuples [(1,), (2,), ...]
-    portfolio_ids = [p[0] for p in portfolio_ids]
 
-    if not portfolio_ids:
-        return []  # Aucun portefeuille → aucun trade
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        trade_date, trade_id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(trade_date), int(trade_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide.")
 
-    # 2️⃣ Récupérer les trades liés à ces portefeuilles
-    trades = db.query(Trade).filter(Trade.portfolio_id.in_(portfolio_ids)).all()
-    return trades
 
-def get_trades_by_portfolio(db: Session,user_id: int, portfolio_id: int):
-    # 1️⃣ Récupérer les IDs de portefeuilles de l’utilisateur connecté
-    portfolio_ids = db.query(Portfolio.portfolio_id).filter(
-        Portfolio.user_id == user_id
-    ).all()
+def get_trades(db: Session, user_id: int, portfolio_id: int | None = None, asset: str | None = None,
+               action: str | None = None, start: date | None = None, end: date | None = None,
+               cursor: str | None = None, limit: int = TRADES_PAGE_SIZE) -> tuple[list[Trade], str | None]:
+    """
+    Page de trades de l'utilisateur, du plus récent au plus ancien, en une seule
+    requête (jointure sur le propriétaire). Pagination par clé sur
+    (trade_date, trade_id) : le coût d'une page ne dépend pas de sa position,
+    via l'index (portfolio_id, trade_date, trade_id). Retourne les trades et le
+    curseur de la page suivante (None sur la dernière page).
+    """
+    query = user_trades_query(user_id, portfolio_id=portfolio_id, asset=asset, action=action, start=start, end=end)
+    if cursor is not None:
+        query = query.where(tuple_(Trade.trade_date, Trade.trade_id) < decode_cursor(cursor))
+    query = query.order_by(Trade.trade_date.desc(), Trade.trade_id.desc()).limit(limit + 1)
+    trades = list(db.scalars(query))
+    if len(trades) > limit:
+        return trades[:limit], encode_cursor(trades[limit - 1])
+    return trades, None
+
+
+def user_trades_query(user_id: int, *columns, portfolio_id: int | None = None, asset: str | None = None,
+                      action: str | None = None, start: date | None = None, end: date | None = None) -> Select:
+    """
+    SELECT des trades des portefeuilles de l'utilisateur (jointure sur le
+    propriétaire), filtres poussés dans le WHERE ; `end` est inclus.
+    Sans colonnes, sélectionne les entités Trade.
+    """
+    query = select(*(columns or (Trade,))).join(Portfolio, Portfolio.portfolio_id == Trade.portfolio_id)
+    query = query.where(Portfolio.user_id == user_id)
+    if portfolio_id is not None:
+        query = query.where(Trade.portfolio_id == portfolio_id)
+    if asset is not None:
+        query = query.where(Trade.asset_name == asset.strip().upper())
+    if action is not None:
+        query = query.where(Trade.action == action.strip().upper())
+    if start is not None:
+        query = query.where(Trade.trade_date >= start)
+    if end is not None:
+        query = query.where(Trade.trade_date < end + timedelta(days=1))
+    return query
+
+
+SUMMARY_GROUPS = ("asset", "month", "portfolio")
+_SUMMARY_AMOUNTS = ("buy_quantity", "sell_quantity", "buy_amount", "sell_amount", "buy_vwap", "sell_vwap",
+                    "net_quantity", "dividends", "volume_share", "cumulative_net_quantity")
+
 
-    # .all() renvoie une liste de tuples [(1,), (2,), ...]
-    portfolio_ids = [p[0] for p in portfolio_ids]
+def get_trade_summary(db: Session, user_id: int, group_by: str, portfolio_id: int | None = None,
+                      start: date | None = None, end: date | None = None) -> list[dict]:
+    """
+    Agrégats des trades de l'utilisateur par titre, mois ou portefeuille, calculés
+    en une seule requête SQL : nombre de trades, quantités et montants achetés /
+    vendus, prix moyens pondérés (VWAP), quantité nette et dividendes. Les
+    fonctions de fenêtre ajoutent la part de chaque groupe dans le volume total
+    et, par mois, la quantité nette cumulée.
+    """
+    if group_by not in SUMMARY_GROUPS:
+        raise HTTPException(status_code=400, detail=f"Regroupement inconnu : {group_by} (asset, month ou portfolio)")
+    key = {
+        "asset": Trade.asset_name,
+        "month": func.date_trunc("month", Trade.trade_date),
+        "portfolio": Trade.portfolio_id,
+    }[group_by]
+    keys = (key, Portfolio.portfolio_name) if group_by == "portfolio" else (key,)
 
-    if not portfolio_ids:
-        return []  # Aucun portefeuille → aucun trade
+    amount = Trade.price * Trade.quantity
+    buy_quantity = func.sum(case((Trade.action == "BUY", Trade.quantity), else_=0.0))
+    sell_quantity = func.sum(case((Trade.action == "SELL", Trade.quantity), else_=0.0))
+    buy_amount = func.sum(case((Trade.action == "BUY", amount), else_=0.0))
+    sell_amount = func.sum(case((Trade.action == "SELL", amount), else_=0.0))
+    net_quantity = buy_quantity - sell_quantity
+    columns = [
+        key.label("key"),
+        *keys[1:],
+        func.count().label("trades"),
+        buy_quantity.label("buy_quantity"),
+        sell_quantity.label("sell_quantity"),
+        buy_amount.label("buy_amount"),
+        sell_amount.label("sell_amount"),
+        (buy_amount / func.nullif(buy_quantity, 0)).label("buy_vwap"),
+        (sell_amount / func.nullif(sell_quantity, 0)).label("sell_vwap"),
+        net_quantity.label("net_quantity"),
+        func.sum(case((Trade.action == "DIVIDEND", amount), else_=0.0)).label("dividends"),
+        ((buy_amount + sell_amount) / func.nullif(func.sum(buy_amount + sell_amount).over(), 0)).label("volume_share"),
+    ]
+    if group_by == "month":
+        columns.append(func.sum(net_quantity).over(order_by=key).label("cumulative_net_quantity"))
+    query = user_trades_query(user_id, *columns, portfolio_id=portfolio_id, start=start, end=end)
+    query = query.group_by(*keys).order_by(*keys)
 
-    # 2️⃣ Récupérer les trades liés à ces portefeuilles
-    trades = db.query(Trade).filter(Trade.portfolio_id.in_(portfolio_ids),Trade.portfolio_id == portfolio_id).all()
-    return trades
\ No newline at end of file
+    summary = []
+    for row in db.execute(query).mappings():
+        group = dict(row)
+        if group_by == "month":
+            group["key"] = row["key"].strftime("%Y-%m")
+        for name in _SUMMARY_AMOUNTS:
+            if name in group and group[name] is not None:
+                group[name] = round(float(group[name]), 6)
+        summary.append(group)
+    return summary
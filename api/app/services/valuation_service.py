@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from models.portfolio_model import Portfolio
+
+from services.portfolio_service import get_portfolio, get_positions
+from services.positions_engine import Ledger, get_ledger, base_positions, symbols_held_since, bar_cutoffs
+from services.ticker_service import get_price_matrix, requested_window
+from services.fx_service import PORTFOLIO_CURRENCY, convert_matrix, fx_rates
+
+
+def valuation_series(
+    db: Session,
+    portfolio: Portfolio,
+    period: str = "1y",
+    interval: str = "1d",
+    start: str | None = None,
+    ledger: Ledger | None = None,
+    currency: str = PORTFOLIO_CURRENCY,
+):
+    """
+    Série de valeur du portefeuille : pour chaque barre, positions détenues à
+    cette date (rejouées depuis le ledger des trades) multipliées par les prix,
+    plus le cash disponible à cette date.
+    Prix et cash sont convertis dans `currency` au change de chaque barre
+    (par défaut la devise du cash et des trades).
+    Retourne (ledger, dates, valeur des positions, cash, symboles sans prix).
+    """
+    if ledger is None:
+        ledger = get_ledger(db, portfolio.portfolio_id)
+    base = base_positions(ledger, get_positions(portfolio))
+    symbols = symbols_held_since(ledger, base, requested_window(period, start)[0])
+    if not symbols:
+        return ledger, pd.DatetimeIndex([]), np.empty(0), np.empty(0), []
+
+    # prix non remplis : un symbole acheté en cours de période ne doit pas
+    # tronquer le début de la série
+    closes = get_price_matrix(symbols, period, interval, start, fill="none")
+    columns = list(closes.columns)
+    cutoffs = bar_cutoffs(closes.index)
+    quantities = np.array([base[s] for s in columns]) + ledger.positions_at(columns, cutoffs)
+    cash_value = float(portfolio.cash_balance or 0) - ledger.net_cash + ledger.cash_at(cutoffs)
+    closes = convert_matrix(closes, currency, period, interval, start)
+    cash_value = cash_value * fx_rates([PORTFOLIO_CURRENCY], currency, closes.index, period, interval, start)[PORTFOLIO_CURRENCY].to_numpy()
+
+    prices = closes.ffill().to_numpy()
+    held = quantities != 0
+    # barres où une position détenue n'a pas encore de cotation
+    complete = ~(held & np.isnan(prices)).any(axis=1)
+    positions_value = np.where(held, prices * quantities, 0.0).sum(axis=1)
+    missing = [s for s in symbols if s not in columns]
+    return ledger, closes.index[complete], positions_value[complete], cash_value[complete], missing
+
+
+def get_portfolio_valuation(
+    db: Session,
+    portfolio_id: int,
+    user_id: int,
+    period: str = "1y",
+    interval: str = "1d",
+    start: str | None = None,
+    currency: str = PORTFOLIO_CURRENCY,
+):
+    """
+    Série de valeur du portefeuille (positions et cash détenus à chaque date).
+    Retourne None si le portefeuille n'appartient pas à l'utilisateur.
+    """
+    portfolio = get_portfolio(db, portfolio_id, user_id)
+    if not portfolio:
+        return None
+    _, dates, positions_value, cash_value, missing = valuation_series(
+        db, portfolio, period, interval, start, currency=currency
+    )
+    return {
+        "portfolio_id": portfolio_id,
+        "currency": currency,
+        "cash": float(portfolio.cash_balance or 0),
+        "dates": [ts.isoformat() for ts in dates],
+        "positions_value": np.round(positions_value, 2).tolist(),
+        "cash_value": np.round(cash_value, 2).tolist(),
+        "total_value": np.round(positions_value + cash_value, 2).tolist(),
+        "missing": missing,
+    }
@@ -3,12 +3,17 @@ Configuration pytest pour les tests API
 """
 import pytest
 import os
+import tempfile
 
 # Configuration des variables d'environnement pour les tests
 os.environ.setdefault("POSTGRES_USER", "admin")
 os.environ.setdefault("POSTGRES_PASSWORD", "admin123")
 os.environ.setdefault("POSTGRES_DB", "master_db")
 os.environ.setdefault("POSTGRES_HOST", "db")
+# Historiques de prix stockés hors du dépôt pendant les tests
+os.environ.setdefault("PRICE_STORE_DIR", tempfile.mkdtemp(prefix="price_store_"))
+# Données de marché synthétiques et reproductibles (MARKET_DATA_PROVIDER=yfinance pour tester contre Yahoo)
+os.environ.setdefault("MARKET_DATA_PROVIDER", "synthetic")
 
 
 def pytest_configure(config):
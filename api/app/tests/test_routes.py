@@ -1,17 +1,31 @@
+import asyncio
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, Session
 import httpx
 from datetime import datetime
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import io
+import csv
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import orjson
+import pyarrow.parquet as pq
 
 from main import app
-from database import BaseSQL, get_db
+from database import BaseSQL, get_db, upgrade_schema
 from models.user_model import User
 from models.portfolio_model import Portfolio
 from models.trade_model import Trade
+from models.holding_model import Holding
 from services.security import hash_password, create_access_token
+from services import market_data, price_store, ticker_service, positions_engine, nav_service, analytics_service, risk_service, projection_service, lots_service, fx_service, corporate_actions, idempotency_service, trade_import_service
 
 # Configuration de la base de données de test (utilise la même DB que l'app mais avec nettoyage)
 POSTGRES_USER = os.environ.get("POSTGRES_USER", "admin")
@@ -46,6 +60,8 @@ def test_db():
     
     # Nettoyer les tables avant le test
     db.execute(text("DELETE FROM trades"))
+    db.execute(text("DELETE FROM portfolio_nav_daily"))
+    db.execute(text("DELETE FROM holdings"))
     db.execute(text("DELETE FROM portfolios"))
     db.execute(text("DELETE FROM users"))
     db.commit()
@@ -54,6 +70,8 @@ def test_db():
     
     # Nettoyer les tables après le test
     db.execute(text("DELETE FROM trades"))
+    db.execute(text("DELETE FROM portfolio_nav_daily"))
+    db.execute(text("DELETE FROM holdings"))
     db.execute(text("DELETE FROM portfolios"))
     db.execute(text("DELETE FROM users"))
     db.commit()
@@ -97,8 +115,10 @@ def test_portfolio(test_db: Session, test_user):
         portfolio_name="Test Portfolio",
         last_amount=10000.0,
         initial_amount=10000.0,
-        positions="AAPL,GOOGL",
-        positions_size="50,50",
+        holdings=[
+            Holding(symbol="AAPL", quantity=50, cost_basis=7500.0),
+            Holding(symbol="GOOGL", quantity=50, cost_basis=5000.0),
+        ],
         cash_balance=5000.0
     )
     test_db.add(portfolio)
@@ -343,6 +363,554 @@ class TestPortfolioRouter:
         )
         assert response.status_code == 404
 
+    def test_create_and_update_portfolio_holdings(self, client, test_user_token, test_db):
+        """Test des positions structurées (holdings) à la création et à la mise à jour"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        response = client.post(
+            "/portfolios/",
+            json={
+                "portfolio_name": "Holdings Portfolio",
+                "last_amount": 10000.0,
+                "initial_amount": 10000.0,
+                "holdings": [
+                    {"symbol": "aapl", "quantity": 10, "cost_basis": 1500.0},
+                    {"symbol": "MSFT", "quantity": 5},
+                ],
+                "cash_balance": 1000.0
+            },
+            headers=headers
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["holdings"] == [
+            {"symbol": "AAPL", "quantity": 10.0, "cost_basis": 1500.0},
+            {"symbol": "MSFT", "quantity": 5.0, "cost_basis": 0.0},
+        ]
+        assert data["positions"] == "AAPL,MSFT"
+        assert data["positions_size"] == "10,5"
+        legacy = Portfolio(holdings=[Holding(symbol="AAPL", quantity=1234567.5), Holding(symbol="MSFT", quantity=0.123456)])
+        assert legacy.positions_size == "1234567.5,0.123456"
+
+        # l'ancien format texte remplace les positions, le prix de revient moyen est conservé
+        response = client.put(
+            f"/portfolios/{data['portfolio_id']}",
+            json={"positions": "AAPL,NVDA", "positions_size": "20,3"},
+            headers=headers
+        )
+        assert response.status_code == 200
+        assert response.json()["holdings"] == [
+            {"symbol": "AAPL", "quantity": 20.0, "cost_basis": 3000.0},
+            {"symbol": "NVDA", "quantity": 3.0, "cost_basis": 0.0},
+        ]
+        holders = test_db.query(Holding.portfolio_id).filter(Holding.symbol == "MSFT").all()
+        assert holders == []
+
+    def test_get_portfolio_valuation(self, client, test_user_token, test_portfolio, monkeypatch):
+        """Test de la série de valeur calculée côté serveur (positions x prix + cash)"""
+        # cotations dans la devise du portefeuille : aucune conversion
+        monkeypatch.setattr(fx_service, "symbol_currency", lambda symbol: fx_service.PORTFOLIO_CURRENCY)
+        response = client.get(
+            f"/portfolios/{test_portfolio.portfolio_id}/valuation",
+            params={"period": "1mo"},
+            headers={"Authorization": f"Bearer {test_user_token}"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["dates"]) == len(data["total_value"]) == len(data["positions_value"]) > 0
+        assert data["total_value"][-1] == pytest.approx(data["positions_value"][-1] + 5000.0)
+
+        closes = client.get("/tickers/AAPL,GOOGL/", params={"period": "1mo", "format": "columnar"}).json()
+        expected = 50 * closes["AAPL"]["Close"][-1] + 50 * closes["GOOGL"]["Close"][-1]
+        assert data["positions_value"][-1] == pytest.approx(expected, abs=0.01)
+
+    def test_portfolio_outputs_in_requested_currency(self, client, test_user_token, test_portfolio, monkeypatch):
+        """Test de la conversion en devise : change aligné par date, rien n'est retéléchargé"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        pid = test_portfolio.portfolio_id
+        # AAPL et GOOGL sont cotés en USD : prix non convertis, cash converti
+        raw = client.get(f"/portfolios/{pid}/valuation", params={"period": "1mo", "currency": "usd"}, headers=headers).json()
+        response = client.get(f"/portfolios/{pid}/valuation", params={"period": "1mo"}, headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["currency"] == "EUR" and data["dates"] == raw["dates"]
+        assert fx_service.symbol_currency("AAPL") == "USD"
+        assert fx_service.symbol_currency("MC.PA") == "EUR"
+
+        rates = ticker_service.get_price_matrix(["USDEUR=X"], "1mo", fill="none")["USDEUR=X"]
+        rates = rates.reindex(rates.index.union(pd.to_datetime(raw["dates"]))).ffill().bfill()
+        expected = np.array(raw["positions_value"]) * rates.reindex(pd.to_datetime(raw["dates"])).to_numpy()
+        assert data["positions_value"] == pytest.approx(expected.tolist(), rel=1e-4)
+        assert data["cash_value"] == [5000.0] * len(data["dates"])
+
+        # prix, change et devises sont en cache : aucun appel au fournisseur
+        calls = []
+        provider = market_data.get_provider()
+        monkeypatch.setattr(provider, "batch_history", lambda *args, **kwargs: calls.append(args) or {})
+        assert client.get(f"/portfolios/{pid}/valuation", params={"period": "1mo", "currency": "EUR"}, headers=headers).status_code == 200
+        assert client.get(f"/portfolios/{pid}/risk", params={"currency": "EUR", "period": "1mo", "seed": 1}, headers=headers).json()["currency"] == "EUR"
+        assert calls == []
+        monkeypatch.undo()
+
+        pnl = client.get(f"/portfolios/{pid}/pnl", params={"currency": "USD"}, headers=headers).json()
+        eurusd = fx_service.spot_rates(["EUR"], "USD")["EUR"]
+        assert pnl["positions"][0]["cost_basis"] == pytest.approx(7500.0 * eurusd, abs=0.01)
+        response = client.get(f"/portfolios/{pid}/valuation", params={"currency": "euro"}, headers=headers)
+        assert response.status_code == 400
+
+    def test_get_portfolio_valuation_replays_trades(self, client, test_user_token, test_portfolio, monkeypatch):
+        """Test que la valorisation utilise les positions et le cash détenus à chaque date"""
+        # cotations dans la devise du portefeuille : aucune conversion
+        monkeypatch.setattr(fx_service, "symbol_currency", lambda symbol: fx_service.PORTFOLIO_CURRENCY)
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        trade_day = pd.Timestamp.utcnow().tz_localize(None).normalize() - pd.offsets.BDay(10)
+        response = client.post(
+            "/trades/",
+            json={
+                "portfolio_id": test_portfolio.portfolio_id, "asset_name": "MSFT", "quantity": 10,
+                "price": 100.0, "action": "BUY", "trade_date": (trade_day + pd.Timedelta(hours=15)).isoformat()
+            },
+            headers=headers
+        )
+        assert response.status_code == 200
+
+        data = client.get(
+            f"/portfolios/{test_portfolio.portfolio_id}/valuation",
+            params={"period": "1mo"},
+            headers=headers
+        ).json()
+        closes = ticker_service.get_price_matrix(["AAPL", "GOOGL", "MSFT"], "1mo", "1d")
+        closes = closes.set_axis([ts.isoformat() for ts in closes.index]).loc[data["dates"]]
+        before = closes.index < trade_day.isoformat()
+        expected = 50 * closes["AAPL"] + 50 * closes["GOOGL"] + np.where(before, 0, 10 * closes["MSFT"])
+        assert before.any() and not before.all()
+        assert data["positions_value"] == pytest.approx(expected.round(2).tolist(), abs=0.01)
+        assert data["cash_value"] == [5000.0 if b else 4000.0 for b in before]
+
+    def test_daily_nav_snapshots(self, client, test_user_token, test_db, test_portfolio):
+        """Test du calcul des NAV journalières, de l'historique et du résumé"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        pid = test_portfolio.portfolio_id
+        test_portfolio.portfolio_date = datetime.utcnow() - pd.Timedelta(days=30)
+        test_db.commit()
+        as_of = nav_service.last_market_day(datetime.utcnow().date() - pd.Timedelta(days=1))
+
+        written = nav_service.materialize_nav(test_db, as_of=as_of)
+        assert written == len(pd.bdate_range(test_portfolio.portfolio_date.date(), as_of))
+        assert nav_service.materialize_nav(test_db, as_of=as_of) == 0
+
+        history = client.get(f"/portfolios/{pid}/history", headers=headers).json()
+        assert history["dates"][-1] == as_of.date().isoformat()
+        valuation = client.get(f"/portfolios/{pid}/valuation", params={"period": "3mo"}, headers=headers).json()
+        by_date = dict(zip([d[:10] for d in valuation["dates"]], valuation["total_value"]))
+        assert history["nav"] == pytest.approx([by_date[d] for d in history["dates"]], abs=0.01)
+        assert history["cash_value"] == [5000.0] * written
+
+        portfolio = client.get(f"/portfolios/{pid}", headers=headers).json()[0]
+        assert portfolio["last_amount"] == history["positions_value"][-1]
+        summary = client.get("/portfolios/summary", headers=headers).json()
+        assert summary[0]["portfolio_id"] == pid
+        assert summary[0]["nav"] == history["nav"][-1]
+        assert summary[0]["day_change"] == pytest.approx(history["nav"][-1] - history["nav"][-2], abs=0.01)
+
+        # un trade antidaté invalide les snapshots à partir de sa date
+        trade_day = pd.Timestamp(history["dates"][-3])
+        response = client.post(
+            "/trades/",
+            json={"portfolio_id": pid, "asset_name": "AAPL", "quantity": 10, "price": 50.0, "action": "SELL",
+                  "trade_date": (trade_day + pd.Timedelta(hours=16)).isoformat()},
+            headers=headers
+        )
+        assert response.status_code == 200
+        assert len(client.get(f"/portfolios/{pid}/history", headers=headers).json()["dates"]) == written - 3
+        test_db.expire_all()
+        assert nav_service.materialize_nav(test_db, as_of=as_of) == 3
+        history = client.get(f"/portfolios/{pid}/history", params={"start": trade_day.date().isoformat()}, headers=headers).json()
+        assert history["cash_value"] == [5500.0] * 3
+
+    def test_daily_nav_skips_dates_without_prices(self, test_db, test_portfolio, monkeypatch):
+        """Test que les NAV ne sont écrites que sur des dates entièrement valorisées, sans trou"""
+        test_portfolio.portfolio_date = datetime.utcnow() - pd.Timedelta(days=30)
+        test_db.commit()
+        as_of = nav_service.last_market_day(datetime.utcnow().date() - pd.Timedelta(days=1))
+        closes = ticker_service.get_price_matrix(["AAPL", "GOOGL"], "3mo", "1d", fill="none")
+
+        def unavailable(*args, **kwargs):
+            raise HTTPException(status_code=404, detail="Aucune donnée")
+
+        monkeypatch.setattr(nav_service, "get_price_matrix", unavailable)
+        assert nav_service.materialize_nav(test_db, as_of=as_of) == 0
+        assert test_portfolio.last_amount == 10000.0
+
+        # GOOGL détenu mais sans aucune cotation : aucune date n'est complète
+        monkeypatch.setattr(nav_service, "get_price_matrix", lambda *args, **kwargs: closes.drop(columns="GOOGL"))
+        assert nav_service.materialize_nav(test_db, as_of=as_of) == 0
+        assert test_portfolio.last_amount == 10000.0
+        monkeypatch.setattr(nav_service, "get_price_matrix", lambda *args, **kwargs: closes)
+        dates = pd.bdate_range(test_portfolio.portfolio_date.date(), as_of)
+        assert nav_service.materialize_nav(test_db, as_of=as_of) == len(dates)
+        count = test_db.execute(text("SELECT count(*) FROM portfolio_nav_daily")).scalar()
+        assert count == len(dates)
+
+    def test_nav_scheduler_survives_database_errors(self, monkeypatch):
+        """Test qu'une erreur de base est journalisée sans arrêter le thread des NAV"""
+        events = []
+
+        class BrokenSession:
+            def execute(self, *args, **kwargs):
+                raise RuntimeError("connexion perdue")
+
+            def rollback(self):
+                raise RuntimeError("connexion perdue")
+
+            def invalidate(self):
+                events.append("invalidate")
+
+            def close(self):
+                events.append("close")
+
+        scheduler = nav_service.NavScheduler(BrokenSession)
+        assert scheduler.run_once() == 0
+        assert events == ["close"]
+
+        runs = []
+
+        def run_once():
+            runs.append(len(runs))
+            if len(runs) == 1:
+                raise RuntimeError("échec imprévu")
+            scheduler._stop.set()
+            return 0
+
+        monkeypatch.setattr(scheduler, "run_once", run_once)
+        monkeypatch.setattr(scheduler, "seconds_until_next_run", lambda: 0)
+        scheduler._loop()
+        assert runs == [0, 1]
+
+    def test_get_portfolio_analytics(self, client, test_user_token, test_portfolio):
+        """Test des indicateurs de performance : sans trade, TWR = rendement simple et IRR = TWR annualisé"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        url = f"/portfolios/{test_portfolio.portfolio_id}/analytics"
+        data = client.get(url, params={"period": "2y"}, headers=headers).json()
+        valuation = client.get(
+            f"/portfolios/{test_portfolio.portfolio_id}/valuation", params={"period": "2y"}, headers=headers
+        ).json()
+        values = np.array(valuation["positions_value"])
+        returns = values[1:] / values[:-1] - 1
+
+        assert data["observations"] == len(values)
+        assert data["twr"] == pytest.approx(values[-1] / values[0] - 1, rel=1e-4)
+        assert data["irr"] == pytest.approx(data["twr_annualized"], rel=1e-4)
+        assert data["volatility"] == pytest.approx(returns.std(ddof=1) * np.sqrt(252), rel=1e-3)
+        assert data["sharpe"] == pytest.approx(returns.mean() / returns.std(ddof=1) * np.sqrt(252), rel=1e-3)
+        assert -1 < data["max_drawdown"] < 0
+        assert data["drawdown_peak"] < data["drawdown_trough"]
+
+        hits = analytics_service.analytics_cache.hits
+        assert client.get(url, params={"period": "2y"}, headers=headers).json() == data
+        assert analytics_service.analytics_cache.hits == hits + 1
+
+    def test_portfolio_analytics_neutralizes_trade_flows(self):
+        """Test qu'un achat n'est pas compté comme un gain dans le TWR"""
+        dates = pd.bdate_range("2024-01-01", periods=4)
+        # +10 %, achat de 1000 au cours du jour 2 puis +10 %, puis stable
+        positions_value = np.array([1000.0, 1100.0, 2310.0, 2310.0])
+        cash_value = np.array([2000.0, 2000.0, 1000.0, 1000.0])
+        data = analytics_service.compute_analytics(dates, positions_value, cash_value)
+        assert data["twr"] == pytest.approx(1.1 * 1.1 - 1)
+        assert data["max_drawdown"] == 0
+        assert analytics_service.irr(np.array([0.0, 1.0]), np.array([-100.0, 110.0])) == pytest.approx(0.1)
+
+    def test_get_portfolio_risk(self, client, test_user_token, test_portfolio, monkeypatch):
+        """Test des VaR / CVaR historique, paramétrique et Monte Carlo"""
+        # cotations dans la devise du portefeuille : aucune conversion
+        monkeypatch.setattr(fx_service, "symbol_currency", lambda symbol: fx_service.PORTFOLIO_CURRENCY)
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        url = f"/portfolios/{test_portfolio.portfolio_id}/risk"
+        params = {"confidence": [0.95, 0.99], "simulations": 20000, "seed": 7}
+        data = client.get(url, params=params, headers=headers).json()
+
+        closes = ticker_service.get_price_matrix(["AAPL", "GOOGL"], "1y", "1d")
+        exposure = 50 * closes.iloc[-1].to_numpy()
+        losses = -(closes.pct_change().dropna().to_numpy() @ exposure)
+        assert data["exposure"] == pytest.approx(exposure.sum(), abs=0.01)
+        assert data["historical"][0]["var"] == pytest.approx(np.quantile(losses, 0.95), abs=0.01)
+        for method in ("historical", "parametric", "monte_carlo"):
+            var95, var99 = data[method]
+            assert 0 < var95["var"] < var99["var"]
+            assert var95["var"] <= var95["cvar"]
+        # avec une distribution normale, Monte Carlo rejoint la méthode paramétrique
+        assert data["monte_carlo"][0]["var"] == pytest.approx(data["parametric"][0]["var"], rel=0.1)
+        assert client.get(url, params=params, headers=headers).json() == data
+
+        response = client.get(url, params={"confidence": 1.5}, headers=headers)
+        assert response.status_code == 400
+
+    def test_monte_carlo_process_pool_matches_in_process(self, monkeypatch):
+        """Test que les tirages répartis dans le pool de processus donnent le même résultat"""
+        mu = np.array([0.0003, 0.0001, 0.0002])
+        cov = np.array([[4e-4, 1e-4, 0.0], [1e-4, 3e-4, 5e-5], [0.0, 5e-5, 2e-4]])
+        args = (mu, risk_service.cov_factor(cov), np.array([1e4, 2e4, 5e3]), 5, 3_000_000, 42)
+        in_process = risk_service.monte_carlo_losses(*args)
+        monkeypatch.setattr(risk_service, "RISK_MAX_WORKERS", 2)
+        monkeypatch.setattr(risk_service, "RISK_POOL_MIN_CELLS", 0)
+        pooled = risk_service.monte_carlo_losses(*args)
+        assert risk_service._pool is not None
+        np.testing.assert_array_equal(in_process, pooled)
+
+    def test_project_portfolio(self, client, test_user_token, test_portfolio):
+        """Test de la projection Monte Carlo : bandes de percentiles ordonnées et reproductibles"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        url = f"/portfolios/{test_portfolio.portfolio_id}/projection"
+        body = {"horizon_years": 5, "steps_per_year": 12, "paths": 5000, "seed": 3, "percentiles": [5, 50, 95]}
+        response = client.post(url, json=body, headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["dates"]) == 60
+        low, median, high = (np.array(data["percentiles"][p]) for p in ("5", "50", "95"))
+        assert (low <= median).all() and (median <= high).all()
+        assert (high - low)[-1] > (high - low)[0]
+        assert low.min() >= 5000.0
+        assert set(data["estimates"]) == {"AAPL", "GOOGL"}
+        # valeur de départ dans la devise du cash, comme la valorisation
+        valuation = client.get(f"/portfolios/{test_portfolio.portfolio_id}/valuation", params={"period": "1y"}, headers=headers).json()
+        assert data["start_value"] == pytest.approx(valuation["total_value"][-1], abs=0.01)
+        assert client.post(url, json=body, headers=headers).json() == data
+
+        response = client.post(url, json={**body, "paths": 200_000, "steps_per_year": 252, "horizon_years": 50}, headers=headers)
+        assert response.status_code == 400
+
+    def test_simulate_wealth_matches_gbm_moments(self, monkeypatch):
+        """Test du noyau GBM découpé en lots : moyenne théorique exp((mu + sigma²/2) t)"""
+        monkeypatch.setattr(projection_service, "_CHUNK_CELLS", 10_000)
+        factor = risk_service.cov_factor(np.array([[0.04, 0.01], [0.01, 0.09]]))
+        wealth = projection_service.simulate_wealth(
+            np.array([100.0, 100.0]), np.array([0.05, 0.02]), factor, 4, 0.25, 50_000, seed=1
+        )
+        assert wealth.shape == (50_000, 4)
+        expected = 100 * np.exp(0.05 + 0.04 / 2) + 100 * np.exp(0.02 + 0.09 / 2)
+        assert wealth[:, -1].mean() == pytest.approx(expected, rel=0.01)
+
+    def test_positions_engine_checkpoints(self, client, test_user_token, test_db, test_portfolio):
+        """Test que le ledger ne relit que les nouveaux trades et gère les trades antidatés"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        pid = test_portfolio.portfolio_id
+
+        def trade(action, quantity, date):
+            payload = {"portfolio_id": pid, "asset_name": "AAPL", "quantity": quantity, "price": 10.0,
+                       "action": action, "trade_date": date}
+            assert client.post("/trades/", json=payload, headers=headers).status_code == 200
+
+        trade("BUY", 10, "2024-03-01T10:00:00")
+        ledger = positions_engine.get_ledger(test_db, pid)
+        assert positions_engine.get_ledger(test_db, pid) is ledger
+        trade("SELL", 5, "2024-06-01T10:00:00")
+        ledger = positions_engine.get_ledger(test_db, pid)
+        assert ledger.full_replays == 0
+        trade("BUY", 3, "2024-01-01T10:00:00")
+        ledger = positions_engine.get_ledger(test_db, pid)
+        assert ledger.full_replays == 1
+        assert len(ledger) == 3
+
+        cutoffs = pd.to_datetime(["2024-01-01", "2024-02-01", "2024-04-01", "2024-07-01"]).to_numpy()
+        assert ledger.positions_at(["AAPL", "MSFT"], cutoffs)[:, 0].tolist() == [0, 3, 13, 8]
+        assert ledger.cash_at(cutoffs).tolist() == [0, -30, -130, -80]
+        assert positions_engine.base_positions(ledger, {"AAPL": 58.0, "GOOGL": 50.0}) == {"AAPL": 50.0, "GOOGL": 50.0}
+
+    def test_get_portfolio_pnl_by_lot_method(self, client, test_user_token, test_db, test_portfolio):
+        """Test du P&L réalisé selon FIFO, LIFO et coût moyen, et du rapprochement incrémental"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        pid = test_portfolio.portfolio_id
+
+        def trade(action, quantity, price, date):
+            payload = {"portfolio_id": pid, "asset_name": "AAPL", "quantity": quantity, "price": price,
+                       "action": action, "trade_date": date}
+            assert client.post("/trades/", json=payload, headers=headers).status_code == 200
+
+        # lot d'origine : 50 AAPL à 150 (holdings du fixture)
+        trade("BUY", 10, 100.0, "2024-03-01T10:00:00")
+        trade("BUY", 10, 260.0, "2024-04-01T10:00:00")
+        trade("SELL", 15, 300.0, "2024-05-01T10:00:00")
+
+        realized = {}
+        for method in ("fifo", "lifo", "average"):
+            response = client.get(f"/portfolios/{pid}/pnl", params={"method": method}, headers=headers)
+            assert response.status_code == 200
+            data = response.json()
+            aapl = next(p for p in data["positions"] if p["symbol"] == "AAPL")
+            assert aapl["quantity"] == 55.0
+            realized[method] = aapl["realized"]
+        assert realized["fifo"] == pytest.approx(15 * 150.0)
+        assert realized["lifo"] == pytest.approx(10 * 40.0 + 5 * 200.0)
+        assert realized["average"] == pytest.approx(15 * (300.0 - 11100.0 / 70), abs=0.01)
+
+        lots = client.get(f"/portfolios/{pid}/pnl/lots", params={"method": "lifo", "symbol": "aapl"}, headers=headers).json()
+        assert [(c["open_price"], c["quantity"]) for c in lots["closed_lots"]] == [(260.0, 10.0), (100.0, 5.0)]
+        assert [(l["trade_id"], l["quantity"]) for l in lots["open_lots"]] == [(None, 50.0), (lots["open_lots"][1]["trade_id"], 5.0)]
+
+        test_db.expire_all()
+        book, _ = lots_service.get_lot_book(test_db, test_portfolio, "fifo")
+        trade("SELL", 10, 300.0, "2024-06-01T10:00:00")
+        test_db.expire_all()
+        extended, _ = lots_service.get_lot_book(test_db, test_portfolio, "fifo")
+        assert extended is book and len(book.trade_ids) == 4
+        assert sum(book.realized.values()) == pytest.approx(25 * 150.0)
+
+        # vente antidatée : le rapprochement est rejoué depuis le début
+        trade("SELL", 5, 120.0, "2024-02-01T10:00:00")
+        test_db.expire_all()
+        rebuilt, _ = lots_service.get_lot_book(test_db, test_portfolio, "fifo")
+        assert rebuilt is not book
+        assert sum(rebuilt.realized.values()) == pytest.approx(5 * -30.0 + 25 * 150.0)
+
+        response = client.get(f"/portfolios/{pid}/pnl", params={"method": "hifo"}, headers=headers)
+        assert response.status_code == 400
+        assert client.get("/portfolios/9999/pnl", headers=headers).status_code == 404
+
+    def test_apply_corporate_actions(self, client, test_user_token, test_db, test_portfolio, monkeypatch, tmp_path):
+        """Test d'une division et d'un dividende appliqués aux trades, holdings, cash et lots"""
+        monkeypatch.setattr(price_store, "PRICE_STORE_DIR", str(tmp_path))
+        corporate_actions.actions_cache.clear()
+        events = pd.DataFrame(
+            {"Dividends": [0.0, 0.25], "Stock Splits": [4.0, 0.0]},
+            index=pd.to_datetime(["2024-04-01", "2024-06-03"]).tz_localize("America/New_York"),
+        )
+        monkeypatch.setattr(market_data.get_provider(), "actions", lambda symbol: events if symbol == "AAPL" else None)
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        pid = test_portfolio.portfolio_id
+        for action, quantity, price, day in (("BUY", 10, 100.0, "2024-03-01"), ("SELL", 5, 200.0, "2024-03-15")):
+            payload = {"portfolio_id": pid, "asset_name": "AAPL", "quantity": quantity, "price": price,
+                       "action": action, "trade_date": f"{day}T10:00:00"}
+            assert client.post("/trades/", json=payload, headers=headers).status_code == 200
+        assert client.get(f"/portfolios/{pid}/pnl", headers=headers).json()["realized_total"] == pytest.approx(250.0)
+        test_db.expire_all()
+        book, stale = lots_service.get_lot_book(test_db, test_portfolio, "fifo")
+        stale_book = lots_service.LotBook("fifo", {}, stale.revision)
+        stale_book.extend(stale)
+        # historique stocké et en cache d'avant la division
+        price_store.write("AAPL", "1d", pd.DataFrame({"Close": [400.0]}, index=pd.to_datetime(["2024-03-01"])), None)
+        cached_key = (("AAPL", "MSFT"), "1mo", "1d", None)
+        ticker_service.frames_cache.set(cached_key, {}, 60)
+
+        response = client.post(f"/portfolios/{pid}/corporate-actions", headers=headers)
+        assert response.status_code == 200
+        applied = {a["action_type"]: a for a in response.json()}
+        assert applied["SPLIT"]["value"] == 4.0
+        assert applied["DIVIDEND"]["quantity"] == 220.0 and applied["DIVIDEND"]["amount"] == 55.0
+        assert client.post(f"/portfolios/{pid}/corporate-actions", headers=headers).json() == []
+        assert price_store.read("AAPL", "1d") == (None, {})
+        assert ticker_service.frames_cache.get(cached_key) is None
+
+        portfolio = client.get(f"/portfolios/{pid}", headers=headers).json()[0]
+        assert portfolio["cash_balance"] == pytest.approx(5055.0)
+        assert portfolio["holdings"][0]["quantity"] == 220.0
+        trades = client.get(f"/trades/portfolio/{pid}", headers=headers).json()
+        assert sorted((t["action"], t["quantity"], t["price"]) for t in trades) == [
+            ("BUY", 40.0, 25.0), ("DIVIDEND", 220.0, 0.25), ("SELL", 20.0, 50.0)
+        ]
+
+        # seul AAPL est rejoué dans le livre de lots en cache, qui n'est pas reconstruit
+        pnl = client.get(f"/portfolios/{pid}/pnl", headers=headers).json()
+        test_db.expire_all()
+        assert lots_service.get_lot_book(test_db, test_portfolio, "fifo")[0] is book
+        assert pnl["realized_total"] == pytest.approx(250.0)
+        assert next(p for p in pnl["positions"] if p["symbol"] == "AAPL")["quantity"] == 220.0
+        ledger = positions_engine.get_ledger(test_db, pid)
+        assert ledger.net("AAPL") == 20.0 and ledger.net_cash == pytest.approx(55.0)
+        assert ledger.revision == stale.revision + 1
+
+        # caches d'un autre processus, d'avant la division : reconstruits grâce à la révision
+        positions_engine.ledgers.set(pid, stale, positions_engine.LEDGER_TTL_SECONDS)
+        lots_service.lot_books.set((pid, "fifo"), stale_book, lots_service.LOTS_TTL_SECONDS)
+        test_db.expire_all()
+        rebuilt, ledger = lots_service.get_lot_book(test_db, test_portfolio, "fifo")
+        assert ledger.version != stale.version and ledger.net("AAPL") == 20.0
+        assert rebuilt is not stale_book and sum(lot[2] for lot in rebuilt.lots["AAPL"]) == pytest.approx(220.0)
+
+        actions = client.get("/tickers/AAPL/actions").json()
+        assert actions["dates"] == ["2024-04-01", "2024-06-03"] and actions["splits"] == [4.0, 0.0]
+        corporate_actions.actions_cache.clear()
+
+    def test_rebalance_portfolio(self, client, test_user_token, test_portfolio):
+        """Test des ordres de rééquilibrage (aperçu, exécution atomique, variante groupée)"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        pid = test_portfolio.portfolio_id
+        targets = {"aapl": 0.5, "MSFT": 0.3}
+        response = client.post(f"/portfolios/{pid}/rebalance", json={"targets": targets}, headers=headers)
+        assert response.status_code == 200
+        plan = response.json()
+        assert plan["executed"] is False
+        orders = {o["symbol"]: o for o in plan["orders"]}
+        assert orders["GOOGL"]["action"] == "SELL" and orders["GOOGL"]["quantity"] == 50
+        assert plan["orders"][0]["action"] == "SELL"
+        assert all(o["quantity"] == int(o["quantity"]) for o in plan["orders"])
+        assert plan["cash_after"] >= 0
+        # cours en USD convertis dans la devise du cash
+        closes = ticker_service.get_price_matrix(["AAPL", "USDEUR=X"], "5d", "1d", fill="ffill").iloc[-1]
+        assert orders["AAPL"]["price"] == pytest.approx(closes["AAPL"] * closes["USDEUR=X"], rel=1e-6)
+        for symbol, weight in (("AAPL", 0.5), ("MSFT", 0.3)):
+            assert abs(plan["weights_after"][symbol] - weight) * plan["total_value"] <= orders[symbol]["price"] / 2 + 0.01
+
+        batch = client.post("/portfolios/rebalance", json={"targets": targets, "portfolio_ids": [pid]}, headers=headers).json()
+        assert batch == [plan]
+
+        response = client.post(f"/portfolios/{pid}/rebalance", json={"targets": targets, "execute": True}, headers=headers)
+        assert response.status_code == 200 and response.json()["executed"] is True
+        portfolio = client.get(f"/portfolios/{pid}", headers=headers).json()[0]
+        held = {h["symbol"]: h["quantity"] for h in portfolio["holdings"]}
+        assert "GOOGL" not in held
+        assert held["MSFT"] == orders["MSFT"]["quantity"]
+        assert portfolio["cash_balance"] == pytest.approx(plan["cash_after"], abs=0.01)
+        assert len(client.get(f"/trades/portfolio/{pid}", headers=headers).json()) == len(plan["orders"])
+
+        response = client.post(f"/portfolios/{pid}/rebalance", json={"targets": {"AAPL": 0.8, "MSFT": 0.3}}, headers=headers)
+        assert response.status_code == 400
+        response = client.post("/portfolios/rebalance", json={"targets": targets, "portfolio_ids": [9999]}, headers=headers)
+        assert response.status_code == 404
+
+    def test_simulate_portfolio_scenarios(self, client, test_user_token, test_portfolio, monkeypatch):
+        """Test de la simulation de trades hypothétiques : plusieurs scénarios, sans écriture ni appel amont"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        pid = test_portfolio.portfolio_id
+        assert client.get(f"/portfolios/{pid}/risk", params={"simulations": 1000}, headers=headers).status_code == 200
+        calls = []
+        monkeypatch.setattr(market_data.get_provider(), "batch_history", lambda *args, **kwargs: calls.append(args) or {})
+        before = client.get(f"/portfolios/{pid}", headers=headers).json()
+
+        scenarios = [
+            [],
+            [{"asset_name": "aapl", "action": "SELL", "quantity": 20, "price": 200.0},
+             {"asset_name": "GOOGL", "action": "BUY", "quantity": 10, "price": 100.0}],
+            [{"asset_name": "AAPL", "action": "SELL", "quantity": 80, "price": 200.0}],
+            [{"asset_name": "GOOGL", "action": "BUY", "quantity": 5}],
+        ]
+        response = client.post(f"/portfolios/{pid}/simulate", json={"scenarios": scenarios}, headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert calls == []
+        unchanged, sold, oversold, at_market = data["scenarios"]
+        assert unchanged == {**data["current"], "valid": True, "rejected_trade": None}
+        assert sold["valid"] and sold["cash"] == pytest.approx(5000.0 + 20 * 200.0 - 10 * 100.0)
+        assert sold["quantities"] == {"AAPL": 30.0, "GOOGL": 60.0}
+        assert sold["realized"] == pytest.approx(20 * (200.0 - 150.0))
+        assert oversold["valid"] is False and oversold["rejected_trade"] == 0
+        assert oversold["quantities"]["AAPL"] == 50.0 and oversold["cash"] == pytest.approx(5000.0)
+        assert at_market["total_value"] == pytest.approx(data["current"]["total_value"], abs=0.01)
+        assert 0 < data["current"]["var"] <= data["current"]["cvar"]
+
+        assert client.get(f"/portfolios/{pid}", headers=headers).json() == before
+        assert client.get(f"/trades/portfolio/{pid}", headers=headers).json() == []
+        response = client.post(f"/portfolios/{pid}/simulate", json={"trades": [{"asset_name": "AAPL", "action": "HOLD", "quantity": 1}]}, headers=headers)
+        assert response.status_code == 400
+        assert client.post("/portfolios/9999/simulate", json={}, headers=headers).status_code == 404
+
+    def test_get_portfolio_valuation_not_found(self, client, test_user_token):
+        """Test de la valorisation d'un portfolio inexistant"""
+        response = client.get(
+            "/portfolios/9999/valuation",
+            headers={"Authorization": f"Bearer {test_user_token}"}
+        )
+        assert response.status_code == 404
+
 
 # =====================================================
 # TESTS TRADE ROUTER
@@ -387,6 +955,185 @@ class TestTradeRouter:
         )
         assert response.status_code == 401
 
+    def test_bulk_import_trades(self, client, test_user_token, test_db, test_portfolio):
+        """Test de l'import en flux (CSV et NDJSON) : holdings, cash et trades en une transaction"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        pid = test_portfolio.portfolio_id
+        lines = ["portfolio_id,asset_name,action,quantity,price,trade_date,description"]
+        for day in range(1, 29):
+            lines.append(f"{pid},msft,BUY,2,10,2024-02-{day:02d}T10:00:00,")
+            lines.append(f'{pid},MSFT,SELL,2,12,2024-02-{day:02d}T15:00:00,"aller, retour"')
+        lines.append(f"{pid},TSLA,BUY,3,100,2024-03-01T10:00:00,")
+        response = client.post("/trades/bulk", content="\n".join(lines).encode(),
+                               headers={**headers, "Content-Type": "text/csv"})
+        assert response.status_code == 200
+        assert response.json() == {"imported": 57, "portfolios": {str(pid): 57}}
+        portfolio = client.get(f"/portfolios/{pid}", headers=headers).json()[0]
+        assert portfolio["cash_balance"] == pytest.approx(5000.0 + 28 * 4.0 - 300.0)
+        assert {h["symbol"]: h["quantity"] for h in portfolio["holdings"]} == {"AAPL": 50, "GOOGL": 50, "TSLA": 3}
+        trades = client.get(f"/trades/portfolio/{pid}", headers=headers).json()
+        assert len(trades) == 57 and sum(t["description"] == "aller, retour" for t in trades) == 28
+
+        ndjson = "\n".join([
+            f'{{"portfolio_id": {pid}, "asset_name": "TSLA", "action": "SELL", "quantity": 1, "price": 110}}',
+            f'{{"portfolio_id": {pid}, "asset_name": "TSLA", "action": "SELL", "quantity": 5, "price": 110}}',
+        ])
+        response = client.post("/trades/bulk", content=ndjson, headers={**headers, "Content-Type": "application/x-ndjson"})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Ligne 2 : Pas assez de titres pour cette vente."
+        assert len(client.get(f"/trades/portfolio/{pid}", headers=headers).json()) == 57
+
+        response = client.post("/trades/bulk", params={"format": "ndjson"},
+                               content=f'{{"portfolio_id": 9999, "asset_name": "TSLA", "action": "BUY", "quantity": 1, "price": 1}}',
+                               headers=headers)
+        assert response.status_code == 404
+
+    def test_bulk_import_rejects_while_streaming(self, test_db, test_user, test_portfolio):
+        """Test qu'une ligne invalide arrête la réception sans attendre la fin du fichier"""
+        sent = []
+
+        async def body():
+            yield f"portfolio_id,asset_name,action,quantity,price\n{test_portfolio.portfolio_id},AAPL,BUY,x,1\n".encode()
+            for _ in range(1000):
+                sent.append(1)
+                yield b"x" * 65536
+
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(trade_import_service.import_trades_stream(test_db, body(), "csv", test_user.user_id))
+        assert error.value.status_code == 400 and error.value.detail.startswith("Ligne 2 : quantity")
+        assert len(sent) < 100
+
+    def test_export_trades_stream(self, client, test_user_token, test_portfolio):
+        """Test de l'export en flux CSV / NDJSON, filtré par dates en SQL"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        pid = test_portfolio.portfolio_id
+        lines = ["portfolio_id,asset_name,action,quantity,price,trade_date"]
+        lines += [f"{pid},MSFT,BUY,1,10,2024-01-{day:02d}T10:00:00" for day in range(31, 0, -1)]
+        assert client.post("/trades/bulk", content="\n".join(lines), headers=headers).status_code == 200
+
+        with client.stream("GET", "/trades/export", params={"start": "2024-01-10", "end": "2024-01-20"}, headers=headers) as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/csv")
+            rows = list(csv.DictReader(response.iter_lines()))
+        assert [r["trade_date"][:10] for r in rows] == [f"2024-01-{day}" for day in range(10, 21)]
+        assert rows[0]["asset_name"] == "MSFT" and float(rows[0]["price"]) == 10.0
+
+        response = client.get("/trades/export", params={"format": "ndjson", "portfolio_id": pid}, headers=headers)
+        records = [json.loads(line) for line in response.text.splitlines()]
+        assert len(records) == 31 and records[0]["trade_date"] == "2024-01-01T10:00:00"
+        assert client.get("/trades/export", params={"portfolio_id": 9999}, headers=headers).text.splitlines() == [
+            "trade_id,portfolio_id,asset_name,action,price,quantity,trade_date,description"
+        ]
+        assert client.get("/trades/export", params={"format": "xml"}, headers=headers).status_code == 400
+
+    def test_trades_keyset_pagination(self, client, test_user_token, test_portfolio):
+        """Test de la pagination par curseur (trade_date, trade_id) et des filtres"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        pid = test_portfolio.portfolio_id
+        lines = ["portfolio_id,asset_name,action,quantity,price,trade_date"]
+        lines += [f"{pid},MSFT,BUY,1,10,2024-01-{day % 5 + 1:02d}T10:00:00" for day in range(25)]
+        lines += [f"{pid},MSFT,SELL,1,10,2024-02-01T10:00:00", f"{pid},TSLA,BUY,1,10,2024-01-03T10:00:00"]
+        assert client.post("/trades/bulk", content="\n".join(lines), headers=headers).status_code == 200
+
+        seen, cursor = [], None
+        while True:
+            params = {"portfolio_id": pid, "limit": 10, **({"cursor": cursor} if cursor else {})}
+            response = client.get(f"/trades/portfolio/{pid}", params=params, headers=headers)
+            assert response.status_code == 200
+            seen += [(t["trade_date"], t["trade_id"]) for t in response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        assert len(seen) == 27 and seen == sorted(seen, reverse=True)
+
+        trades = client.get("/trades/", params={"asset": "msft", "action": "BUY", "start": "2024-01-02", "end": "2024-01-03"},
+                            headers=headers).json()
+        assert len(trades) == 10 and {t["trade_date"][:10] for t in trades} == {"2024-01-02", "2024-01-03"}
+        assert "X-Next-Cursor" not in client.get("/trades/", headers=headers).headers
+        assert client.get("/trades/", params={"cursor": "pas-un-curseur"}, headers=headers).status_code == 400
+        assert client.get("/trades/portfolio/9999", headers=headers).json() == []
+
+    def test_upgrade_schema_backfills_trade_date(self, test_db, test_portfolio):
+        """Test de la migration d'une base où trade_date acceptait encore NULL"""
+        pid = test_portfolio.portfolio_id
+        test_db.execute(text("ALTER TABLE trades ALTER COLUMN trade_date DROP NOT NULL"))
+        try:
+            test_db.execute(text(
+                "INSERT INTO trades (portfolio_id, asset_name, action, quantity, price, trade_date) VALUES "
+                "(:pid, 'MSFT', 'BUY', 1, 10, '2020-01-02 10:00'), (:pid, 'MSFT', 'BUY', 1, 10, NULL)"
+            ), {"pid": pid})
+            test_db.commit()
+            upgrade_schema(engine)
+            upgrade_schema(engine)
+        finally:
+            test_db.rollback()
+            test_db.execute(text("UPDATE trades SET trade_date = NOW() WHERE trade_date IS NULL"))
+            test_db.execute(text("ALTER TABLE trades ALTER COLUMN trade_date SET NOT NULL"))
+            test_db.commit()
+
+        dates = test_db.execute(text(
+            "SELECT trade_date FROM trades WHERE portfolio_id = :pid AND asset_name = 'MSFT' ORDER BY trade_id"
+        ), {"pid": pid}).scalars().all()
+        # le trade sans date passe avant tous les autres, comme lors du rejeu du ledger
+        assert dates == [datetime(2020, 1, 2, 10), datetime(2020, 1, 2, 10)]
+        nullable = test_db.execute(text(
+            "SELECT is_nullable FROM information_schema.columns "
+            "WHERE table_name = 'trades' AND column_name = 'trade_date'"
+        )).scalar()
+        assert nullable == "NO"
+
+    def test_idempotency_key_replays_original_response(self, client, test_user_token, test_db, test_portfolio):
+        """Test qu'un rejeu avec la même Idempotency-Key renvoie la réponse d'origine sans réexécuter"""
+        headers = {"Authorization": f"Bearer {test_user_token}", "Idempotency-Key": "trade-1"}
+        pid = test_portfolio.portfolio_id
+        payload = {"portfolio_id": pid, "asset_name": "TSLA", "quantity": 5, "price": 100.0, "action": "BUY"}
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            responses = list(pool.map(lambda _: client.post("/trades/", json=payload, headers=headers), range(4)))
+        assert {r.status_code for r in responses} == {200}
+        assert len({r.json()["trade_id"] for r in responses}) == 1
+        assert len(client.get(f"/trades/portfolio/{pid}", headers=headers).json()) == 1
+        assert client.get(f"/portfolios/{pid}", headers=headers).json()[0]["cash_balance"] == pytest.approx(4500.0)
+
+        response = client.post("/trades/", json={**payload, "quantity": 6}, headers=headers)
+        assert response.status_code == 422
+        # un trade refusé ne consomme pas la clé
+        refused = {**headers, "Idempotency-Key": "trade-2"}
+        assert client.post("/trades/", json={**payload, "quantity": 1000}, headers=refused).status_code == 400
+        assert client.post("/trades/", json=payload, headers=refused).status_code == 200
+
+        body = {"last_amount": 1000.0, "initial_amount": 1000.0, "portfolio_name": "Idem", "cash_balance": 1000.0}
+        created = [client.post("/portfolios/", json=body, headers={**headers, "Idempotency-Key": "pf-1"}).json() for _ in range(2)]
+        assert created[0] == created[1]
+        assert len(client.get("/portfolios/", headers=headers).json()) == 2
+
+        test_db.execute(text("UPDATE idempotency_keys SET created_at = created_at - interval '2 days'"))
+        test_db.commit()
+        assert idempotency_service.purge_idempotency_keys(test_db) == 3
+
+    def test_trade_summary_grouped_in_sql(self, client, test_user_token, test_portfolio):
+        """Test des agrégats par titre, mois et portefeuille (VWAP, quantité nette, fenêtres)"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        pid = test_portfolio.portfolio_id
+        lines = ["portfolio_id,asset_name,action,quantity,price,trade_date",
+                 f"{pid},MSFT,BUY,10,100,2024-01-05T10:00:00",
+                 f"{pid},MSFT,BUY,30,120,2024-01-20T10:00:00",
+                 f"{pid},MSFT,SELL,20,250,2024-02-10T10:00:00",
+                 f"{pid},AAPL,SELL,10,150,2024-02-15T10:00:00"]
+        assert client.post("/trades/bulk", content="\n".join(lines), headers=headers).status_code == 200
+
+        by_asset = {g["key"]: g for g in client.get("/trades/summary", headers=headers).json()}
+        msft = by_asset["MSFT"]
+        assert msft["trades"] == 3 and msft["net_quantity"] == 20.0
+        assert msft["buy_vwap"] == pytest.approx(4600.0 / 40) and msft["sell_vwap"] == 250.0
+        assert by_asset["AAPL"]["buy_vwap"] is None and by_asset["AAPL"]["net_quantity"] == -10.0
+        assert sum(g["volume_share"] for g in by_asset.values()) == pytest.approx(1.0)
+
+        by_month = client.get("/trades/summary", params={"group_by": "month"}, headers=headers).json()
+        assert [(g["key"], g["cumulative_net_quantity"]) for g in by_month] == [("2024-01", 40.0), ("2024-02", 10.0)]
+        by_portfolio = client.get("/trades/summary", params={"group_by": "portfolio", "end": "2024-01-31"}, headers=headers).json()
+        assert by_portfolio == [{**by_portfolio[0], "key": pid, "portfolio_name": "Test Portfolio", "trades": 2}]
+        assert client.get("/trades/summary", params={"group_by": "week"}, headers=headers).status_code == 400
+
     def test_get_all_trades(self, client, test_user_token, test_portfolio):
         """Test de récupération de tous les trades de l'utilisateur"""
         # Créer un trade d'abord
@@ -424,7 +1171,7 @@ class TestTradeRouter:
             json={
                 "portfolio_id": test_portfolio.portfolio_id,
                 "asset_name": "GOOGL",
-                "quantity": 5,
+                "quantity": 1,
                 "price": 2800.00,
                 "action": "BUY",
                 "trade_date": datetime.now().isoformat()
@@ -449,6 +1196,89 @@ class TestTradeRouter:
         response = client.get("/trades/")
         assert response.status_code == 401
 
+    def test_create_trade_updates_portfolio(self, client, test_user_token, test_portfolio):
+        """Test qu'un trade met à jour cash et positions du portfolio"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        response = client.post(
+            "/trades/",
+            json={"portfolio_id": test_portfolio.portfolio_id, "asset_name": "msft", "quantity": 10, "price": 100.0, "action": "BUY"},
+            headers=headers
+        )
+        assert response.status_code == 200
+        response = client.post(
+            "/trades/",
+            json={"portfolio_id": test_portfolio.portfolio_id, "asset_name": "AAPL", "quantity": 50, "price": 200.0, "action": "SELL"},
+            headers=headers
+        )
+        assert response.status_code == 200
+
+        portfolio = client.get(f"/portfolios/{test_portfolio.portfolio_id}", headers=headers).json()[0]
+        assert portfolio["cash_balance"] == 5000.0 - 1000.0 + 10000.0
+        assert portfolio["positions"] == "GOOGL,MSFT"
+        assert portfolio["positions_size"] == "50,10"
+        assert portfolio["holdings"] == [
+            {"symbol": "GOOGL", "quantity": 50.0, "cost_basis": 5000.0},
+            {"symbol": "MSFT", "quantity": 10.0, "cost_basis": 1000.0},
+        ]
+
+    def test_partial_sell_keeps_average_cost(self, client, test_user_token, test_portfolio):
+        """Test qu'une vente partielle retire les titres au prix de revient moyen"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        response = client.post(
+            "/trades/",
+            json={"portfolio_id": test_portfolio.portfolio_id, "asset_name": "AAPL", "quantity": 20, "price": 300.0, "action": "SELL"},
+            headers=headers
+        )
+        assert response.status_code == 200
+        portfolio = client.get(f"/portfolios/{test_portfolio.portfolio_id}", headers=headers).json()[0]
+        aapl = portfolio["holdings"][0]
+        assert aapl["symbol"] == "AAPL"
+        assert aapl["quantity"] == 30.0
+        assert aapl["cost_basis"] == pytest.approx(7500.0 * 30 / 50)
+
+    def test_create_trade_rejected(self, client, test_user_token, test_portfolio):
+        """Test des trades refusés : cash insuffisant, titres insuffisants ou non détenus"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        base = {"portfolio_id": test_portfolio.portfolio_id, "price": 100.0}
+        for payload in (
+            {"asset_name": "TSLA", "quantity": 51, "action": "BUY"},
+            {"asset_name": "AAPL", "quantity": 51, "action": "SELL"},
+            {"asset_name": "TSLA", "quantity": 1, "action": "SELL"},
+            {"asset_name": "TSLA", "quantity": 1, "action": "HOLD"},
+        ):
+            response = client.post("/trades/", json={**base, **payload}, headers=headers)
+            assert response.status_code == 400
+
+        portfolio = client.get(f"/portfolios/{test_portfolio.portfolio_id}", headers=headers).json()[0]
+        assert portfolio["cash_balance"] == 5000.0
+        assert client.get("/trades/", headers=headers).json() == []
+
+    def test_create_trade_other_user_portfolio(self, client, test_portfolio):
+        """Test qu'un utilisateur ne peut pas trader sur le portfolio d'un autre"""
+        client.post(
+            "/auth/register",
+            json={"first_name": "Other", "last_name": "User", "username": "othertrader", "password": "password123"}
+        )
+        other_token = client.post("/auth/token", data={"username": "othertrader", "password": "password123"}).json()["access_token"]
+        response = client.post(
+            "/trades/",
+            json={"portfolio_id": test_portfolio.portfolio_id, "asset_name": "AAPL", "quantity": 1, "price": 10.0, "action": "BUY"},
+            headers={"Authorization": f"Bearer {other_token}"}
+        )
+        assert response.status_code == 404
+
+    def test_concurrent_trades_never_overdraw_cash(self, client, test_user_token, test_portfolio):
+        """Test que des achats simultanés ne rendent jamais le cash négatif (verrou sur le portfolio)"""
+        headers = {"Authorization": f"Bearer {test_user_token}"}
+        payload = {"portfolio_id": test_portfolio.portfolio_id, "asset_name": "MSFT", "quantity": 1, "price": 1000.0, "action": "BUY"}
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda _: client.post("/trades/", json=payload, headers=headers), range(8)))
+
+        assert sorted(r.status_code for r in responses) == [200] * 5 + [400] * 3
+        portfolio = client.get(f"/portfolios/{test_portfolio.portfolio_id}", headers=headers).json()[0]
+        assert portfolio["cash_balance"] == 0.0
+        assert portfolio["positions_size"].split(",")[-1] == "5"
+
 
 # =====================================================
 # TESTS TICKER ROUTER
@@ -478,6 +1308,13 @@ class TestTickerRouter:
         data = response.json()
         assert data is not None
 
+    def test_get_ticker_data_day_period_counts_sessions(self, client):
+        """Test qu'une période en jours garde les N dernières séances, barres intraday comprises"""
+        hourly = ticker_service.get_tickers_frames("AAPL", period="5d", interval="1h")["AAPL"]
+        assert hourly.index.normalize().nunique() == 5 and len(hourly) > 5
+        daily = ticker_service.get_tickers_frames("AAPL", period="5d", interval="1d")["AAPL"]
+        assert len(daily) == 5
+
     def test_get_ticker_data_with_start_date(self, client):
         """Test de récupération de données de ticker avec date de début"""
         response = client.get(
@@ -499,6 +1336,215 @@ class TestTickerRouter:
         # Peut retourner 200, 404, 400 ou 500 selon l'erreur yfinance
         assert response.status_code in [200, 404, 400, 500]
 
+    def test_get_ticker_data_from_price_store(self, client, monkeypatch, tmp_path):
+        """Test que l'historique stocké localement est servi si Yahoo est indisponible"""
+        monkeypatch.setattr(price_store, "PRICE_STORE_DIR", str(tmp_path))
+        monkeypatch.setattr(ticker_service, "STORE_REFRESH_SECONDS", 0)
+        index = pd.date_range("2024-01-01", periods=10, freq="B", name="Date")
+        history = pd.DataFrame(
+            {"Open": 1.0, "High": 2.0, "Low": 0.5, "Close": range(10), "Volume": 100},
+            index=index,
+        )
+        monkeypatch.setattr(ticker_service, "_fetch", lambda symbols, interval, **kwargs: {"AAPL": history})
+        response = client.get("/tickers/AAPL/", params={"start": "2024-01-01"})
+        assert response.status_code == 200
+        assert len(response.json()["AAPL"]) == 10
+
+        def upstream_down(symbols, interval, **kwargs):
+            raise ConnectionError("Yahoo indisponible")
+
+        monkeypatch.setattr(ticker_service, "_fetch", upstream_down)
+        response = client.get("/tickers/AAPL/", params={"start": "2024-01-08"})
+        assert response.status_code == 200
+        data = response.json()["AAPL"]
+        assert len(data) == 5
+        assert data[-1]["Close"] == 9
+
+    def test_price_store_tail_refresh_keeps_coverage(self, monkeypatch, tmp_path):
+        """Test qu'un rafraîchissement de fin commençant à la date demandée ne réduit pas la couverture stockée"""
+        monkeypatch.setattr(price_store, "PRICE_STORE_DIR", str(tmp_path))
+        monkeypatch.setattr(ticker_service, "STORE_REFRESH_SECONDS", 0)
+        index = pd.date_range("2024-01-01", periods=10, freq="B", name="Date")
+        history = pd.DataFrame({"Close": range(10)}, index=index, dtype=float)
+        price_store.write("AAPL", "1d", history, "2024-01-01T00:00:00")
+        monkeypatch.setattr(ticker_service, "_fetch", lambda symbols, interval, **kwargs: {"AAPL": history.tail(1)})
+        frames = ticker_service._fetch_with_store(["AAPL"], "1d", pd.Timestamp("2024-01-12"))
+        assert len(frames["AAPL"]) == 1
+        assert price_store.read("AAPL", "1d")[1]["covered_from"] == "2024-01-01T00:00:00"
+
+    def test_get_ticker_data_cache_single_flight(self, client, monkeypatch, tmp_path):
+        """Test que des requêtes identiques simultanées ne déclenchent qu'un appel amont"""
+        monkeypatch.setattr(price_store, "PRICE_STORE_DIR", str(tmp_path))
+        ticker_service.frames_cache.clear()
+        index = pd.date_range("2024-01-01", periods=10, freq="B", name="Date")
+        history = pd.DataFrame({"Close": range(10)}, index=index, dtype=float)
+        calls = []
+
+        def slow_fetch(symbols, interval, **kwargs):
+            calls.append(symbols)
+            time.sleep(0.2)
+            return {s: history for s in symbols}
+
+        monkeypatch.setattr(ticker_service, "_fetch", slow_fetch)
+        before = client.get("/tickers/cache/stats").json()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            responses = list(pool.map(
+                lambda _: client.get("/tickers/msft,aapl/", params={"start": "2024-01-01"}),
+                range(4),
+            ))
+        assert all(r.status_code == 200 for r in responses)
+        assert len(calls) == 1
+
+        response = client.get("/tickers/AAPL,MSFT/", params={"start": "2024-01-01"})
+        assert response.status_code == 200
+        assert len(calls) == 1
+        stats = client.get("/tickers/cache/stats").json()
+        assert stats["misses"] == before["misses"] + 1
+        assert stats["hits"] + stats["coalesced"] == before["hits"] + before["coalesced"] + 4
+
+    def test_get_ticker_data_columnar_format(self, client, monkeypatch, tmp_path):
+        """Test du format columnar et du remplacement des NaN/inf par null"""
+        monkeypatch.setattr(price_store, "PRICE_STORE_DIR", str(tmp_path))
+        ticker_service.frames_cache.clear()
+        index = pd.date_range("2024-01-01", periods=3, freq="B", name="Date")
+        history = pd.DataFrame({"Close": [1.5, float("nan"), float("inf")], "Volume": [10, 20, 30]}, index=index)
+        monkeypatch.setattr(ticker_service, "_fetch", lambda symbols, interval, **kwargs: {"AAPL": history})
+
+        response = client.get("/tickers/AAPL/", params={"start": "2024-01-01", "format": "columnar"})
+        assert response.status_code == 200
+        data = response.json()["AAPL"]
+        assert data["Close"] == [1.5, None, None]
+        assert data["Volume"] == [10, 20, 30]
+        assert len(data["Date"]) == 3
+
+        response = client.get("/tickers/AAPL/", params={"start": "2024-01-01"})
+        rows = response.json()["AAPL"]
+        assert rows[1] == {"Date": data["Date"][1], "Close": None, "Volume": 20}
+
+        # dates localisées de part et d'autre d'un changement d'heure : même texte qu'orjson
+        local = pd.date_range("2024-03-08 09:30", periods=3, freq="D", tz="America/New_York", name="Date")
+        frame = pd.DataFrame({"Close": [1.25, float("nan"), 3.0]}, index=local)
+        expected = [{"Date": d, "Close": c} for d, c in zip(local.to_pydatetime(), [1.25, None, 3.0])]
+        assert ticker_service.frames_json({"AAPL": frame}) == orjson.dumps({"AAPL": expected})
+
+    def test_get_ticker_data_arrow_and_parquet(self, client, monkeypatch, tmp_path):
+        """Test des sorties Arrow IPC (un batch par ticker) et Parquet selon l'en-tête Accept"""
+        monkeypatch.setattr(price_store, "PRICE_STORE_DIR", str(tmp_path))
+        ticker_service.frames_cache.clear()
+        index = pd.date_range("2024-01-01", periods=4, freq="B", name="Date")
+        history = pd.DataFrame({"Close": [1.0, 2.0, 3.0, 4.0], "Volume": [10, 20, 30, 40]}, index=index)
+        monkeypatch.setattr(
+            ticker_service, "_fetch",
+            lambda symbols, interval, **kwargs: {s: history for s in symbols},
+        )
+
+        response = client.get(
+            "/tickers/AAPL,MSFT/",
+            params={"start": "2024-01-01"},
+            headers={"Accept": "application/vnd.apache.arrow.stream"},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+        batches = list(pa.ipc.open_stream(response.content))
+        assert len(batches) == 2
+        assert batches[0].num_rows == 4
+        assert batches[1].column("Close").to_pylist() == [1.0, 2.0, 3.0, 4.0]
+
+        response = client.get(
+            "/tickers/AAPL,MSFT/",
+            params={"start": "2024-01-01"},
+            headers={"Accept": "application/vnd.apache.parquet"},
+        )
+        assert response.status_code == 200
+        table = pq.read_table(io.BytesIO(response.content))
+        assert table.num_rows == 8
+        assert set(table.column("Symbol").to_pylist()) == {"AAPL", "MSFT"}
+
+    def test_get_ticker_data_downsampled(self, client, monkeypatch, tmp_path):
+        """Test du sous-échantillonnage côté serveur (LTTB et OHLC)"""
+        monkeypatch.setattr(price_store, "PRICE_STORE_DIR", str(tmp_path))
+        ticker_service.frames_cache.clear()
+        index = pd.date_range("2020-01-01", periods=1000, freq="B", name="Date")
+        close = [float(i % 50) for i in range(1000)]
+        history = pd.DataFrame(
+            {"Open": close, "High": [c + 1 for c in close], "Low": [c - 1 for c in close], "Close": close, "Volume": 1},
+            index=index,
+        )
+        monkeypatch.setattr(ticker_service, "_fetch", lambda symbols, interval, **kwargs: {"AAPL": history})
+
+        response = client.get("/tickers/AAPL/", params={"start": "2020-01-01", "max_points": 100, "format": "columnar"})
+        assert response.status_code == 200
+        data = response.json()["AAPL"]
+        assert len(data["Close"]) == 100
+        assert data["Close"][0] == 0.0 and data["Close"][-1] == close[-1]
+        assert max(data["Close"]) == 49.0
+
+        response = client.get(
+            "/tickers/AAPL/",
+            params={"start": "2020-01-01", "max_points": 10, "downsample": "ohlc", "format": "columnar"},
+        )
+        data = response.json()["AAPL"]
+        assert len(data["Close"]) == 10
+        assert sum(data["Volume"]) == 1000
+        assert max(data["High"]) == 50.0
+
+    def test_get_price_matrix_mixed_calendars(self, client, monkeypatch, tmp_path):
+        """Test de la matrice alignée sur l'union des calendriers avec politiques de remplissage"""
+        monkeypatch.setattr(price_store, "PRICE_STORE_DIR", str(tmp_path))
+        ticker_service.frames_cache.clear()
+        us = pd.DataFrame(
+            {"Close": [1.0, 2.0, 3.0]},
+            index=pd.DatetimeIndex(["2024-01-02", "2024-01-03", "2024-01-05"], name="Date").tz_localize("America/New_York"),
+        )
+        eu = pd.DataFrame(
+            {"Close": [10.0, 20.0, 30.0]},
+            index=pd.DatetimeIndex(["2024-01-02", "2024-01-04", "2024-01-05"], name="Date").tz_localize("Europe/Paris"),
+        )
+        monkeypatch.setattr(ticker_service, "_fetch", lambda symbols, interval, **kwargs: {"US": us, "EU": eu})
+
+        response = client.get("/tickers/US,EU/matrix", params={"start": "2024-01-01"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["symbols"] == ["US", "EU"]
+        assert len(data["dates"]) == 4
+        assert data["values"] == [[1.0, 10.0], [2.0, 10.0], [2.0, 20.0], [3.0, 30.0]]
+
+        data = client.get("/tickers/US,EU/matrix", params={"start": "2024-01-01", "fill": "drop"}).json()
+        assert data["values"] == [[1.0, 10.0], [3.0, 30.0]]
+
+        data = client.get("/tickers/US,EU/matrix", params={"start": "2024-01-01", "fill": "none"}).json()
+        assert data["values"][1] == [2.0, None]
+
+    def test_get_ticker_quote_and_lookup(self, client):
+        """Test des routes quote et lookup via le fournisseur de données configuré"""
+        response = client.get("/tickers/aapl/quote")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["symbol"] == "AAPL"
+        assert data["price"] > 0
+
+        response = client.get("/tickers/AAPL/lookup")
+        assert response.status_code == 200
+        assert response.json()["symbol"] == "AAPL"
+
+    def test_file_provider_replays_recorded_history(self, client, monkeypatch, tmp_path):
+        """Test du rejeu d'un historique enregistré, avec repli sur le fournisseur suivant"""
+        monkeypatch.setattr(price_store, "PRICE_STORE_DIR", str(tmp_path / "store"))
+        ticker_service.frames_cache.clear()
+        (tmp_path / "replay" / "1d").mkdir(parents=True)
+        index = pd.date_range("2024-01-01", periods=5, freq="B", name="Date")
+        pd.DataFrame({"Close": [10.0, 11.0, 12.0, 13.0, 14.0]}, index=index).to_csv(tmp_path / "replay" / "1d" / "REC.csv")
+        monkeypatch.setenv("MARKET_DATA_DIR", str(tmp_path / "replay"))
+        market_data.set_provider(market_data.build_provider("file,synthetic"))
+        try:
+            response = client.get("/tickers/REC,AAPL/", params={"start": "2024-01-01", "format": "columnar"})
+        finally:
+            market_data.set_provider(None)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["REC"]["Close"][:5] == [10.0, 11.0, 12.0, 13.0, 14.0]
+        assert len(data["AAPL"]["Close"]) > 5
+
 
 # =====================================================
 # TESTS D'INTÉGRATION
@@ -1,3 +1,7 @@
+DROP TABLE IF EXISTS idempotency_keys;
+DROP TABLE IF EXISTS corporate_actions_applied;
+DROP TABLE IF EXISTS portfolio_nav_daily;
+DROP TABLE IF EXISTS holdings;
 DROP TABLE IF EXISTS trades;
 DROP TABLE IF EXISTS portfolios;
 DROP TABLE IF EXISTS users;
@@ -15,24 +19,75 @@ CREATE TABLE portfolios (
     user_id INT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
     last_amount NUMERIC(12, 2) NOT NULL,
     initial_amount NUMERIC(12, 2) NOT NULL,
-    positions TEXT,
-    positions_size TEXT,
     portfolio_name TEXT,
     portfolio_date  TIMESTAMP DEFAULT NOW(),
-    cash_balance NUMERIC(12, 2) NOT NULL DEFAULT 0
+    cash_balance NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    ledger_revision INT NOT NULL DEFAULT 0
 );
 
 CREATE TABLE trades (
     trade_id SERIAL PRIMARY KEY, 
     portfolio_id INT NOT NULL REFERENCES portfolios(portfolio_id) ON DELETE CASCADE,
     asset_name TEXT NOT NULL,
-    action VARCHAR(4) NOT NULL CHECK (action IN ('BUY', 'SELL')),
-    price NUMERIC(12, 2) NOT NULL,
-    quantity NUMERIC(12, 2) NOT NULL,
-    trade_date TIMESTAMP DEFAULT NOW(),
+    action VARCHAR(8) NOT NULL CHECK (action IN ('BUY', 'SELL', 'DIVIDEND')),
+    price NUMERIC(18, 6) NOT NULL,
+    quantity NUMERIC(18, 6) NOT NULL,
+    trade_date TIMESTAMP NOT NULL DEFAULT NOW(),
     description TEXT
 );
 
+CREATE TABLE holdings (
+    holding_id SERIAL PRIMARY KEY,
+    portfolio_id INT NOT NULL REFERENCES portfolios(portfolio_id) ON DELETE CASCADE,
+    symbol TEXT NOT NULL,
+    quantity NUMERIC(18, 6) NOT NULL DEFAULT 0,
+    cost_basis NUMERIC(18, 2) NOT NULL DEFAULT 0,
+    CONSTRAINT uq_holdings_portfolio_symbol UNIQUE (portfolio_id, symbol)
+);
+
+CREATE INDEX ix_holdings_symbol ON holdings(symbol);
+
+-- Pagination des trades par clé (trade_date, trade_id), filtres portefeuille / titre
+CREATE INDEX ix_portfolios_user_id ON portfolios(user_id);
+CREATE INDEX ix_trades_portfolio_date ON trades(portfolio_id, trade_date, trade_id);
+CREATE INDEX ix_trades_portfolio_asset_date ON trades(portfolio_id, asset_name, trade_date, trade_id);
+
+-- NAV de clôture par portefeuille, alimentée par le calcul quotidien de l'API
+CREATE TABLE portfolio_nav_daily (
+    portfolio_id INT NOT NULL REFERENCES portfolios(portfolio_id) ON DELETE CASCADE,
+    nav_date DATE NOT NULL,
+    positions_value NUMERIC(14, 2) NOT NULL,
+    cash_value NUMERIC(14, 2) NOT NULL,
+    nav NUMERIC(14, 2) NOT NULL,
+    PRIMARY KEY (portfolio_id, nav_date)
+);
+
+-- Divisions et dividendes déjà appliqués aux trades, holdings et cash d'un portefeuille
+CREATE TABLE corporate_actions_applied (
+    portfolio_id INT NOT NULL REFERENCES portfolios(portfolio_id) ON DELETE CASCADE,
+    symbol TEXT NOT NULL,
+    ex_date DATE NOT NULL,
+    action_type VARCHAR(8) NOT NULL CHECK (action_type IN ('SPLIT', 'DIVIDEND')),
+    value NUMERIC(18, 6) NOT NULL,
+    quantity NUMERIC(18, 6),
+    amount NUMERIC(18, 2),
+    applied_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (portfolio_id, symbol, ex_date, action_type)
+);
+
+-- Réponses des écritures rejouées avec le même en-tête Idempotency-Key (purgées après expiration)
+CREATE TABLE idempotency_keys (
+    user_id INT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    key VARCHAR(255) NOT NULL,
+    endpoint TEXT NOT NULL,
+    fingerprint CHAR(64) NOT NULL,
+    response JSONB,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, key)
+);
+
+CREATE INDEX ix_idempotency_keys_created_at ON idempotency_keys(created_at);
+
 
 -- Users
 COPY users(user_id,first_name, last_name, username, password)
@@ -40,12 +95,42 @@ FROM '/docker-entrypoint-initdb.d/data/users.csv'
 DELIMITER ','
 CSV HEADER;
 
--- Portfolios
-COPY portfolios(portfolio_id,user_id, last_amount, initial_amount, positions, positions_size, portfolio_name, portfolio_date,cash_balance)
+-- Portfolios (le CSV garde l'ancien format positions / positions_size, converti en lignes holdings)
+CREATE TEMP TABLE portfolios_csv (
+    portfolio_id INT,
+    user_id INT,
+    last_amount NUMERIC(12, 2),
+    initial_amount NUMERIC(12, 2),
+    positions TEXT,
+    positions_size TEXT,
+    portfolio_name TEXT,
+    portfolio_date TIMESTAMP,
+    cash_balance NUMERIC(12, 2)
+);
+
+COPY portfolios_csv
 FROM '/docker-entrypoint-initdb.d/data/portfolios.csv'
 DELIMITER ','
 CSV HEADER;
 
+INSERT INTO portfolios(portfolio_id, user_id, last_amount, initial_amount, portfolio_name, portfolio_date, cash_balance)
+SELECT portfolio_id, user_id, last_amount, initial_amount, portfolio_name, portfolio_date, cash_balance
+FROM portfolios_csv;
+
+INSERT INTO holdings(portfolio_id, symbol, quantity)
+SELECT p.portfolio_id, UPPER(TRIM(h.symbol)), SUM(h.quantity::NUMERIC)
+FROM portfolios_csv p
+CROSS JOIN LATERAL unnest(
+    string_to_array(p.positions, ','),
+    string_to_array(p.positions_size, ',')
+) WITH ORDINALITY AS h(symbol, quantity, n)
+WHERE TRIM(h.symbol) <> '' AND h.quantity IS NOT NULL
+GROUP BY p.portfolio_id, UPPER(TRIM(h.symbol))
+HAVING SUM(h.quantity::NUMERIC) <> 0
+ORDER BY p.portfolio_id, MIN(h.n);
+
+DROP TABLE portfolios_csv;
+
 -- Trades
 COPY trades(trade_id,portfolio_id, asset_name, action, price, quantity, trade_date, description)
 FROM '/docker-entrypoint-initdb.d/data/trades.csv'
@@ -54,4 +139,4 @@ CSV HEADER;
 
 SELECT setval('users_user_id_seq', (SELECT MAX(user_id)+1 FROM users));
 SELECT setval('portfolios_portfolio_id_seq', (SELECT MAX(portfolio_id)+1 FROM portfolios));
-SELECT setval('trades_trade_id_seq', (SELECT MAX(trade_id)+1 FROM trades));
\ No newline at end of file
+SELECT setval('trades_trade_id_seq', (SELECT MAX(trade_id)+1 FROM trades));
@@ -5,6 +5,7 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 API_URL = "http://api:5001/tickers"  # à adapter si ton backend tourne sur un autre port
+MAX_POINTS = 1500  # au-delà, l'API sous-échantillonne la courbe (LTTB)
 
 def create_bourse():
     layout = html.Div([
@@ -100,9 +101,9 @@ def update_graph(n_clicks, ticker, period):
     try:
         # Requête à ton API
         if start_date:
-            response = requests.get(f"{API_URL}/{ticker.strip().upper()}/?interval={interval}&start={start_date.strftime('%Y-%m-%d')}")
+            response = requests.get(f"{API_URL}/{ticker.strip().upper()}/?interval={interval}&start={start_date.strftime('%Y-%m-%d')}&max_points={MAX_POINTS}")
         else:
-            response = requests.get(f"{API_URL}/{ticker.strip().upper()}/?period=max")
+            response = requests.get(f"{API_URL}/{ticker.strip().upper()}/?period=max&max_points={MAX_POINTS}")
         if response.status_code != 200:
             return go.Figure(), f"Erreur API ({response.status_code}) : {response.text}"
 
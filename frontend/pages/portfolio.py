@@ -2,19 +2,16 @@
 from dash import html, callback, Output, Input, ALL, State, no_update, dcc
 import requests
 import dash_bootstrap_components as dbc
-import json
-import yfinance as yf
-import pandas as pd
 import plotly.graph_objs as go
 from pages.trades import create_trades
-from datetime import datetime
+from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 
 def ticker_exists(ticker: str) -> bool:
     try:
-        data = yf.Ticker(ticker).history(period="1d")
-        return not data.empty
-    except Exception:
+        response = requests.get(f"http://api:5001/tickers/{ticker.strip().upper()}/lookup", timeout=10)
+        return response.status_code == 200
+    except requests.exceptions.RequestException:
         return False
 
 # -------------------------------
@@ -46,29 +43,69 @@ def create_portfolio():
         ]
     )
 
+def get_valuation(portfolio_id, user_data, params):
+    """Série de valeur du portefeuille calculée par l'API (dates, valeur des positions, valeur totale)."""
+    token = user_data["access_token"]
+    token_type = user_data.get("token_type", "bearer")
+    headers = {
+        "Authorization": f"{token_type.capitalize()} {token}"
+    }
+    try:
+        response = requests.get(f"http://api:5001/portfolios/{portfolio_id}/valuation", headers=headers, params=params, timeout=10)
+        if response.status_code == 200:
+            return response.json()
+    except requests.exceptions.RequestException:
+        pass
+    return {"dates": [], "positions_value": [], "total_value": []}
+
+def get_history(portfolio_id, user_data, start_date):
+    """NAV de clôture enregistrées par l'API (lecture directe, sans recalcul)."""
+    token = user_data["access_token"]
+    token_type = user_data.get("token_type", "bearer")
+    headers = {
+        "Authorization": f"{token_type.capitalize()} {token}"
+    }
+    try:
+        response = requests.get(f"http://api:5001/portfolios/{portfolio_id}/history", headers=headers, params={"start": start_date}, timeout=10)
+        if response.status_code == 200:
+            history = response.json()
+            return {"dates": history["dates"], "total_value": history["nav"]}
+    except requests.exceptions.RequestException:
+        pass
+    return {"dates": [], "total_value": []}
+
+def get_long_history(portfolio_id, user_data, start_date, interval):
+    """
+    Historique long : snapshots journaliers, complétés par la valorisation de l'API
+    quand ils commencent après `start_date` (les NAV ne remontent que sur
+    NAV_BACKFILL_DAYS jours).
+    """
+    while start_date.weekday() >= 5:
+        start_date += timedelta(days=1)
+    start = start_date.strftime('%Y-%m-%d')
+    history = get_history(portfolio_id, user_data, start)
+    if history["dates"] and history["dates"][0] <= start:
+        return history
+    valuation = get_valuation(portfolio_id, user_data, {"interval": interval, "start": start})
+    if not history["dates"]:
+        return valuation
+    head = [(d, v) for d, v in zip(valuation["dates"], valuation["total_value"]) if d[:10] < history["dates"][0]]
+    return {
+        "dates": [d for d, _ in head] + history["dates"],
+        "total_value": [v for _, v in head] + history["total_value"],
+    }
+
 def create_portfolio_output(data,portfolio_id,user_data):
-    API_URL="http://api:5001/tickers"
     last_amount = data.get("last_amount", "N/A")
     initial_amount = data.get("initial_amount", "N/A")
     cash= data.get("cash_balance", 0)
-    tickers = data.get("positions", "").lower()
-    tickers_list = tickers.split(",")
-    positions_size = data.get("positions_size","").split(",")
-    portfolio_dict=dict(zip(tickers_list, positions_size))
-    response=requests.get(f"{API_URL}/{tickers.strip().upper()}")
-    response=response.json()
-    dates=[line['Date'] for line in response[next(iter(response))]]
-    prices=[]
-    for ticker, rows in response.items():
-        ticker=ticker.lower()
-        df = pd.DataFrame(rows)
-        dates=df['Date'].to_list()
-        df=df['Close']
-        df=df*int(portfolio_dict.get(ticker,portfolio_dict.get(ticker.upper(),1)))
-        prices = [round(a + b, 2) for a, b in zip(prices, df.tolist())] if not prices == [] else df.tolist()
+    portfolio_dict={h["symbol"].lower(): f"{h['quantity']:g}" for h in data.get("holdings", [])}
+    valuation = get_valuation(portfolio_id, user_data, {"period": "5d"})
+    dates = valuation["dates"]
+    prices = valuation["positions_value"]
 
     fig = go.Figure(data=[
-            go.Scatter(x=dates, y=prices, mode='lines', name="Evolution du portefeuille")
+            go.Scatter(x=dates, y=valuation["total_value"], mode='lines', name="Evolution du portefeuille")
         ])
     fig.update_layout(
         title=f"Évolution du portefeuille",
@@ -79,20 +116,8 @@ def create_portfolio_output(data,portfolio_id,user_data):
         font=dict(color='white')
     )
     if prices:
+        # affichage seulement : last_amount est mis à jour par le calcul quotidien des NAV
         last_amount=prices[-1]
-        API_URL_portfolios=f"http://api:5001/portfolios/{portfolio_id}"
-        token = user_data["access_token"]
-        token_type = user_data.get("token_type", "bearer")
-        headers = {
-            "Authorization": f"{token_type.capitalize()} {token}"
-        }
-        playload = {
-            "last_amount": last_amount
-        }
-        try:
-            response = requests.put(API_URL_portfolios, headers=headers, json=playload, timeout=5)
-        except requests.exceptions.RequestException:
-            pass
     last_amount=round(last_amount,2)
     evolution= (last_amount + cash - initial_amount) / initial_amount * 100 if initial_amount !=0 else 0
     sign="+" if evolution >=0 else ""
@@ -158,11 +183,6 @@ def update_portfolio_graph(period, portfolio_id, user_data):
         if not data:
             return no_update
         data=data[0]
-        API_URL="http://api:5001/tickers"
-        tickers = data.get("positions", "").upper()
-        tickers_list = tickers.split(",")
-        positions_size = data.get("positions_size","").split(",")
-        portfolio_dict=dict(zip(tickers_list, positions_size))
 
         today = datetime.today()
         label = period
@@ -190,25 +210,22 @@ def update_portfolio_graph(period, portfolio_id, user_data):
             interval = "1d"
         elif label == "1y":
             # minimum interval = 1d
-            start_date = data.get("portfolio_date", today - relativedelta(years=1))
+            start_date = data.get("portfolio_date") or today - relativedelta(years=1)
+            if isinstance(start_date, str):
+                start_date = datetime.fromisoformat(start_date[:10])
             interval = "1d"
         elif label == "max":
             # minimum interval = 1d
             start_date = today - relativedelta(years=10)
             interval = "1d"
-        response=requests.get(f"{API_URL}/{tickers.strip().upper()}/?interval={interval}&start={start_date.strftime('%Y-%m-%d')}")
-        response=response.json()
-        dates=[line['Date'] for line in response[next(iter(response))]]
-        prices=[]
-        for ticker, rows in response.items():
-            df = pd.DataFrame(rows)
-            dates=df['Date'].to_list()
-            df=df['Close']
-            df=df*int(portfolio_dict[ticker])
-            prices=prices+df.tolist()
+        if label in ("1y", "max"):
+            # historiques longs : snapshots journaliers, recalcul seulement de ce qui manque
+            valuation = get_long_history(portfolio_id, user_data, start_date, interval)
+        else:
+            valuation = get_valuation(portfolio_id, user_data, {"interval": interval, "start": start_date.strftime('%Y-%m-%d')})
 
         fig = go.Figure(data=[
-                go.Scatter(x=dates, y=prices, mode='lines', name="Evolution du portefeuille")
+                go.Scatter(x=valuation["dates"], y=valuation["total_value"], mode='lines', name="Evolution du portefeuille")
             ])
         fig.update_layout(
             title=f"Évolution du portefeuille",
@@ -404,14 +421,12 @@ def submit_portfolio(n_clicks, initial_amount, tickers, sizes, cash_balance, por
     for ticker in tickers:
         if not ticker_exists(ticker):
             return f"Le ticker '{ticker}' n'existe pas. Veuillez vérifier et réessayer.\n Il faut insérer le ticker de l'action et non le nom de l'entreprise."
-    positions = json.dumps(tickers).replace('"', '').replace('[', '').replace(']', '')
-    positions_size = json.dumps(sizes).replace('"', '').replace('[', '').replace(']', '')
+    holdings = [{"symbol": ticker.upper(), "quantity": size} for ticker, size in zip(tickers, sizes) if ticker and size]
 
     payload = {
         "last_amount": initial_amount,
         "initial_amount": initial_amount,
-        "positions": positions.upper(),
-        "positions_size": positions_size,
+        "holdings": holdings,
         "portfolio_name": portfolio_name,
         "cash_balance": cash_balance if cash_balance > 0 else 0
     }